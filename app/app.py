@@ -1,15 +1,30 @@
 from fastapi import FastAPI
 import psutil
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi import HTTPException, Request
+import orjson
 import os
+import time
 
 from src.status import Status
-from src import utils
-from src.main import main as scraper_main
+from src import utils, metrics, tracing, monitor
+from src.append_to_db import get_post_info
 import asyncio
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+# 爬蟲 (src.main) 跟 markdown (src.render) 會拉進 bs4 / markdownify / pydantic，用到的時候才 import
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 直接 `uvicorn app.app:app` 啟動時也要有 logging / 資料夾
+    utils.init_runtime()
+    # event loop lag / slow callback 監控
+    monitor.MONITOR.start()
+    yield
+    monitor.MONITOR.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files
 static_dir = os.path.join(os.path.dirname(__file__), "static")
@@ -19,67 +34,196 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 async def read_root():
     return FileResponse(os.path.join(static_dir, 'index.html'))
 
-@app.get('/api/status')
-async def get_status(page: int = 1, limit: int = 20, q: str = ''):
-    # Filter scrapers
-    filtered_items = []
-    q = q.lower().strip()
-    
-    # Create list of matching items first
-    for bsn, status in Status.scrapers_status.items():
-        # Ensure status is a dict
-        if not isinstance(status, dict):
-            continue
-            
-        title = status.get('theme_title', '')
-        if not q or q in str(bsn).lower() or q in title.lower():
-            filtered_items.append((bsn, status))
-
-    # Sort by BSN
-    filtered_items.sort(key=lambda x: x[0]) 
-    
-    # Calculate active scrapers count (before pagination)
-    active_scrapers_count = sum(
-        1 for _, status in filtered_items 
-        if isinstance(status, dict) and status.get('post_status') != 'none'
-    )
-    
-    # Pagination
-    total_filtered = len(filtered_items)
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_items = filtered_items[start:end]
-    
-    # Convert back to dict for response
-    paginated_scrapers = dict(paginated_items)
-    
-    # Get System Metrics
+_system_metrics_cache: tuple[float, dict] = (0.0, {})
+
+def _system_metrics() -> dict:
+    # 多個分頁 / SSE 共用，1 秒內只算一次
+    global _system_metrics_cache
+    now = time.monotonic()
+    if now - _system_metrics_cache[0] < 1:
+        return _system_metrics_cache[1]
+
     cpu_usage = psutil.cpu_percent(interval=None)
     mem = psutil.virtual_memory()
+    result = {
+        "cpu_usage": cpu_usage,
+        "memory_usage": mem.percent,
+        "memory_total": mem.total,
+        "memory_available": mem.available,
+        "memory_used": mem.used
+    }
+    _system_metrics_cache = (now, result)
+    return result
 
+def _global_status() -> dict:
     return {
+        "version": Status.version,
         "curr_status": Status.curr_status,
-        "scrapers_status": paginated_scrapers,
         "page_count": Status.page_count,
         "tasks_count": len(Status.tasks),
         "total_scrapers_count": len(Status.scrapers_status),
+        "active_scrapers_count": Status.active_count,
+        "system_metrics": _system_metrics(),
+    }
+
+@app.get('/api/status')
+async def get_status(page: int = 1, limit: int = 20, q: str = ''):
+    # 排序 / 計數都在 Status 裡維護好了，這裡只取出這一頁
+    paginated_items, total_filtered, active_scrapers_count = Status.query(page, limit, q)
+
+    return {
+        **_global_status(),
+        "scrapers_status": {bsn: state.to_dict() for bsn, state in paginated_items},
         "active_scrapers_count": active_scrapers_count,
         "filtered_count": total_filtered,
         "page": page,
         "limit": limit,
-        "system_metrics": {
-            "cpu_usage": cpu_usage,
-            "memory_usage": mem.percent,
-            "memory_total": mem.total,
-            "memory_available": mem.available,
-            "memory_used": mem.used
-        }
     }
 
+@app.get('/api/status/stream')
+async def stream_status(request: Request, since: int = 0, interval: float = 1.0):
+    '''
+    Server-Sent Events，只推有變動的看板
+    每則 data: {...全域狀態, "changed": {bsn: status}, "resync": bool}
+    resync 為 true 代表 since 太舊，前端要重新抓一次 /api/status
+    '''
+    interval = max(interval, 0.2)
+
+    async def events():
+        version = since
+        while not await request.is_disconnected():
+            await Status.wait_for_change(version, timeout=15)
+            if Status.version == version:
+                yield b': keep-alive\n\n'
+                continue
+
+            changes = Status.changes_since(version)
+            payload = _global_status()
+            if changes is None:
+                payload.update(changed={}, resync=True)
+            else:
+                payload.update(changed={bsn: state.to_dict() for bsn, state in changes[0].items()}, resync=False)
+            version = payload['version']
+
+            yield b'data: ' + orjson.dumps(payload) + b'\n\n'
+            # 一段時間內的變動合併成一則
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.post('/api/refresh')
 async def refresh_scraper():
     if utils.TOP_SCRAPE_TASK and not utils.TOP_SCRAPE_TASK.done():
         return {"status": "error", "message": "Scraper is already running"}
     
+    from src.main import main as scraper_main
     utils.TOP_SCRAPE_TASK = asyncio.create_task(scraper_main())
     return {"status": "success", "message": "Scraper started"}
+
+@app.get('/api/post')
+async def get_post(url: str):
+    data = await get_post_info(url)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    # CONTENT_MODE=html 存的是 HTML，讀的時候才轉 markdown (有快取)
+    from src.render import render_floors
+    floors = await asyncio.to_thread(render_floors, orjson.loads(data['floors']))
+    return {
+        "title": data['title'],
+        "url": url,
+        "floors": floors,
+    }
+
+@app.post('/api/export/parquet')
+async def export_parquet(full: bool = False):
+    # 增量匯出 (只重寫有變動的分區)，見 src/parquet_export.py
+    from src import parquet_export
+    if parquet_export.pa is None:
+        raise HTTPException(status_code=503, detail="pyarrow is not installed")
+    return await parquet_export.export_parquet(full)
+
+@app.get('/api/stats')
+async def get_stats(days: int = 7, bsn: int | None = None, sort: str = 'comments', limit: int = 20):
+    # 預先算好的看板 / 每日統計 (寫入時更新)，見 src/append_to_db/stats.py
+    from src.append_to_db import stats
+    if not stats.STATS:
+        raise HTTPException(status_code=503, detail="stats are disabled (STATS=0)")
+    if days < 1 or not 1 <= limit <= 200:
+        raise HTTPException(status_code=400, detail="days must be >= 1 and limit between 1 and 200")
+    try:
+        return await stats.query_stats(days, bsn, sort, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get('/api/media')
+async def get_media_stats():
+    # 頭貼 / 圖片快取的去重比例跟省下的流量 (MEDIA_CACHE=1)，見 src/media.py
+    from src import media
+    return await media.media_stats()
+
+@app.get('/metrics')
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+@app.get('/api/trace')
+async def get_trace():
+    # chrome://tracing 或 ui.perfetto.dev 打開
+    return Response(
+        orjson.dumps(tracing.to_chrome_trace()),
+        media_type='application/json',
+        headers={'Content-Disposition': 'attachment; filename="baha-trace.json"'},
+    )
+
+# 沒有驗證的 debug API，參數都要有上下限 (取樣太密 / frames 太多會拖慢整個爬蟲)
+PROFILE_INTERVAL_RANGE = (0.001, 1.0)
+TRACEMALLOC_MAX_FRAMES = 50
+MEMORY_REPORT_MAX_LIMIT = 200
+_memory_report_lock = asyncio.Lock() # 一次掃一遍就好
+
+@app.post('/api/profile/start')
+async def start_profile(interval: float = 0.005):
+    low, high = PROFILE_INTERVAL_RANGE
+    if not low <= interval <= high:
+        raise HTTPException(status_code=400, detail=f"interval must be between {low} and {high} seconds")
+    if tracing.PROFILER.running:
+        return {"status": "error", "message": "Profiler is already running"}
+    # 在 event loop 的 thread 上呼叫，所以取樣的就是 event loop
+    tracing.PROFILER.start(interval)
+    return {"status": "success", "message": f"Profiler started (interval {interval}s)"}
+
+@app.post('/api/profile/stop')
+async def stop_profile():
+    # folded stacks，可以丟給 flamegraph.pl 或 speedscope
+    folded = await asyncio.to_thread(tracing.PROFILER.stop)
+    return PlainTextResponse(folded)
+
+@app.get('/api/debug/loop')
+async def debug_loop(window: float = 60):
+    return monitor.MONITOR.report(window)
+
+@app.get('/api/debug/tasks')
+async def debug_tasks():
+    return monitor.task_summary()
+
+@app.post('/api/debug/tracemalloc/start')
+async def start_tracemalloc(frames: int = 10):
+    if not 1 <= frames <= TRACEMALLOC_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"frames must be between 1 and {TRACEMALLOC_MAX_FRAMES}")
+    monitor.start_tracemalloc(frames)
+    return {"status": "success", "message": f"tracemalloc started ({frames} frames)"}
+
+@app.post('/api/debug/tracemalloc/stop')
+async def stop_tracemalloc():
+    monitor.stop_tracemalloc()
+    return {"status": "success", "message": "tracemalloc stopped"}
+
+@app.get('/api/debug/memory')
+async def debug_memory(limit: int = 20, reset_baseline: bool = False):
+    # 第一次呼叫會存成 baseline，之後的 diff 都是跟 baseline 比
+    if not 1 <= limit <= MEMORY_REPORT_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MEMORY_REPORT_MAX_LIMIT}")
+    if _memory_report_lock.locked():
+        raise HTTPException(status_code=409, detail="a memory report is already running")
+    async with _memory_report_lock:
+        return await asyncio.to_thread(monitor.memory_report, limit, reset_baseline)
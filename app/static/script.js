@@ -46,6 +46,73 @@ document.addEventListener('DOMContentLoaded', () => {
         return 'var(--text-secondary)';
     }
 
+    function renderGlobal(data) {
+        globalStatusEl.textContent = data.curr_status;
+        globalStatusEl.style.color = getStatusColor(data.curr_status);
+        globalStatusEl.style.borderColor = getStatusColor(data.curr_status);
+
+        pageCountEl.textContent = data.page_count;
+        totalScrapersEl.textContent = data.total_scrapers_count;
+        tasksCountEl.textContent = data.tasks_count;
+        cpuUsageEl.innerHTML = `
+            <div class="metric-value-group">
+                <span class="metric-primary">${data.system_metrics.cpu_usage}%</span>
+            </div>`;
+
+        const mem = data.system_metrics;
+        memUsageEl.innerHTML = `
+            <div class="metric-value-group">
+                <span class="metric-primary">${mem.memory_usage}%</span>
+                <span class="metric-secondary">${formatBytes(mem.memory_used)} / ${formatBytes(mem.memory_total)}</span>
+            </div>`;
+        lastUpdatedEl.textContent = new Date().toLocaleTimeString();
+    }
+
+    function renderCard(bsn, status) {
+        const card = document.createElement('div');
+        card.className = `scraper-card status-${status.post_list_status.toLowerCase()}`;
+
+        const mainStatus = status.post_status || status.post_list_status;
+        const statusColor = getStatusColor(mainStatus);
+        const title = status.theme_title || bsn;
+
+        card.innerHTML = `
+            <div class="scraper-header">
+                <div class="scraper-name" title="${bsn}">${title}</div>
+                <div class="scraper-status-pill" style="color: ${statusColor}; border: 1px solid ${statusColor}">${mainStatus}</div>
+            </div>
+            <div class="scraper-details">
+                <div class="detail-item">
+                    <span>BSN</span>
+                    <span>${bsn}</span>
+                </div>
+                <div class="detail-item">
+                    <span>Post Status</span>
+                    <span>${status.post_status}</span>
+                </div>
+                <div class="detail-item">
+                    <span>List Status</span>
+                    <span>${status.post_list_status}</span>
+                </div>
+                <div class="detail-item">
+                    <span>Start Time</span>
+                    <span>${formatDate(status.start_time)}</span>
+                </div>
+                <div class="detail-item">
+                    <span>End Time</span>
+                    <span>${formatDate(status.end_time)}</span>
+                </div>
+            </div>
+        `;
+        return card;
+    }
+
+    // State for the SSE stream
+    let cards = new Map(); // bsn -> card element on the current page
+    let totalScrapers = 0;
+    let eventSource = null;
+    let refetchTimer = null;
+
     async function fetchStatus() {
         try {
             const queryParams = new URLSearchParams({
@@ -57,66 +124,17 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = await response.json();
 
             // Update Global Metrics
-            globalStatusEl.textContent = data.curr_status;
-            globalStatusEl.style.color = getStatusColor(data.curr_status);
-            globalStatusEl.style.borderColor = getStatusColor(data.curr_status);
-
-            pageCountEl.textContent = data.page_count;
+            renderGlobal(data);
             activeScrapersEl.textContent = data.active_scrapers_count;
-            totalScrapersEl.textContent = data.total_scrapers_count;
-            tasksCountEl.textContent = data.tasks_count;
-            cpuUsageEl.innerHTML = `
-                <div class="metric-value-group">
-                    <span class="metric-primary">${data.system_metrics.cpu_usage}%</span>
-                </div>`;
-
-            const mem = data.system_metrics;
-            memUsageEl.innerHTML = `
-                <div class="metric-value-group">
-                    <span class="metric-primary">${mem.memory_usage}%</span>
-                    <span class="metric-secondary">${formatBytes(mem.memory_used)} / ${formatBytes(mem.memory_total)}</span>
-                </div>`;
-            lastUpdatedEl.textContent = new Date().toLocaleTimeString();
+            totalScrapers = data.total_scrapers_count;
 
             // Update Scrapers List
             scrapersContainer.innerHTML = '';
+            cards = new Map();
 
             Object.entries(data.scrapers_status).forEach(([bsn, status]) => {
-                const card = document.createElement('div');
-                card.className = `scraper-card status-${status.post_list_status.toLowerCase()}`;
-
-                const mainStatus = status.post_status || status.post_list_status;
-                const statusColor = getStatusColor(mainStatus);
-                const title = status.theme_title || bsn;
-
-                card.innerHTML = `
-                    <div class="scraper-header">
-                        <div class="scraper-name" title="${bsn}">${title}</div>
-                        <div class="scraper-status-pill" style="color: ${statusColor}; border: 1px solid ${statusColor}">${mainStatus}</div>
-                    </div>
-                    <div class="scraper-details">
-                        <div class="detail-item">
-                            <span>BSN</span>
-                            <span>${bsn}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Post Status</span>
-                            <span>${status.post_status}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>List Status</span>
-                            <span>${status.post_list_status}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Start Time</span>
-                            <span>${formatDate(status.start_time)}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>End Time</span>
-                            <span>${formatDate(status.end_time)}</span>
-                        </div>
-                    </div>
-                `;
+                const card = renderCard(bsn, status);
+                cards.set(bsn, card);
                 scrapersContainer.appendChild(card);
             });
 
@@ -128,13 +146,60 @@ document.addEventListener('DOMContentLoaded', () => {
             prevBtn.disabled = currentPage <= 1;
             nextBtn.disabled = currentPage >= totalPages;
 
+            connectStream(data.version);
+
         } catch (error) {
             console.error('Error fetching status:', error);
             globalStatusEl.textContent = 'Connection Error';
             globalStatusEl.style.color = 'var(--error-color)';
+            scheduleFetch(2000);
         }
     }
 
+    function scheduleFetch(delay = 300) {
+        clearTimeout(refetchTimer);
+        refetchTimer = setTimeout(fetchStatus, delay);
+    }
+
+    function connectStream(version) {
+        if (eventSource) eventSource.close();
+
+        // Server pushes only the boards that changed since `version`
+        eventSource = new EventSource(`/api/status/stream?since=${version}`);
+
+        eventSource.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            renderGlobal(data);
+
+            // New boards change pagination, and a search needs its own filtered counts
+            const needsRefetch = data.resync
+                || data.total_scrapers_count !== totalScrapers
+                || (searchQuery && Object.keys(data.changed).length > 0);
+            if (needsRefetch) {
+                eventSource.close();
+                scheduleFetch();
+                return;
+            }
+
+            if (!searchQuery) activeScrapersEl.textContent = data.active_scrapers_count;
+            Object.entries(data.changed).forEach(([bsn, status]) => {
+                const oldCard = cards.get(bsn);
+                if (!oldCard) return; // not on this page
+                const card = renderCard(bsn, status);
+                oldCard.replaceWith(card);
+                cards.set(bsn, card);
+            });
+        };
+
+        eventSource.onerror = () => {
+            // The `since` in the URL would be stale after a reconnect, so resync first
+            eventSource.close();
+            globalStatusEl.textContent = 'Connection Error';
+            globalStatusEl.style.color = 'var(--error-color)';
+            scheduleFetch(2000);
+        };
+    }
+
     // Event Listeners
     searchInput.addEventListener('input', (e) => {
         clearTimeout(debounceTimer);
@@ -184,9 +249,6 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // Initial fetch
+    // Initial fetch, then live updates over SSE (see connectStream)
     fetchStatus();
-
-    // Poll every 2 seconds
-    setInterval(fetchStatus, 2000);
 });
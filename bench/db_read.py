@@ -0,0 +1,79 @@
+'''
+唯讀連線池的讀取吞吐量 (get_post_info / 秒)，DB_READERS=1 約等於之前所有人共用一條連線
+
+同時會有一個 writer 一直寫 post_info，模擬爬蟲在跑的時候 API / 快取查詢的情況
+
+    python -m bench.db_read [posts] [seconds]
+'''
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import orjson
+
+from src.append_to_db import client
+from src.append_to_db import init_tables, get_client, close_client, add_to_post_info, get_post_info
+
+
+def _floors(i: int) -> str:
+    return orjson.dumps([
+        {'index': n, 'content': f'第 {n} 樓 ' + '內文' * 200, 'like_count': n, 'comments': []}
+        for n in range(1, 6)
+    ]).decode()
+
+
+async def seed(posts: int) -> list[str]:
+    await init_tables()
+    db = await get_client()
+    urls = [f'https://forum.gamer.com.tw/C.php?bsn=1&snA={i}' for i in range(posts)]
+    await db.executemany(
+        'INSERT INTO post_info (url, title, floors) VALUES (?, ?, ?)',
+        [(url, f'標題 {i}', _floors(i)) for i, url in enumerate(urls)],
+    )
+    await db.commit()
+    return urls
+
+
+async def run(urls: list[str], readers: int, seconds: float) -> float:
+    client.DB_READERS = readers
+    await close_client() # 重開連線池
+    stop = time.perf_counter() + seconds
+    count = 0
+
+    async def reader():
+        nonlocal count
+        while time.perf_counter() < stop:
+            await get_post_info(random.choice(urls))
+            count += 1
+
+    async def writer():
+        i = 0
+        while time.perf_counter() < stop:
+            await add_to_post_info(random.choice(urls), f'更新 {i}', _floors(i))
+            i += 1
+
+    await asyncio.gather(writer(), *(reader() for _ in range(readers * 4)))
+    return count / seconds
+
+
+async def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client.DB_PATH = os.path.join(tmp, 'bench.db')
+        urls = await seed(posts)
+        print(f'posts={posts} seconds={seconds}')
+        base = None
+        for readers in (1, 2, 4, 8):
+            rate = await run(urls, readers, seconds)
+            base = base or rate
+            print(f'DB_READERS={readers}: {rate:,.0f} reads/s ({rate / base:.1f}x)')
+        await close_client()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
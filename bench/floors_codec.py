@@ -0,0 +1,112 @@
+'''
+post_info.floors 存純文字 vs zstd vs zstd + 自己訓練的字典 (FLOORS_CODEC，見 src/append_to_db/codec.py)
+
+每種模式一個新的 DB: 先寫 train 篇 (字典模式會拿這些訓練，再用 migrate 重壓)，
+再量寫入剩下的貼文的速度 (add_to_post_info)、VACUUM 後的檔案大小、快取讀取 (get_post_info) 的時間
+
+    python -m bench.floors_codec [posts] [train]
+'''
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+import orjson
+
+from bench.parquet_export import _floors
+from src.append_to_db import client, codec, func
+from src.append_to_db import init_tables, get_client, close_client, add_to_post_info, get_post_info
+from src.records import jsonl_line
+
+READS = 5000
+# 內文跟留言用 3000 個中文字亂數組 (不然一直重複同一句，壓縮率會好得不像真的)，字頻大概照 Zipf
+CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(CHARS))))
+
+
+def _text(length: int) -> str:
+    words = []
+    while sum(map(len, words)) < length:
+        words.append(''.join(random.choices(CHARS, cum_weights=CUM_WEIGHTS, k=random.randint(2, 12))) + random.choice('，。！？'))
+    return ''.join(words)
+
+
+def posts(count: int) -> list[tuple[str, str, str]]:
+    random.seed(0)
+    result = []
+    for snA in range(count):
+        url = f'https://forum.gamer.com.tw/C.php?bsn={snA % 20 + 1}&snA={snA}'
+        floors = _floors(snA, snA % 6 + 1)
+        # 長短不一 (一樓就結束的很多)
+        floors = floors[:random.choice((1, 1, 2, 3, 8))]
+        for floor in floors:
+            floor['content'] = _text(random.randint(20, 400))
+            for comment in floor['comments']:
+                comment['comment_text'] = _text(random.randint(4, 40))
+        result.append((url, f'標題 {snA}', orjson.dumps(floors).decode()))
+    return result
+
+
+async def run(mode: str, data: list[tuple[str, str, str]], train: int) -> tuple[float, float, int, float]:
+    codec.FLOORS_CODEC = 'text' if mode == 'text' else 'zstd'
+    codec._CODECS.clear()
+    codec._CURRENT = None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client.DB_PATH = os.path.join(tmp, 'bench.db')
+        await init_tables()
+        for url, title, floors in data[:train]:
+            await add_to_post_info(url, title, floors)
+
+        migrate_rate = 0.0
+        if mode == 'zstd+dict':
+            start = time.perf_counter()
+            count = await codec.migrate(pause=0) # 會先訓練字典
+            migrate_rate = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for url, title, floors in data[train:]:
+            await add_to_post_info(url, title, floors)
+        write_rate = (len(data) - train) / (time.perf_counter() - start)
+
+        db = await get_client()
+        await db.execute("VACUUM")
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = os.path.getsize(client.DB_PATH)
+
+        # 快取命中的路徑: 讀出來直接嵌進 JSONL，取三次裡最快的
+        urls = [random.choice(data)[0] for _ in range(READS)]
+        read_us = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            for url in urls:
+                row = await get_post_info(url)
+                jsonl_line(row['title'], url, row['floors'])
+            read_us = min(read_us, (time.perf_counter() - start) / READS * 1e6)
+
+        await close_client()
+    return write_rate, read_us, size, migrate_rate
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    train = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    func.STATS = False # 只量 post_info
+
+    data = posts(count)
+    raw = sum(len(floors.encode()) for _, _, floors in data)
+    print(f'posts={count} train={train} floors JSON={raw / 2**20:.1f} MiB')
+
+    base = None
+    for mode in ('text', 'zstd', 'zstd+dict'):
+        write_rate, read_us, size, migrate_rate = await run(mode, data, train)
+        base = base or size
+        extra = f'  migrate {migrate_rate:,.0f} posts/s' if migrate_rate else ''
+        print(f'{mode:9s} db {size / 2**20:6.1f} MiB ({size / base:4.0%})  write {write_rate:6,.0f} posts/s  read {read_us:5.0f} us{extra}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+'''
+B.php 列表上找到的貼文，每篇佔幾 bytes (之前 vs 現在)
+
+之前: {canonical 網址: PostListing} + 存 all_posts 時再組一份 PostModel 的 list (兩份同時在記憶體)
+現在: PostFrontier (整數 key + array)，存 all_posts 時用 generator 一次一個 tuple
+另外印出跨次執行用的 Bloom filter (SEEN_BLOOM=1) 的大小跟誤判率
+
+    python -m bench.frontier [threads]
+'''
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+from pydantic import BaseModel
+
+from src.frontier import BloomFilter, PostFrontier, pack_key
+from src.records import PostListing
+from src.utils import canonical_post_url
+
+
+class _OldPostModel(BaseModel):
+    bsn: str
+    post_url: str
+    reply_count: int | None = None
+    gp: int | None = None
+    last_reply: str | None = None
+
+
+def sample(threads: int) -> list[tuple[int, int, PostListing | None]]:
+    '''真的列表上大約 8 成的連結有列表資訊 (其他是列表外的連結)'''
+    rng = random.Random(0)
+    result = []
+    for i in range(threads):
+        bsn, snA = rng.randrange(1, 80000), rng.randrange(1, 8_000_000)
+        listing = None
+        if rng.random() < 0.8:
+            listing = PostListing(
+                url=f'C.php?bsn={bsn}&snA={snA}&tnum={i % 500}',
+                reply_count=rng.randrange(0, 500),
+                gp=rng.randrange(0, 1000),
+                last_reply=f'2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d} {rng.randrange(24):02d}:{rng.randrange(60):02d}',
+            )
+        result.append((bsn, snA, listing))
+    return result
+
+
+def old_layout(data):
+    all_urls: dict[str, PostListing | None] = {}
+    for bsn, snA, listing in data:
+        url = canonical_post_url(bsn, snA)
+        if listing is not None:
+            listing = PostListing(url, listing.reply_count, listing.gp, listing.last_reply)
+        all_urls[url] = listing
+    models = [
+        _OldPostModel(bsn=url.split('bsn=')[1].split('&')[0], post_url=url) if row is None else
+        _OldPostModel(bsn=url.split('bsn=')[1].split('&')[0], post_url=url, reply_count=row.reply_count, gp=row.gp, last_reply=row.last_reply)
+        for url, row in all_urls.items()
+    ]
+    return all_urls, models
+
+
+def new_layout(data):
+    frontier = PostFrontier()
+    for bsn, snA, listing in data:
+        frontier.add(pack_key(bsn, snA), listing)
+    # 存 all_posts 的 tuple 是一個一個組的，不會全部留著
+    for _ in frontier.rows('0'):
+        pass
+    return frontier
+
+
+def measure(build, data) -> tuple[float, int, object]:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = perf_counter()
+    result = build(data)
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    data = sample(threads)
+    print(f'threads={threads}')
+
+    for name, build in (('old', old_layout), ('frontier', new_layout)):
+        seconds, peak, result = measure(build, data)
+        extra = f' (arrays {result.nbytes / threads:.1f} B/thread)' if isinstance(result, PostFrontier) else ''
+        print(f'{name:9s} {peak / threads:7.1f} B/thread peak  {peak / 2**20:7.1f} MiB  {seconds:6.2f}s{extra}')
+        del result
+
+    bloom = BloomFilter(threads)
+    for bsn, snA, _ in data:
+        bloom.add(pack_key(bsn, snA))
+    rng = random.Random(1)
+    probes = 100_000
+    false_positive = sum(pack_key(rng.randrange(80000, 160000), rng.randrange(1, 8_000_000)) in bloom for _ in range(probes))
+    print(f'bloom     {len(bloom.to_bytes()) / threads:7.1f} B/thread on disk, false positive {false_positive / probes:.2%}')
+
+
+if __name__ == '__main__':
+    main()
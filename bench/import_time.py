@@ -0,0 +1,65 @@
+'''
+冷啟動的 import 時間，以及 import 完有沒有副作用 (建資料夾、換掉 stdout、設定 logging、開 httpx client)
+
+每次都開新的 python process，在空的暫存資料夾裡 import，取中位數
+
+    python -m bench.import_time [repeat]
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = [
+    'src.status',
+    'src.utils',
+    'src.append_to_db',
+    'app.app',
+    'src.main',
+    'main',
+]
+
+_PROBE = '''
+import json, logging, os, sys, time
+stdout = sys.stdout
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('bs4', 'markdownify', 'pydantic', 'httpx') if m in sys.modules]
+side_effects = []
+if os.listdir('.'):
+    side_effects.append('created ' + ','.join(sorted(os.listdir('.'))))
+if sys.stdout is not stdout:
+    side_effects.append('replaced stdout')
+if logging.getLogger().handlers:
+    side_effects.append('configured logging')
+print(json.dumps({{'elapsed': elapsed, 'heavy': heavy, 'side_effects': side_effects}}), file=sys.__stdout__)
+'''
+
+
+def probe(module: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, 'PYTHONPATH': str(ROOT), 'PYTHONDONTWRITEBYTECODE': '1'}
+        out = subprocess.run(
+            [sys.executable, '-c', _PROBE.format(module=module)],
+            cwd=tmp, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for module in MODULES:
+        results = [probe(module) for _ in range(repeat)]
+        median = statistics.median(r['elapsed'] for r in results) * 1000
+        last = results[-1]
+        print(f'{module:<18} {median:7.1f} ms  heavy={",".join(last["heavy"]) or "-"}  side_effects={"; ".join(last["side_effects"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
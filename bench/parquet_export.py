@@ -0,0 +1,134 @@
+'''
+JSONL (python -m src.export) vs Parquet (python -m src.parquet_export): 檔案大小、匯出時間、讀取時間
+
+讀取的比較:
+- JSONL: 每行 orjson.loads，再攤平成每則留言一列 (分析時通常要這樣做)
+- Parquet: 直接讀 comments 表；只要讚數的話只讀 floors 的 like_count 欄
+
+    python -m bench.parquet_export [posts] [boards]
+'''
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import orjson
+
+from src.append_to_db import client
+from src.append_to_db import init_tables, get_client, close_client
+
+
+def _floors(snA: int, month: int) -> list[dict]:
+    users = [f'user{i}' for i in range(300)]
+    floors = []
+    for idx in range(8):
+        author = random.choice(users)
+        floors.append({
+            'index': idx,
+            'tags': {'閒聊': 'B.php?bsn=1&subbsn=1'} if idx == 0 else {},
+            'author': {'name': f'名字{author}', 'id': author, 'url': f'https://home.gamer.com.tw/{author}'},
+            'time': f'2024-{month:02d}-{idx + 1:02d}T10:00:00+00:00',
+            'content': f'第 {idx} 樓 ' + '這是內文，' * random.randint(10, 80),
+            'like_count': random.randint(0, 500),
+            'dislike_count': random.randint(0, 5),
+            'comments': [
+                {
+                    'avatar_url': f'https://avatar2.bahamut.com.tw/avataruserpic/{user}.png',
+                    'user_url': f'https://home.gamer.com.tw/{user}',
+                    'user_name': f'名字{user}',
+                    'comment_text': '留言' * random.randint(2, 20),
+                    'floor': f'B{c + 1}',
+                    'time': f'2024-{month:02d}-{idx + 1:02d}T12:00:00+00:00',
+                }
+                for c, user in enumerate(random.sample(users, random.randint(0, 15)))
+            ],
+        })
+    return floors
+
+
+async def seed(posts: int, boards: int):
+    await init_tables()
+    db = await get_client()
+    await db.executemany(
+        'INSERT INTO all_themes (bsn, title, page_count) VALUES (?, ?, 1)',
+        [(str(bsn), f'看板 {bsn}') for bsn in range(1, boards + 1)],
+    )
+    rows_posts, rows_info = [], []
+    for snA in range(posts):
+        bsn = snA % boards + 1
+        month = snA % 6 + 1
+        url = f'https://forum.gamer.com.tw/C.php?bsn={bsn}&snA={snA}'
+        floors = _floors(snA, month)
+        rows_posts.append((url, str(bsn)))
+        rows_info.append((url, f'標題 {snA}', orjson.dumps(floors).decode(), floors[0]['time']))
+    await db.executemany('INSERT INTO all_posts (post_url, bsn) VALUES (?, ?)', rows_posts)
+    await db.executemany('INSERT INTO post_info (url, title, floors, post_time) VALUES (?, ?, ?, ?)', rows_info)
+    await db.commit()
+
+
+def _size(path: Path, pattern: str) -> int:
+    return sum(p.stat().st_size for p in path.rglob(pattern))
+
+
+def load_jsonl(data_dir: Path) -> int:
+    rows = 0
+    for path in data_dir.glob('*.jsonl'):
+        with open(path, 'rb') as f:
+            for line in f:
+                post = orjson.loads(line)
+                for floor in post['floors']:
+                    for comment in floor['comments']:
+                        rows += 1
+    return rows
+
+
+def timed(func, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+async def main():
+    import pyarrow.parquet as pq
+    from src.export import export
+    from src.parquet_export import export_parquet
+
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    boards = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp) # src.export 寫到相對路徑 data/
+        data_dir = Path(tmp) / 'data'
+        data_dir.mkdir()
+        client.DB_PATH = str(data_dir / 'db' / 'data.db')
+        await seed(posts, boards)
+
+        start = time.perf_counter()
+        await export()
+        jsonl_export = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await export_parquet(full=True, root=data_dir / 'parquet')
+        parquet_export = time.perf_counter() - start
+        await close_client()
+
+        jsonl_size = _size(data_dir, '*.jsonl')
+        parquet_size = _size(data_dir / 'parquet', '*.parquet')
+        jsonl_load, jsonl_rows = timed(load_jsonl, data_dir)
+        parquet_load, table = timed(pq.read_table, data_dir / 'parquet' / 'comments')
+        column_load, _ = timed(pq.read_table, data_dir / 'parquet' / 'floors', columns=['like_count'])
+        assert table.num_rows == jsonl_rows
+
+        print(f'posts={posts} boards={boards} comments={jsonl_rows}')
+        print(f'size:    JSONL {jsonl_size / 2**20:7.1f} MiB   Parquet {parquet_size / 2**20:7.1f} MiB ({jsonl_size / parquet_size:.1f}x smaller)')
+        print(f'export:  JSONL {jsonl_export:7.2f} s     Parquet {parquet_export:7.2f} s')
+        print(f'load comments:       JSONL {jsonl_load * 1000:7.1f} ms  Parquet {parquet_load * 1000:7.1f} ms ({jsonl_load / parquet_load:.1f}x faster)')
+        print(f'load like_count only:                    Parquet {column_load * 1000:7.1f} ms ({jsonl_load / column_load:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+'''
+解析後的貼文: 巢狀 dict + frozendict 去重 + dumps 兩次 (之前) vs slots dataclass + 只 encode 一次 (現在)
+以及快取命中時: loads + dumps (之前) vs floors 原封不動嵌進 JSONL (現在)
+
+不含 BeautifulSoup 的部分 (兩邊一樣)，只比較組資料 / 序列化
+
+    python -m bench.post_records [floors] [comments_per_floor]
+'''
+import sys
+import time
+import tracemalloc
+
+import orjson
+from frozendict import frozendict
+
+from src.records import Post, Floor, Author, Comment, jsonl_line
+
+POST_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=123456'
+
+
+def _comment_values(floors: int, comments: int):
+    # 每則留言出現兩次 (實際頁面上也會有重複的)
+    return [
+        [
+            (f'https://avatar2.bahamut.com.tw/avataruserpic/u/s/user{c}/user{c}_s.png',
+             f'https://home.gamer.com.tw/user{c}', f'使用者{c}', f'第 {f} 樓的第 {c} 則留言' * 3,
+             f'B{c + 1}', '2024-01-01T10:00:00+00:00')
+            for c in list(range(comments)) * 2
+        ]
+        for f in range(floors)
+    ]
+
+
+def old_record(values) -> dict:
+    result = {'theme_title': '看板', 'title': '標題', 'url': POST_URL, 'floors': []}
+    for idx, floor_comments in enumerate(values):
+        result['floors'].append({'index': idx})
+        result['floors'][idx]['tags'] = {'閒聊': 'B.php?bsn=60076&subbsn=1'}
+        result['floors'][idx]['author'] = {'name': '作者', 'id': 'author', 'url': 'https://home.gamer.com.tw/author'}
+        result['floors'][idx]['time'] = '2024-01-01T10:00:00+00:00'
+        result['floors'][idx]['content'] = '內文 ' * 200
+        result['floors'][idx]['like_count'] = 10
+        result['floors'][idx]['dislike_count'] = 0
+        comments = set()
+        for avatar_url, user_url, user_name, comment_text, floor, time_iso in floor_comments:
+            comments.add(frozendict({
+                'avatar_url': avatar_url, 'user_url': user_url, 'user_name': user_name,
+                'comment_text': comment_text, 'floor': floor, 'time': time_iso,
+            }))
+        comments = list(comments)
+        comments.sort(key=lambda x: int(x['floor'][1:]))
+        result['floors'][idx]['comments'] = comments
+    return result
+
+
+def old_build(values) -> bytes:
+    result = old_record(values)
+    db_value = orjson.dumps(result['floors']).decode()
+    line = orjson.dumps(result) + b'\n'
+    return line if db_value else b''
+
+
+def new_record(values) -> Post:
+    post = Post(theme_title='看板', title='標題', url=POST_URL, floors=[])
+    for idx, floor_comments in enumerate(values):
+        comments = set()
+        for avatar_url, user_url, user_name, comment_text, floor, time_iso in floor_comments:
+            comments.add(Comment(avatar_url, user_url, user_name, comment_text, floor, time_iso))
+        post.floors.append(Floor(
+            idx, {'閒聊': 'B.php?bsn=60076&subbsn=1'},
+            Author('作者', 'author', 'https://home.gamer.com.tw/author'),
+            '2024-01-01T10:00:00+00:00', '內文 ' * 200, 10, 0,
+            sorted(comments, key=lambda x: int(x.floor[1:])),
+        ))
+    return post
+
+
+def new_build(values) -> bytes:
+    post = new_record(values)
+    floors_json = post.encode_floors()
+    db_value = floors_json.decode()
+    line = jsonl_line(post.title, POST_URL, floors_json, post.theme_title)
+    return line if db_value else b''
+
+
+def old_cache_hit(blob: str) -> bytes:
+    floors = orjson.loads(blob)
+    floors[0].get('time')
+    return orjson.dumps({'title': '標題', 'url': POST_URL, 'floors': floors}) + b'\n'
+
+
+def new_cache_hit(blob: str) -> bytes:
+    return jsonl_line('標題', POST_URL, blob)
+
+
+def measure(name: str, func, arg, loops: int):
+    func(arg) # warm up
+    cpu = float('inf')
+    for _ in range(5): # 取最快的一輪，減少雜訊
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(arg)
+        cpu = min(cpu, (time.perf_counter() - start) / loops)
+
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'  {name:<6} {cpu * 1e6:9.1f} us/post   peak {peak / 1024:8.1f} KiB/post')
+    return cpu, peak
+
+
+def retained(func, arg) -> int:
+    tracemalloc.start()
+    kept = func(arg)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def main():
+    floors = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    comments = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    values = _comment_values(floors, comments)
+    assert old_build(values) == new_build(values) # 輸出要一模一樣
+
+    print(f'floors={floors} comments_per_floor={comments} (x2 duplicated)')
+    print('parse -> DB + JSONL')
+    old = measure('before', old_build, values, 100)
+    new = measure('after', new_build, values, 100)
+    print(f'  {old[0] / new[0]:.2f}x faster, {old[1] / new[1]:.2f}x less peak memory')
+    old_size, new_size = retained(old_record, values), retained(new_record, values)
+    print(f'  parsed record kept in memory: {old_size / 1024:.1f} KiB -> {new_size / 1024:.1f} KiB ({old_size / new_size:.2f}x smaller)')
+
+    blob = orjson.loads(old_build(values))['floors']
+    blob = orjson.dumps(blob).decode()
+    assert old_cache_hit(blob) == new_cache_hit(blob)
+    print('cache hit -> JSONL')
+    old = measure('before', old_cache_hit, blob, 2000)
+    new = measure('after', new_cache_hit, blob, 2000)
+    print(f'  {old[0] / new[0]:.2f}x faster, {old[1] / new[1]:.2f}x less peak memory')
+
+
+if __name__ == '__main__':
+    main()
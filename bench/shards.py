@@ -0,0 +1,67 @@
+'''
+一個 data.db vs 依 bsn 分成 DB_SHARDS 個檔 (見 src/append_to_db/client.py)
+
+- 寫入: 20 個看板同時寫 post_info (跟爬蟲一樣每篇各自 commit)，看每秒幾篇
+- 維護: 刪掉一半的貼文後 VACUUM，整個檔一次做 vs 一個 shard 一個 shard 做
+  (VACUUM 的期間那個檔的寫入都要等，所以「最久卡住多久」看的是單一 shard 的時間)
+
+    python -m bench.shards [posts] [shards]
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from bench.floors_codec import posts
+from src.append_to_db import client, maintenance
+from src.append_to_db import init_tables, get_client, close_client, add_to_post_info, shard_of, shard_ids
+
+
+async def run(shards: int, data: list[tuple[str, str, str]]) -> tuple[float, float, float]:
+    by_board = defaultdict(list)
+    for url, title, floors in data:
+        by_board[url.split('bsn=')[1].split('&')[0]].append((url, title, floors))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client.DB_PATH = os.path.join(tmp, 'data.db')
+        client.DB_SHARDS = shards
+        await init_tables()
+
+        async def write(rows):
+            for url, title, floors in rows:
+                await add_to_post_info(url, title, floors)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(write(rows) for rows in by_board.values()))
+        write_rate = len(data) / (time.perf_counter() - start)
+
+        for bsn in by_board:
+            db = await get_client(shard_of(bsn))
+            await db.execute("DELETE FROM post_info WHERE url LIKE ? AND rowid % 2 = 0", (f'%bsn={bsn}&%',))
+            await db.commit()
+
+        seconds = []
+        for shard in shard_ids():
+            result = await maintenance.run('compact', shard)
+            seconds.append(result['seconds'])
+
+        await close_client()
+    return write_rate, sum(seconds), max(seconds)
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    data = posts(count)
+    print(f'posts={count} boards=20')
+
+    for n in (0, shards):
+        write_rate, total, longest = await run(n, data)
+        name = 'one file' if n == 0 else f'{n} shards'
+        print(f'{name:9s} write {write_rate:6,.0f} posts/s  compact total {total:5.2f}s  longest stall {longest:5.2f}s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
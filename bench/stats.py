@@ -0,0 +1,89 @@
+'''
+/api/stats: 預先算好的 board_daily_stats vs 每次都掃 post_info 解開 floors 重算
+
+- scan: 每次查詢都把 post_info 全部讀出來 orjson.loads，再用 set 算不重複留言者 (沒有統計表的話只能這樣)
+- query_stats: 讀 board_daily_stats，不重複留言者用 HyperLogLog 合併
+- rebuild: python -m src.append_to_db.stats 全部重算，numpy 向量化 vs 純 Python
+
+    python -m bench.stats [posts] [boards]
+'''
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import orjson
+
+from bench.parquet_export import seed
+from src.append_to_db import client, stats
+from src.append_to_db import get_reader, close_client
+from src.append_to_db.codec import unpack_floors
+from src.append_to_db.normalized import user_id_from_url
+from src.utils import post_key
+
+DAYS = 10000 # 假資料是 2024 年的，全部都要算進去
+
+
+async def scan() -> dict[int, tuple[int, int]]:
+    '''{bsn: (留言數, 不重複留言者)}'''
+    comments: dict[int, int] = defaultdict(int)
+    users: dict[int, set[str]] = defaultdict(set)
+    async with get_reader() as db:
+        cursor = await db.execute("SELECT url, floors FROM post_info")
+        for url, floors in await cursor.fetchall():
+            bsn = post_key(url)[0]
+            for floor in orjson.loads(await unpack_floors(floors)):
+                for comment in floor['comments']:
+                    comments[bsn] += 1
+                    users[bsn].add(user_id_from_url(comment['user_url']))
+    return {bsn: (comments[bsn], len(users[bsn])) for bsn in comments}
+
+
+async def best_of(rounds: int, func, *args) -> tuple[float, object]:
+    best, result = float('inf'), None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = await func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+async def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    boards = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        client.DB_PATH = str(Path(tmp) / 'db' / 'data.db')
+        await seed(posts, boards)
+
+        timings = {}
+        if stats._numpy() is not None:
+            timings['numpy'], _ = await best_of(1, stats.rebuild)
+        stats.USE_NUMPY = False
+        timings['python'], _ = await best_of(1, stats.rebuild)
+        stats.USE_NUMPY = True
+
+        scan_time, exact = await best_of(3, scan)
+        query_time, result = await best_of(3, stats.query_stats, DAYS, None, 'comments', boards)
+        await close_client()
+
+    errors = []
+    for board in result['boards']:
+        count, unique = exact[board['bsn']]
+        assert board['comments'] == count
+        errors.append(abs(board['unique_commenters'] - unique) / unique)
+
+    print(f'posts={posts} boards={boards}')
+    print(f"rebuild: python {timings['python']:6.2f} s" + (f"   numpy {timings['numpy']:6.2f} s ({timings['python'] / timings['numpy']:.1f}x faster)" if 'numpy' in timings else ''))
+    print(f'query:   scan {scan_time * 1000:8.1f} ms   query_stats {query_time * 1000:6.1f} ms ({scan_time / query_time:.0f}x faster)')
+    print(f'unique commenters error (HyperLogLog): max {max(errors) * 100:.1f}%')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+'''
+每個看板的執行狀態佔多少記憶體 (之前 vs 現在)
+
+之前: Status.scrapers_status 裡的 dict (datetime + "fetched_<完整網址>")
+      + 一直留在 SCRAPERS 裡的 Scraper (asyncio.Lock + 做完的 running_tasks)
+現在: 只剩 BoardState (__slots__, 整數編碼)，Scraper 做完就釋放
+
+    python -m bench.status_memory [boards] [posts_per_board]
+'''
+import asyncio
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+
+from src.status import BoardState, PostState, ListState
+
+
+class _OldScraper:
+    def __init__(self, title: str, bsn: str):
+        self.title = title
+        self.bsn = bsn
+        self.running_tasks: list[asyncio.Task] = []
+        self.is_first_run = True
+        self.WRITE_LOCK = asyncio.Lock()
+
+
+async def _noop():
+    pass
+
+
+async def old_layout(boards: int, posts: int):
+    status, scrapers = {}, []
+    for i in range(boards):
+        bsn = str(60000 + i)
+        scraper = _OldScraper(f'看板標題 {i}', bsn)
+        scraper.running_tasks = [asyncio.create_task(_noop()) for _ in range(posts)]
+        await asyncio.gather(*scraper.running_tasks)
+        scrapers.append(scraper)
+        status[bsn] = {
+            'theme_title': scraper.title,
+            'post_list_status': 'fetched',
+            'post_status': f'fetched_https://forum.gamer.com.tw/C.php?bsn={bsn}&snA={123456 + i}&tnum=42',
+            'start_time': datetime.now(timezone.utc),
+            'end_time': datetime.now(timezone.utc),
+        }
+    return status, scrapers
+
+
+async def new_layout(boards: int, posts: int):
+    status = {}
+    for i in range(boards):
+        bsn = str(60000 + i)
+        state = BoardState(bsn, f'看板標題 {i}')
+        state.list_state = ListState.FETCHED
+        state.post_state = PostState.FETCHED
+        state.detail = 123456 + i
+        state.end_time = state.start_time + 1
+        state.posts = posts
+        status[bsn] = state
+    return status
+
+
+async def measure(factory, boards: int, posts: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = await factory(boards, posts)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del kept
+    return size / boards
+
+
+async def main():
+    boards = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    posts = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    old = await measure(old_layout, boards, posts)
+    new = await measure(new_layout, boards, posts)
+    print(f'boards={boards} posts_per_board={posts}')
+    print(f'before: {old:,.0f} bytes/board')
+    print(f'after:  {new:,.0f} bytes/board ({old / new:.1f}x smaller)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
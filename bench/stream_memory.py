@@ -0,0 +1,113 @@
+'''
+很多 C.php 同時在下載時的 peak RSS: 整頁讀進來 + BeautifulSoup 整棵 DOM vs 串流解析 (STREAM_PARSE)
+
+假的 C.php 大部分是 script / 側欄 (跟真的一樣)，用 httpx.MockTransport 一小塊一小塊送，
+所有 request 同時在跑；每種模式開一個新的 process，量 ru_maxrss 減掉開始前的 RSS
+
+    python -m bench.stream_memory [concurrent] [floors]
+'''
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+URL = 'https://forum.gamer.com.tw/C.php?bsn=1&snA={}'
+CHUNK = 16 * 1024
+
+
+def _floor(i: int) -> str:
+    comments = ''.join(f'''<div><div class="c-reply__item">
+<a class="reply-avatar" href="x"><img data-src="https://avatar2.bahamut.com.tw/avataruserpic/u{c}.png"/></a>
+<div class="reply-content"><a href="//home.gamer.com.tw/u{c}">使用者{c}</a><article><span>{'留言' * 20}</span></article>
+<div class="edittime">B{c + 1}</div><div class="edittime" data-tippy-content="留言時間 2024-01-01 12:00:00"></div></div></div></div>''' for c in range(15))
+    title = '<h1 class="c-post__header__title">標題</h1>' if i == 0 else ''
+    return f'''<section class="c-section"><div class="c-section__main c-post">
+<div class="c-post__header">{title}
+<div class="c-post__header__author"><a class="username">作者{i}</a><a class="userid" href="//home.gamer.com.tw/a{i}">a{i}</a></div>
+<div class="c-post__header__info"><a class="edittime" data-mtime="2024-01-01 10:00:00">x</a></div></div>
+<div class="c-post__body"><article><div>{'<p>這是內文，<b>粗體</b>。</p>' * 150}</div></article>
+<div class="c-post__body__buttonbar"><div class="gp"><a>{i}</a></div><div class="bp"><a>-</a></div></div></div>
+<div class="c-post__footer c-reply">{comments}</div></div></section>'''
+
+
+def page(floors: int) -> bytes:
+    script = '<script>' + 'var x = {"a": [1, 2, 3], "b": "<div>not html</div>"};\n' * 6000 + '</script>'
+    sidebar = '<div class="sidebar">' + '<div class="item"><a href="/x"><img src="/y.png"/>側欄</a></div>' * 3000 + '</div>'
+    return f'<html><head>{script}</head><body>{sidebar}{"".join(_floor(i) for i in range(floors))}{script}</body></html>'.encode()
+
+
+def rss_kib() -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+async def child(mode: str, concurrent: int, floors: int):
+    import httpx
+    from src import utils
+    from src.parser import parse_post
+    from src.stream_parse import PostStreamParser
+
+    body = page(floors)
+
+    async def stream_body():
+        for start in range(0, len(body), CHUNK):
+            await asyncio.sleep(random.uniform(0, 0.002)) # 讓所有 request 交錯
+            yield body[start:start + CHUNK]
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(
+        200, headers={'Content-Type': 'text/html; charset=utf-8'}, content=stream_body(),
+    ))
+    utils.HttpxClient = httpx.AsyncClient(transport=transport)
+
+    async def one(i: int) -> int:
+        url = URL.format(i)
+        if mode == 'stream':
+            sink = PostStreamParser(url, '看板')
+            await utils.fetch_with_retry(url, sink=sink)
+            post = sink.close()
+        else:
+            resp = await utils.fetch_with_retry(url)
+            post = parse_post(resp.text, url, '看板')
+        return len(post.floors)
+
+    baseline = rss_kib()
+    results = await asyncio.gather(*(one(i) for i in range(concurrent)))
+    assert results == [floors] * concurrent
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(len(body), baseline, peak)
+
+
+def run(mode: str, concurrent: int, floors: int) -> tuple[int, int, int]:
+    env = {**os.environ, 'PYTHONPATH': str(ROOT)}
+    out = subprocess.run(
+        [sys.executable, '-m', 'bench.stream_memory', '--child', mode, str(concurrent), str(floors)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    size, baseline, peak = map(int, out.strip().splitlines()[-1].split())
+    return size, baseline, peak
+
+
+def main():
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    floors = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    results = {mode: run(mode, concurrent, floors) for mode in ('buffered', 'stream')}
+    size = results['buffered'][0]
+    print(f'page={size / 2**10:.0f} KiB floors={floors} concurrent={concurrent}')
+    for mode, (_, baseline, peak) in results.items():
+        print(f'{mode:9s} peak RSS +{(peak - baseline) / 1024:7.1f} MiB')
+    buffered, stream = (peak - baseline for _, baseline, peak in results.values())
+    print(f'{buffered / stream:.1f}x less')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        asyncio.run(child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4])))
+    else:
+        main()
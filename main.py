@@ -1,15 +1,25 @@
+'''
+    python main.py [all|api|crawler]   (或環境變數 MODE，預設 all)
+
+- all: API server + 啟動時跑一次爬蟲
+- api: 只開 API server (不會 import 爬蟲那一套)，/api/refresh 還是可以手動開始爬
+- crawler: 只跑爬蟲，跑完就結束
+'''
 import asyncio
 import os
+import sys
 import logging
-import uvicorn
 
-from src.main import main as scraper
 from src import utils
-from app.app import app
 
 logger = logging.getLogger(__name__)
 
+MODES = ('all', 'api', 'crawler')
+
 async def run_server():
+    import uvicorn
+    from app.app import app
+
     env_port = os.getenv("PORT")
     logger.info(f'Env PORT: `{env_port}`')
     if not env_port:
@@ -22,15 +32,29 @@ async def run_server():
     server = uvicorn.Server(config)
     await server.serve()
 
-async def main():
-    # init task
-    utils.TOP_SCRAPE_TASK = asyncio.create_task(scraper())
+async def run_crawler():
+    from src.main import main as scraper
+    await scraper()
+
+async def main(mode: str = 'all'):
+    if mode == 'crawler':
+        await run_crawler()
+        return
+
+    if mode == 'all':
+        # init task
+        utils.TOP_SCRAPE_TASK = asyncio.create_task(run_crawler())
     # api server
     await run_server()
 
 
 if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else os.getenv('MODE', 'all')
+    if mode not in MODES:
+        sys.exit(f'Unknown mode `{mode}`, expected one of {", ".join(MODES)}')
+
+    utils.init_runtime()
     try:
-        asyncio.run(main())
+        asyncio.run(main(mode))
     except (asyncio.CancelledError, KeyboardInterrupt):
         logger.info('Closing the main entry point...')
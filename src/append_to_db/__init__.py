@@ -1,2 +1,2 @@
-from .client import init_tables, get_client, close_client
+from .client import init_tables, get_client, get_reader, close_client, shard_of, shard_ids, fan_out
 from .func import *
\ No newline at end of file
@@ -1,30 +1,193 @@
 import aiosqlite
+import asyncio
+import logging
+import os
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "data/db/data.db"
-Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+# blob: floors 以 JSON 存在 post_info.floors
+# normalized: 拆成 users / floors / comments (見 normalized.py)
+DB_LAYOUT = os.getenv("DB_LAYOUT", "blob")
+
+# 0: 全部在 DB_PATH 一個檔
+# N: all_posts / post_info (跟跟著它們的 stats、normalized 的表) 依 bsn 分到 N 個 shard 檔 (data/db/shard-00.db ...)
+#    DB_PATH 只剩 catalog (all_themes、raw_pages、floors_dicts、media、media_refs)；每個 shard 有自己的寫入連線，可以同時寫
+#    shard 數量決定了就不要改 (不會自動搬資料)
+DB_SHARDS = int(os.getenv("DB_SHARDS", "0"))
+
+# 唯讀連線池的大小 (WAL 下讀不會被寫卡住，每條連線各自一個 aiosqlite thread)，每個檔各一個池
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_KIB = int(os.getenv("DB_CACHE_KIB", str(64 * 1024))) # 每條連線的 page cache
+# sqlite3 以 SQL 字串快取 prepared statement，所以 SQL 請寫成固定字串，參數用 ?
+DB_CACHED_STATEMENTS = 256
+
+
+class _Database:
+    '''一個 SQLite 檔: 唯一的寫入連線 + 唯讀連線池'''
+    def __init__(self, path: str, shard: int | None):
+        self.path = path
+        self.shard = shard
+        self.writer: aiosqlite.Connection | None = None
+        self.readers: list[aiosqlite.Connection] = []
+        self.idle: asyncio.Queue[aiosqlite.Connection] | None = None
+        self.reader_slots = 0 # 已經開 (或正在開) 的唯讀連線數
+
+    async def connect(self) -> aiosqlite.Connection:
+        is_new = not Path(self.path).exists()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_CACHED_STATEMENTS)
+        if is_new and self.shard is not None:
+            # 要在建表之前設，之後 maintenance 才能一個 shard 一個 shard 做 incremental_vacuum
+            await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute("PRAGMA journal_mode = WAL") # 讀寫並行
+        await conn.execute("PRAGMA synchronous = NORMAL") # WAL 下 NORMAL 就不會壞檔，只是斷電可能少最後幾筆
+        await conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        await conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KIB}")
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    async def close(self):
+        if self.writer:
+            await self.writer.close()
+            self.writer = None
+
+        readers = list(self.readers)
+        self.readers.clear()
+        self.idle = None
+        self.reader_slots = 0
+        for conn in readers:
+            await conn.close()
+
+
+_DATABASES: dict[int | None, _Database] = {} # None 是 catalog
+
+
+def shard_of(bsn: int | str | None) -> int | None:
+    """看板在哪個 shard，沒有分 shard (或不知道 bsn) 的話是 None (= catalog，也就是唯一的 DB)"""
+    if DB_SHARDS <= 0 or bsn is None:
+        return None
+    return int(bsn) % DB_SHARDS # bsn 本身就夠分散了
+
+
+def shard_ids() -> list[int | None]:
+    """有貼文資料的每個檔，沒有分 shard 的話只有 [None]"""
+    return list(range(DB_SHARDS)) if DB_SHARDS > 0 else [None]
+
 
-DB_CLIENT: aiosqlite.Connection | None = None
+def _database(shard: int | None) -> _Database:
+    if shard not in _DATABASES:
+        path = DB_PATH if shard is None else str(Path(DB_PATH).parent / f"shard-{shard:02d}.db")
+        _DATABASES[shard] = _Database(path, shard)
+    return _DATABASES[shard]
 
-async def get_client():
-    global DB_CLIENT
-    if DB_CLIENT is None:
-        DB_CLIENT = await aiosqlite.connect(DB_PATH)
-    return DB_CLIENT
+
+def db_path(shard: int | None = None) -> str:
+    return _database(shard).path
+
+
+async def get_client(shard: int | None = None):
+    """
+    寫入用的連線，一個檔的全部寫入都走這條 (SQLite 同時間本來就只能有一個 writer)
+    shard 用 shard_of(bsn)；None 是 catalog
+    """
+    database = _database(shard)
+    if database.writer is None:
+        database.writer = await database.connect()
+    return database.writer
+
+@asynccontextmanager
+async def get_reader(shard: int | None = None) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    從唯讀連線池借一條連線，用完自動還回去
+    row_factory 固定是 aiosqlite.Row (可以用 row[0] 也可以 dict(row))，不要去改它
+
+        async with get_reader(shard_of(bsn)) as db:
+            cursor = await db.execute(...)
+    """
+    database = _database(shard)
+    if database.idle is None:
+        database.idle = asyncio.Queue()
+    idle = database.idle
+
+    if idle.empty() and database.reader_slots < DB_READERS:
+        database.reader_slots += 1
+        try:
+            conn = await database.connect()
+            await conn.execute("PRAGMA query_only = ON")
+        except BaseException:
+            database.reader_slots -= 1
+            raise
+        conn.row_factory = aiosqlite.Row
+        database.readers.append(conn)
+    else:
+        conn = await idle.get()
+
+    try:
+        yield conn
+    finally:
+        # close_client 之後才還的就不用放回去了
+        if conn in database.readers:
+            idle.put_nowait(conn)
+
+# 寫入連線是大家共用的，一段寫入 (到 commit 為止) 拿著這把鎖，別人的 commit / VACUUM 才不會插在中間
+_WRITE_LOCKS: weakref.WeakKeyDictionary[aiosqlite.Connection, asyncio.Lock] = weakref.WeakKeyDictionary()
+
+@asynccontextmanager
+async def writing(db: aiosqlite.Connection) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    在 get_client() 的連線上寫入都要包這個 (一個連線一把鎖，不同 shard 可以同時寫)
+    裡面要自己 commit；出錯的話 rollback，不會把寫一半的 transaction 留給下一個 commit 的人
+    (rollback 掉的 users 也要從 normalized 的快取拿掉，不然之後會指到不存在的 users.id)
+
+        async with writing(db):
+            await db.execute(...)
+            await db.commit()
+    """
+    if db not in _WRITE_LOCKS:
+        _WRITE_LOCKS[db] = asyncio.Lock()
+    async with _WRITE_LOCKS[db]:
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            from .normalized import forget_users
+            forget_users(db)
+            raise
+
+async def fan_out(query: Callable[[aiosqlite.Connection], Awaitable[T]]) -> list[T]:
+    """每個 shard 借一條唯讀連線同時跑 query，回傳每個 shard 的結果 (沒有分 shard 的話只有一個)"""
+    async def run(shard: int | None) -> T:
+        async with get_reader(shard) as db:
+            return await query(db)
+
+    return list(await asyncio.gather(*(run(shard) for shard in shard_ids())))
 
 async def close_client():
-    global DB_CLIENT
-    if DB_CLIENT:
-        await DB_CLIENT.close()
-        DB_CLIENT = None
+    databases = list(_DATABASES.values())
+    _DATABASES.clear() # DB_PATH 可能會改 (bench)，下次重新算路徑
+    for database in databases:
+        await database.close()
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, decl: str):
+    """舊的資料庫沒有這個欄位就補上 (SQLite 沒有 ADD COLUMN IF NOT EXISTS)"""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in await cursor.fetchall()}:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
 async def init_tables():
+    """catalog 跟每個 shard 的表 (沒有分 shard 的話全部在同一個檔)"""
     db = await get_client()
 
 
-    await db.execute("PRAGMA journal_mode = WAL") # 讀寫並行
-
-
     '''
     用來儲存
     f'https://api.gamer.com.tw/forum/v1/board_list.php?category=&page={page_count}&origin=forum'
@@ -40,24 +203,98 @@ async def init_tables():
         )
     """)
     
+    '''
+    ARCHIVE_RAW=1 時，每次抓到的 C.php 原始 HTML (sha256 見 src/archive.py)
+    '''
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS raw_pages (
+            bsn INTEGER,
+            snA INTEGER,
+            fetched_at TEXT,
+            url TEXT,
+            sha256 TEXT,
+            PRIMARY KEY (bsn, snA, fetched_at)
+        )
+    """)
 
     '''
+    MEDIA_CACHE=1 時，貼文裡的頭貼 / 圖片網址 -> 內容的 sha256 (見 src/media.py)
+    not_modified: 重新驗證拿到 304 的次數
+    media_refs: 每篇貼文 (canonical_post_url) 裡每個網址出現幾次，重抓同一篇時整篇換掉，不會越加越多
+    '''
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS media (
+            url TEXT PRIMARY KEY,
+            sha256 TEXT,
+            size INTEGER,
+            content_type TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            status INTEGER,
+            not_modified INTEGER NOT NULL DEFAULT 0,
+            checked_at TEXT
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS media_refs (
+            post_url TEXT,
+            media_url TEXT,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (post_url, media_url)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_media_refs_media_url ON media_refs (media_url)")
+
+    from .codec import init_codec_tables
+    await init_codec_tables(db)
+
+    await db.commit()
+
+    from .stats import STATS, has_stale_keys
+    for shard in shard_ids():
+        shard_db = await get_client(shard)
+        await _init_post_tables(shard_db)
+        await shard_db.commit()
+
+        await _rekey_posts(shard_db)
+        if STATS and await has_stale_keys(shard_db):
+            # 以前的統計是用帶 tnum 的網址記的，同一篇會被算好幾次
+            # 重算要解開整個資料庫，不在啟動的時候做 (會卡住寫入)
+            logger.warning(
+                f'post_stats in {db_path(shard)} still has tnum-keyed urls, /api/stats will over-count until '
+                'you run `python -m src.append_to_db.stats`'
+            )
+
+# 跟著 bsn 分 shard 的表
+async def _init_post_tables(db: aiosqlite.Connection):
+    '''
+    post_url 是 utils.canonical_post_url (不含 tnum)
+    reply_count / gp / last_reply 是 B.php 列表上最近一次看到的 (見 records.PostListing)
     '''
     # 單一主題的 全部貼文連結
     await db.execute("""
         CREATE TABLE IF NOT EXISTS all_posts (
             post_url TEXT PRIMARY KEY,
             bsn TEXT,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            reply_count INTEGER,
+            gp INTEGER,
+            last_reply TEXT
         )
     """)
+    await _add_column(db, "all_posts", "reply_count", "INTEGER")
+    await _add_column(db, "all_posts", "gp", "INTEGER")
+    await _add_column(db, "all_posts", "last_reply", "TEXT")
 
     # 建立索引
     await db.execute("CREATE INDEX IF NOT EXISTS idx_posts_bsn ON all_posts (bsn)")
 
     '''
     url 為主鍵
-    floors 為 JSON 格式
+    floors 為 JSON 格式 (FLOORS_CODEC=zstd 時是壓過的 BLOB，見 codec.py)
+    post_time 為樓主的發文時間 (= floors[0].time)，判斷要不要用快取時不用解開 floors
+    list_reply_count / list_last_reply 為抓這次 C.php 時 B.php 列表上的回覆數 / 最後回覆時間，沒變的話就不用再抓
     '''
     # 單一貼文的資訊
     await db.execute("""
@@ -65,8 +302,82 @@ async def init_tables():
             url TEXT PRIMARY KEY,
             title TEXT,
             floors TEXT,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            post_time TEXT,
+            list_reply_count INTEGER,
+            list_last_reply TEXT
         )
     """)
+    await _add_column(db, "post_info", "post_time", "TEXT")
+    await _add_column(db, "post_info", "list_reply_count", "INTEGER")
+    await _add_column(db, "post_info", "list_last_reply", "TEXT")
+
+    if DB_LAYOUT == "normalized":
+        from .normalized import init_normalized_tables
+        await init_normalized_tables(db)
+
+    from .stats import STATS, init_stats_tables
+    if STATS:
+        await init_stats_tables(db)
+
+# canonical_post_url 以外的網址 (帶 tnum 的)；GLOB 只是先篩一輪，真的要改的再用 post_key 判斷
+_NOT_CANONICAL = "NOT GLOB 'https://forum.gamer.com.tw/C.php?bsn=[0-9]*&snA=[0-9]*' OR {0} GLOB '*&snA=*[^0-9]*'"
+
+async def _rekey_posts(db: aiosqlite.Connection, batch_size: int = 500) -> int:
+    '''
+    以前 all_posts / post_info 是用 B.php 上的網址 (帶 tnum) 存的，同一篇會因為 tnum 不同存成好幾列
+    改成 canonical_post_url，同一篇 (post_key 一樣的) 只留 updated_at 最新的那一列，已經是 canonical 的列也一起比
+    DB_LAYOUT=normalized 的 floors / comments 跟著 post_info 搬；回傳改掉 (刪掉或改名) 的 post_info 列數
+    整個 shard 一個 transaction (在 writing() 裡)，中途出錯就整個 rollback，下次啟動再搬
+    '''
+    from ..utils import post_key, canonical_post_url
+
+    changed = 0
+    async with writing(db):
+        has_floors = bool(await db.execute_fetchall("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'floors'"))
+        for table, column in (("post_info", "url"), ("all_posts", "post_url")):
+            rows = await db.execute_fetchall(f"SELECT {column}, updated_at FROM {table} WHERE {column} {_NOT_CANONICAL.format(column)}")
+            groups: dict[str, list[tuple[str, str]]] = defaultdict(list)
+            for url, updated_at in rows:
+                key = post_key(url)
+                if key is not None and url != canonical_post_url(*key):
+                    groups[canonical_post_url(*key)].append((updated_at or '', url))
+            if not groups:
+                continue
+            rekeyed = sum(len(variants) for variants in groups.values())
+
+            # 已經有 canonical 那一列的，一次查一批
+            canonicals = list(groups)
+            existing: dict[str, str] = {}
+            for start in range(0, len(canonicals), batch_size):
+                batch = canonicals[start:start + batch_size]
+                existing.update(await db.execute_fetchall(
+                    f"SELECT {column}, updated_at FROM {table} WHERE {column} IN ({','.join('?' * len(batch))})",
+                    batch,
+                ))
+
+            drop: list[tuple[str]] = []
+            rename: list[tuple[str, str]] = []
+            for canonical, variants in groups.items():
+                if canonical in existing:
+                    variants.append((existing[canonical] or '', canonical))
+                # 最新的留下來，一樣新的話留 canonical 那一列
+                keep = max(variants, key=lambda variant: (variant[0], variant[1] == canonical))[1]
+                drop.extend((url,) for _, url in variants if url != keep)
+                if keep != canonical:
+                    rename.append((canonical, keep))
+
+            # 先刪再改名，不然改成 canonical 的時候舊的 canonical 還在 (PRIMARY KEY 撞到)
+            if table == "post_info" and has_floors:
+                await db.executemany("DELETE FROM comments WHERE floor_id IN (SELECT id FROM floors WHERE post_url = ?)", drop)
+                await db.executemany("DELETE FROM floors WHERE post_url = ?", drop)
+                await db.executemany("UPDATE floors SET post_url = ? WHERE post_url = ?", rename)
+            await db.executemany(f"DELETE FROM {table} WHERE {column} = ?", drop)
+            await db.executemany(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", rename)
+
+            if table == "post_info":
+                changed = rekeyed
+            logger.info(f'Rekeyed {rekeyed} {table} rows to canonical post urls')
 
-    await db.commit()
\ No newline at end of file
+        await db.commit()
+    return changed
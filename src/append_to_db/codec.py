@@ -0,0 +1,260 @@
+'''
+post_info.floors 的壓縮 (FLOORS_CODEC=zstd，預設 text 不壓，外部直接讀 floors 當 JSON 的工具不受影響)
+
+floors 的 JSON 裡一直重複一樣的 key、home.gamer.com.tw / 頭像的網址，用我們自己的資料訓練的 zstd 字典壓
+- 字典存在 floors_dicts 表 (DB_SHARDS 時在 catalog，所有 shard 共用)，最新的一個拿來壓新的資料，舊的留著解壓縮舊的列
+- 壓過的存成 BLOB: 7 bytes 的 header (b'FZ' + 版本 + 字典 id，0 是沒有字典) + zstd frame
+- 以前的列還是 TEXT (純 JSON)，兩種可以混著放，讀的時候看型別
+
+zstd 用 Python 3.14 內建的 compression.zstd，舊版的 Python 要 pip install zstandard
+開了之後只有新寫入的列會壓，舊的列要手動重壓 (可以中斷，下次接著做):
+
+    python -m src.append_to_db.codec train              # 重新訓練字典 (之後寫入的都用新的)
+    python -m src.append_to_db.codec migrate [--vacuum]  # 重壓全部
+'''
+import asyncio
+import logging
+import os
+import struct
+import sys
+
+import aiosqlite
+import orjson
+
+try:
+    from compression import zstd # Python 3.14
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+HAS_ZSTD = zstd is not None or zstandard is not None
+FLOORS_CODEC = os.getenv("FLOORS_CODEC", "text")
+FLOORS_ZSTD_LEVEL = int(os.getenv("FLOORS_ZSTD_LEVEL", "3"))
+FLOORS_DICT_SIZE = int(os.getenv("FLOORS_DICT_SIZE", str(112 * 1024)))
+FLOORS_DICT_SAMPLES = int(os.getenv("FLOORS_DICT_SAMPLES", "2000"))
+FLOORS_DICT_MIN_SAMPLES = 100 # 資料太少訓練不出好字典，先不用字典壓
+
+_HEADER = struct.Struct('<2sBI') # magic, 版本, 字典 id
+_MAGIC = b'FZ'
+_VERSION = 1
+
+
+class _Codec:
+    '''
+    一個字典 (dict_id 0 是沒有字典) 的壓縮 / 解壓縮
+    zstandard 的物件不能多個 thread 同時用，只在 event loop 的 thread 呼叫
+    '''
+    def __init__(self, dict_id: int, data: bytes | None):
+        self.dict_id = dict_id
+        self.header = _HEADER.pack(_MAGIC, _VERSION, dict_id)
+        if zstd is not None:
+            zdict = zstd.ZstdDict(data) if data else None
+            self.compress = lambda raw: zstd.compress(raw, FLOORS_ZSTD_LEVEL, zstd_dict=zdict)
+            self.decompress = lambda blob: zstd.decompress(blob, zstd_dict=zdict)
+        elif zstandard is not None:
+            zdict = zstandard.ZstdCompressionDict(data) if data else None
+            self.compress = zstandard.ZstdCompressor(level=FLOORS_ZSTD_LEVEL, dict_data=zdict).compress
+            self.decompress = zstandard.ZstdDecompressor(dict_data=zdict).decompress
+        else:
+            raise RuntimeError('floors are zstd-compressed, install Python 3.14+ or `pip install zstandard`')
+
+
+_CODECS: dict[int, _Codec] = {}
+_CURRENT: _Codec | None = None # 寫入用的 (最新的字典)
+
+
+async def init_codec_tables(db: aiosqlite.Connection):
+    global _CURRENT
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS floors_dicts (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            samples INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    if FLOORS_CODEC == 'zstd' and HAS_ZSTD:
+        rows = await db.execute_fetchall("SELECT id, data FROM floors_dicts ORDER BY id DESC LIMIT 1")
+        if rows:
+            dict_id, data = rows[0]
+            _CURRENT = _CODECS.get(dict_id) or _Codec(dict_id, data)
+            _CODECS[dict_id] = _CURRENT
+        else:
+            _CURRENT = _get_codec_sync(0)
+
+
+def _get_codec_sync(dict_id: int) -> _Codec:
+    if dict_id not in _CODECS:
+        if dict_id != 0:
+            raise KeyError(dict_id)
+        _CODECS[0] = _Codec(0, None)
+    return _CODECS[dict_id]
+
+
+async def _get_codec(dict_id: int) -> _Codec:
+    from .client import get_client
+
+    if dict_id in _CODECS or dict_id == 0:
+        return _get_codec_sync(dict_id)
+    # 別的 process 訓練的新字典 (用 catalog 的寫入連線讀，不用再借一條唯讀連線)
+    db = await get_client()
+    rows = await db.execute_fetchall("SELECT data FROM floors_dicts WHERE id = ?", (dict_id,))
+    if not rows:
+        raise ValueError(f'floors dictionary {dict_id} not found')
+    codec = _CODECS[dict_id] = _Codec(dict_id, rows[0][0])
+    return codec
+
+
+def pack_floors(floors: str | bytes) -> str | bytes:
+    '''要寫進 post_info.floors 的值，FLOORS_CODEC=text 時原樣回傳'''
+    if FLOORS_CODEC != 'zstd' or not HAS_ZSTD:
+        return floors
+    codec = _CURRENT or _get_codec_sync(0) # 沒有 init_tables 的話 (例如 bench) 不用字典
+    raw = floors.encode() if isinstance(floors, str) else floors
+    return codec.header + codec.compress(raw)
+
+
+async def unpack_floors(value: str | bytes | None) -> str | bytes | None:
+    '''
+    post_info.floors 讀出來的值 -> JSON (舊的 TEXT 列是 str，壓過的解開是 bytes，orjson.loads / jsonl_line 都吃)
+    遇到還沒載入的字典時會去 floors_dicts 讀
+    '''
+    if value is None or isinstance(value, str):
+        return value
+    if value[:2] != _MAGIC:
+        return value # BLOB 但沒有 header，當作 JSON
+    _, version, dict_id = _HEADER.unpack_from(value)
+    if version != _VERSION:
+        raise ValueError(f'Unknown floors codec version {version}')
+    codec = await _get_codec(dict_id)
+    return codec.decompress(value[_HEADER.size:])
+
+
+async def train(samples: int = FLOORS_DICT_SAMPLES) -> int | None:
+    '''
+    從 post_info 隨機抽 samples 篇 (每個 shard 平均抽) 訓練新的字典，之後寫入都用它
+    資料太少 (< FLOORS_DICT_MIN_SAMPLES 篇) 的話回傳 None
+    '''
+    from .client import fan_out, get_client, shard_ids, writing
+
+    global _CURRENT
+    per_shard = -(-samples // len(shard_ids()))
+    results = await fan_out(lambda db: db.execute_fetchall(
+        "SELECT floors FROM post_info WHERE floors IS NOT NULL ORDER BY random() LIMIT ?", (per_shard,),
+    ))
+    data = []
+    for rows in results:
+        for (value,) in rows:
+            raw = await unpack_floors(value)
+            data.append(raw.encode() if isinstance(raw, str) else raw)
+    if len(data) < FLOORS_DICT_MIN_SAMPLES:
+        logger.info(f'Not enough posts to train a floors dictionary ({len(data)} < {FLOORS_DICT_MIN_SAMPLES})')
+        return None
+
+    if zstd is not None:
+        content = (await asyncio.to_thread(zstd.train_dict, data, FLOORS_DICT_SIZE)).dict_content
+    else:
+        content = (await asyncio.to_thread(zstandard.train_dictionary, FLOORS_DICT_SIZE, data)).as_bytes()
+
+    db = await get_client()
+    async with writing(db):
+        cursor = await db.execute("INSERT INTO floors_dicts (data, samples) VALUES (?, ?)", (content, len(data)))
+        await db.commit()
+    dict_id = cursor.lastrowid
+    _CURRENT = _CODECS[dict_id] = _Codec(dict_id, content)
+    logger.info(f'Trained floors dictionary {dict_id} ({len(content)} bytes, {len(data)} samples)')
+    return dict_id
+
+
+async def migrate(batch_size: int = 200, pause: float = 0.05, vacuum: bool = False) -> int:
+    '''
+    把還不是用最新字典壓的 floors (TEXT 的、舊字典的) 重壓，可以中斷後重跑
+    還沒有字典的話先訓練一個；每一批之間休息 pause 秒，讓爬蟲的寫入插隊
+    post_time 還是 NULL 的舊列 (加欄位之前存的) 順便從 floors 補上，壓過之後 SQL 就讀不到 floors 裡的時間了
+    '''
+    from .client import shard_ids
+
+    if FLOORS_CODEC != 'zstd' or not HAS_ZSTD:
+        return 0
+
+    if _CURRENT is None or _CURRENT.dict_id == 0:
+        await train()
+
+    total = 0
+    for shard in shard_ids():
+        total += await _migrate_shard(shard, batch_size, pause, vacuum)
+    return total
+
+
+async def _migrate_shard(shard: int | None, batch_size: int, pause: float, vacuum: bool) -> int:
+    from .client import get_client, writing
+
+    db = await get_client(shard)
+    header = (_CURRENT or _get_codec_sync(0)).header
+    last_rowid, total = 0, 0
+    while True:
+        # 讀跟寫回去都拿著寫入的鎖，不會讀到別人寫到一半 (還沒 commit) 的列，中間也不會被爬蟲蓋掉
+        async with writing(db):
+            rows = await db.execute_fetchall("""
+                SELECT rowid, floors, post_time FROM post_info
+                WHERE rowid > ? AND floors IS NOT NULL
+                AND NOT (typeof(floors) = 'blob' AND substr(floors, 1, ?) = ?)
+                ORDER BY rowid LIMIT ?
+            """, (last_rowid, _HEADER.size, header, batch_size))
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+
+            updates = []
+            for rowid, value, post_time in rows:
+                raw = await unpack_floors(value)
+                if post_time is None:
+                    floors = orjson.loads(raw)
+                    post_time = floors[0].get('time') if floors else None
+                updates.append((pack_floors(raw), post_time, rowid, value))
+            # 別的 process (例如另一個爬蟲) 在這中間改過的就不要蓋掉
+            await db.executemany("UPDATE post_info SET floors = ?, post_time = COALESCE(post_time, ?) WHERE rowid = ? AND floors = ?", updates)
+            await db.commit()
+
+        total += len(rows)
+        logger.info(f'Recompressed {total} posts' + (f' in shard {shard}' if shard is not None else ''))
+        await asyncio.sleep(pause)
+
+    if vacuum:
+        # 空出來的頁面要 VACUUM 之後檔案才會變小 (拿著寫入的鎖，才不會遇到別人開著的 transaction)
+        async with writing(db):
+            await db.execute("VACUUM")
+    return total
+
+
+async def _main(command: str, vacuum: bool):
+    from .client import close_client, init_tables
+
+    try:
+        await init_tables()
+        if command == 'train':
+            await train()
+        else:
+            count = await migrate(pause=0, vacuum=vacuum)
+            logger.info(f'Done, {count} posts recompressed')
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    from ..utils import init_runtime
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command not in ('train', 'migrate'):
+        sys.exit(f'Unknown command `{command}`, expected train or migrate')
+    if FLOORS_CODEC != 'zstd' or not HAS_ZSTD:
+        sys.exit('FLOORS_CODEC is not zstd (or zstd is not available)')
+
+    init_runtime()
+    asyncio.run(_main(command, '--vacuum' in sys.argv[2:]))
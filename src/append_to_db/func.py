@@ -1,103 +1,188 @@
-import aiosqlite
-from typing import Any
+from __future__ import annotations
 
-from .type import ThemeModel, PostModel
-from .client import get_client
+import aiosqlite
+import itertools
+import orjson
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # pydantic 很重，只開 API 的時候不需要
+    from .type import ThemeModel
+    from ..records import Post, PostListing
+from . import client
+from .client import get_client, get_reader, shard_of, writing
+from .normalized import EMPTY_FLOORS, write_floors, read_floors
+from .codec import pack_floors, unpack_floors
+from .stats import STATS, record_post
+from ..metrics import DB_WRITE_SECONDS, DB_COMMIT_SECONDS
+from ..utils import post_key, canonical_post_url
 
 
 # adds
 
+async def _commit(db: aiosqlite.Connection, table: str):
+    with DB_COMMIT_SECONDS.time(table=table):
+        await db.commit()
+
 async def add_to_all_themes(theme: ThemeModel | list[ThemeModel]):
     db = await get_client()
 
-    if isinstance(theme, list):
-        await db.executemany('''
-        INSERT INTO all_themes (bsn, title, page_count)
-        VALUES (?, ?, ?)
-        ON CONFLICT (bsn) DO UPDATE SET 
-            title = excluded.title,
-            page_count = excluded.page_count,
-            updated_at = CURRENT_TIMESTAMP
-    ''', [(theme.bsn, theme.title, theme.page_count) for theme in theme])
-    else:
-        await db.execute('''
-        INSERT INTO all_themes (bsn, title, page_count)
-        VALUES (?, ?, ?)
-        ON CONFLICT (bsn) DO UPDATE SET 
-            title = excluded.title,
-            page_count = excluded.page_count,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (theme.bsn, theme.title, theme.page_count))
-    await db.commit()
-
-async def add_to_all_posts(post: PostModel | list[PostModel]):
-    db = await get_client()
+    themes = theme if isinstance(theme, list) else [theme]
 
-    if isinstance(post, list):
+    async with writing(db):
+        start = perf_counter()
         await db.executemany('''
-        INSERT INTO all_posts (post_url, bsn)
-        VALUES (?, ?)
-        ON CONFLICT (post_url) DO UPDATE SET 
-            bsn = excluded.bsn,
-            updated_at = CURRENT_TIMESTAMP
-    ''', [(post.post_url, post.bsn) for post in post])
-    else:
-        await db.execute('''
-        INSERT INTO all_posts (post_url, bsn)
-        VALUES (?, ?)
-        ON CONFLICT (post_url) DO UPDATE SET 
-            bsn = excluded.bsn,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (post.post_url, post.bsn))
-    await db.commit()
-
-async def add_to_post_info(post_url: str, title: str, floors: str):
+            INSERT INTO all_themes (bsn, title, page_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT (bsn) DO UPDATE SET 
+                title = excluded.title,
+                page_count = excluded.page_count,
+                updated_at = CURRENT_TIMESTAMP
+        ''', [(theme.bsn, theme.title, theme.page_count) for theme in themes])
+        DB_WRITE_SECONDS.observe(perf_counter() - start, table='all_themes')
+        await _commit(db, 'all_themes')
+
+async def add_to_all_posts(rows: Iterable[tuple[str, str, int | None, int | None, str | None]]):
+    """
+    Args:
+        rows: (post_url, bsn, reply_count, gp, last_reply)，可以是 generator (見 frontier.PostFrontier.rows)
+              全部要是同一個看板的 (DB_SHARDS 時看第一列決定寫到哪個 shard)
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    rows = itertools.chain((first,), rows)
+    db = await get_client(shard_of(first[1]))
+
+    async with writing(db):
+        start = perf_counter()
+        await db.executemany('''
+            INSERT INTO all_posts (post_url, bsn, reply_count, gp, last_reply)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (post_url) DO UPDATE SET 
+                bsn = excluded.bsn,
+                reply_count = excluded.reply_count,
+                gp = excluded.gp,
+                last_reply = excluded.last_reply,
+                updated_at = CURRENT_TIMESTAMP
+        ''', rows)
+        DB_WRITE_SECONDS.observe(perf_counter() - start, table='all_posts')
+        await _commit(db, 'all_posts')
+
+async def add_to_post_info(post_url: str, title: str, floors: str, post_time: str | None = None, listing: PostListing | None = None, post: Post | None = None):
     """
     Args:
         post_url (str): _description_
         title (str): _description_
-        floors (str): list 透過 orjson.dumps().decode() 轉換
+        floors (str): list 透過 orjson.dumps().decode() 轉換 (Post.encode_floors().decode())
+        post_time (str | None): 樓主發文時間 (ISO)，見 Post.post_time
+        listing (PostListing | None): 抓的時候 B.php 列表上的樣子，沒有的話保留上次的
+        post (Post | None): 剛解析好的 Post (爬蟲)，有的話統計直接用 post.floors，不用再 orjson.loads
     """    
-    db = await get_client()
+    key = post_key(post_url)
+    db = await get_client(shard_of(key[0] if key else None))
 
-    await db.execute('''
-        INSERT INTO post_info (url, title, floors)
-        VALUES (?, ?, ?)
-        ON CONFLICT (url) DO UPDATE SET 
-            title = excluded.title,
-            floors = excluded.floors,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (post_url, title, floors))
-    await db.commit()
+    decoded = orjson.loads(floors) if client.DB_LAYOUT == "normalized" or (STATS and post is None) else None
+    if client.DB_LAYOUT != "normalized":
+        floors = pack_floors(floors)
 
+    # post_info / floors / 統計在同一個 transaction，中間出錯整段 rollback
+    async with writing(db):
+        start = perf_counter()
+        if client.DB_LAYOUT == "normalized":
+            await write_floors(db, post_url, decoded)
+            floors = None if decoded else EMPTY_FLOORS # 沒有樓層的 read_floors 會回傳 None，當成沒存過
 
-# finds
-async def find_from_all_themes(query_key: str, query_value: Any) -> ThemeModel | None:
-    db = await get_client()
+        await db.execute('''
+            INSERT INTO post_info (url, title, floors, post_time, list_reply_count, list_last_reply)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET 
+                title = excluded.title,
+                floors = excluded.floors,
+                post_time = excluded.post_time,
+                list_reply_count = COALESCE(excluded.list_reply_count, post_info.list_reply_count),
+                list_last_reply = COALESCE(excluded.list_last_reply, post_info.list_last_reply),
+                updated_at = CURRENT_TIMESTAMP
+        ''', (
+            post_url, title, floors, post_time,
+            listing.reply_count if listing else None, listing.last_reply if listing else None,
+        ))
+        DB_WRITE_SECONDS.observe(perf_counter() - start, table='post_info')
+
+        if STATS:
+            with DB_WRITE_SECONDS.time(table='stats'):
+                await record_post(db, post_url, title, post.floors if post is not None else decoded)
+        await _commit(db, 'post_info')
 
-    # 這樣才能 **
-    db.row_factory = aiosqlite.Row
 
-    cursor = await db.execute(f"SELECT * FROM all_themes WHERE {query_key} = ?", (query_value,))
-    result = await cursor.fetchone()
+# finds
+async def find_from_all_themes(query_key: str, query_value: Any) -> ThemeModel | None:
+    async with get_reader() as db:
+        cursor = await db.execute(f"SELECT * FROM all_themes WHERE {query_key} = ?", (query_value,))
+        result = await cursor.fetchone()
     if result is None:
         return None
+    from .type import ThemeModel
     return ThemeModel(**dict(result))
 
 
 async def check_exists(table_name: str, key: str, value: Any) -> bool:
-    db = await get_client()
-
-    cursor = await db.execute(f"SELECT 1 FROM {table_name} WHERE {key} = ?", (value,))
-    result = await cursor.fetchone()
+    async with get_reader() as db:
+        cursor = await db.execute(f"SELECT 1 FROM {table_name} WHERE {key} = ?", (value,))
+        result = await cursor.fetchone()
     return result is not None
 
 async def get_post_info(url: str) -> dict[str, Any] | None:
-    db = await get_client()
-
-    db.row_factory = aiosqlite.Row
-    cursor = await db.execute("SELECT * FROM post_info WHERE url = ?", (url,))
-    result = await cursor.fetchone()
-    if result:
-        return dict(result)
+    # 新的資料是用 canonical_post_url 存的，帶 tnum 的網址 (/api/post) 也要找得到
+    key = post_key(url)
+    canonical = canonical_post_url(*key) if key else url
+    async with get_reader(shard_of(key[0] if key else None)) as db:
+        cursor = await db.execute("SELECT * FROM post_info WHERE url IN (?, ?) ORDER BY url = ? DESC LIMIT 1", (url, canonical, url))
+        result = await cursor.fetchone()
+        if result:
+            result = dict(result)
+            if result['floors'] is None:
+                # 正規化格式 (或已遷移的舊資料)，從 floors / comments 組回來
+                floors = await read_floors(db, result['url']) # 找到的可能是 canonical 那一列
+                if floors is None:
+                    return None
+                result['floors'] = orjson.dumps(floors).decode()
+            else:
+                # 壓過的解開是 bytes (見 codec.py)
+                result['floors'] = await unpack_floors(result['floors'])
+            return result
     return None
+
+async def load_posts(urls: list[str], batch_size: int = 500) -> list[tuple[str, str, list[dict[str, Any]], str]]:
+    """
+    一次讀很多篇 (匯出 / 統計重算用)，floors 已經解開，兩種 DB_LAYOUT 都可以
+
+    Returns:
+        [(url, title, floors, updated_at), ...] 順序不一定跟 urls 一樣，找不到的會略過
+    """
+    by_shard: dict[int | None, list[str]] = defaultdict(list)
+    for url in urls:
+        key = post_key(url)
+        by_shard[shard_of(key[0] if key else None)].append(url)
+
+    posts = []
+    for shard, shard_urls in by_shard.items():
+        async with get_reader(shard) as db:
+            for start in range(0, len(shard_urls), batch_size):
+                batch = shard_urls[start:start + batch_size]
+                cursor = await db.execute(
+                    f"SELECT url, title, floors, updated_at FROM post_info WHERE url IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for url, title, floors, updated_at in await cursor.fetchall():
+                    if floors is None:
+                        floors = await read_floors(db, url) # DB_LAYOUT=normalized
+                        if floors is None:
+                            continue
+                    else:
+                        floors = orjson.loads(await unpack_floors(floors))
+                    posts.append((url, title, floors, updated_at))
+    return posts
@@ -0,0 +1,121 @@
+'''
+資料庫維護，一次只動一個 shard (DB_SHARDS 時其他 shard 照常寫入；沒有分 shard 的話就是整個 data.db)
+
+- vacuum:  PRAGMA incremental_vacuum，把空出來的頁面還給檔案系統 (新建的 shard 預設 auto_vacuum = INCREMENTAL)
+- compact: 整個檔 VACUUM 重寫 (舊的檔案順便改成 auto_vacuum = INCREMENTAL)，期間這個 shard 的寫入會等
+- reindex: REINDEX + ANALYZE
+- prune:   刪掉樓主發文超過 days 天的貼文 (post_info) 跟 days 天沒在列表上看到的 all_posts
+           統計 (post_stats / board_daily_stats) 會留著；還在列表上的貼文下次會再抓
+
+    python -m src.append_to_db.maintenance vacuum [--shard 3]        # 沒有 --shard 就一個一個 shard 做
+    python -m src.append_to_db.maintenance prune --days 365
+
+prune 會刪資料，所以只有 CLI，沒有開 HTTP API
+'''
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Any
+
+import aiosqlite
+
+from . import client
+from .client import get_client, shard_ids, writing
+
+logger = logging.getLogger(__name__)
+
+OPS = ('vacuum', 'compact', 'reindex', 'prune')
+
+
+async def _file_size(shard: int | None) -> int:
+    path = client.db_path(shard)
+    return sum(os.path.getsize(p) for p in (path, f'{path}-wal') if os.path.exists(p))
+
+
+async def _freelist(db: aiosqlite.Connection) -> int:
+    '''空著的頁面有幾 bytes'''
+    (count,), = await db.execute_fetchall("PRAGMA freelist_count")
+    (page_size,), = await db.execute_fetchall("PRAGMA page_size")
+    return count * page_size
+
+
+async def _prune(db: aiosqlite.Connection, days: int) -> dict[str, int]:
+    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+    old_posts = "SELECT url FROM post_info WHERE substr(COALESCE(post_time, updated_at), 1, 10) < ?"
+
+    if client.DB_LAYOUT == "normalized":
+        await db.execute(f"DELETE FROM comments WHERE floor_id IN (SELECT id FROM floors WHERE post_url IN ({old_posts}))", (cutoff,))
+        await db.execute(f"DELETE FROM floors WHERE post_url IN ({old_posts})", (cutoff,))
+    cursor = await db.execute(f"DELETE FROM post_info WHERE url IN ({old_posts})", (cutoff,))
+    posts = cursor.rowcount
+    cursor = await db.execute("DELETE FROM all_posts WHERE updated_at < datetime('now', ?)", (f'-{days} days',))
+    listings = cursor.rowcount
+    await db.commit()
+    return {'posts': posts, 'all_posts': listings}
+
+
+async def run(op: str, shard: int | None = None, days: int | None = None) -> dict[str, Any]:
+    '''
+    在一個 shard (None 是沒有分 shard 時的 data.db) 上做一種維護，用這個 shard 的寫入連線 (等爬蟲正在寫的做完)
+
+    Returns:
+        {'op', 'shard', 'seconds', 'size_before', 'size_after', ...}
+    '''
+    if op not in OPS:
+        raise ValueError(f'op must be one of {OPS}')
+    if shard not in shard_ids():
+        raise ValueError(f'shard must be one of {shard_ids()}')
+    if op == 'prune' and (days is None or days <= 0):
+        raise ValueError('prune needs days > 0')
+
+    db = await get_client(shard)
+    result: dict[str, Any] = {'op': op, 'shard': shard, 'size_before': await _file_size(shard)}
+    start = perf_counter()
+
+    # 拿著寫入的鎖: 爬蟲的寫入都 commit 完了才會進來，VACUUM 不會遇到別人開著的 transaction
+    async with writing(db):
+        if op == 'vacuum':
+            freed = await _freelist(db)
+            await db.execute_fetchall("PRAGMA incremental_vacuum") # 要 fetch 完才會真的跑完
+            result['freed'] = freed - await _freelist(db)
+        elif op == 'compact':
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+        elif op == 'reindex':
+            await db.execute("REINDEX")
+            await db.execute("ANALYZE")
+            await db.commit()
+        else:
+            result.update(await _prune(db, days))
+
+        await db.execute_fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+    result['seconds'] = round(perf_counter() - start, 3)
+    result['size_after'] = await _file_size(shard)
+    return result
+
+
+async def _main(args: argparse.Namespace):
+    from .client import close_client, init_tables
+
+    try:
+        await init_tables()
+        for shard in ([args.shard] if args.shard is not None else shard_ids()):
+            result = await run(args.op, shard, args.days)
+            logger.info(f'Done: {result}')
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    from ..utils import init_runtime
+
+    parser = argparse.ArgumentParser(description='Vacuum / compact / reindex / prune one shard at a time')
+    parser.add_argument('op', choices=OPS)
+    parser.add_argument('--shard', type=int, help='only this shard (default: every shard, one after another)')
+    parser.add_argument('--days', type=int, help='prune: keep this many days')
+    args = parser.parse_args()
+    init_runtime()
+    asyncio.run(_main(args))
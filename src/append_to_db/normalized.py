@@ -0,0 +1,298 @@
+'''
+正規化的儲存格式 (DB_LAYOUT=normalized)
+
+post_info.floors 的 JSON blob 裡，每則留言都重複存一次 avatar_url / user_url / user_name
+這裡把它拆成三張表:
+    users    -> 以 user id 為 key，作者與留言者共用
+    floors   -> 每一樓一列，author 指向 users.id
+    comments -> 每則留言一列，floor_id 指向 floors.id，user 指向 users.id
+
+floors / comments 上的 *_name / *_url / avatar_url 只在跟 users 裡的值不同時才會存 (否則為 NULL)
+所以讀回來的 floors 跟原本的 JSON 完全一樣，匯出的 JSONL 不會變
+
+遷移舊資料:
+    python -m src.append_to_db.normalized
+'''
+import asyncio
+import aiosqlite
+import orjson
+import logging
+import weakref
+from typing import Any
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# 每條寫入連線 (DB_SHARDS 時每個 shard 有自己的 users 表) 一份 user_id: (users.id, name, url, avatar_url)
+_USER_CACHES: weakref.WeakKeyDictionary[aiosqlite.Connection, dict[str, tuple[int, str | None, str | None, str | None]]] = weakref.WeakKeyDictionary()
+_USER_CACHE_MAX = 200_000
+
+# 沒有樓層的貼文 post_info.floors 存這個 (floors 是 NULL 的才從 floors / comments 組回來)
+EMPTY_FLOORS = '[]'
+
+
+async def init_normalized_tables(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL UNIQUE,
+            name TEXT,
+            url TEXT,
+            avatar_url TEXT
+        )
+    """)
+
+    # author_name / author_url 只在跟 users 不同時才有值
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS floors (
+            id INTEGER PRIMARY KEY,
+            post_url TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            author INTEGER REFERENCES users (id),
+            author_name TEXT,
+            author_url TEXT,
+            time TEXT,
+            tags TEXT,
+            content TEXT,
+            content_html TEXT,
+            like_count INTEGER,
+            dislike_count INTEGER,
+            UNIQUE (post_url, idx)
+        )
+    """)
+
+    # user_name / user_url / avatar_url 只在跟 users 不同時才有值
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY,
+            floor_id INTEGER NOT NULL REFERENCES floors (id),
+            seq INTEGER NOT NULL,
+            user INTEGER REFERENCES users (id),
+            user_name TEXT,
+            user_url TEXT,
+            avatar_url TEXT,
+            comment_text TEXT,
+            floor TEXT,
+            time TEXT
+        )
+    """)
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_floors_time ON floors (time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_floors_author ON floors (author)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_floors_like_count ON floors (like_count)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_comments_floor ON comments (floor_id, seq)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_comments_time ON comments (time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user)")
+
+
+def forget_users(db: aiosqlite.Connection):
+    '''transaction rollback 之後呼叫 (client.writing)，快取裡可能有剛剛 rollback 掉的 users.id'''
+    _USER_CACHES.pop(db, None)
+
+
+def user_id_from_url(url: str) -> str:
+    '''
+    https://home.gamer.com.tw/homeindex.php?owner=abc -> abc
+    https://home.gamer.com.tw/abc -> abc
+    都解析不到就直接用整個 url 當 key
+    '''
+    parsed = urlparse(url)
+    owner = parse_qs(parsed.query).get('owner')
+    if owner:
+        return owner[0]
+    last = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+    if last and '.' not in last:
+        return last
+    return url
+
+
+async def _intern_user(db: aiosqlite.Connection, user_id: str, name: str | None, url: str | None, avatar_url: str | None):
+    cache = _USER_CACHES.setdefault(db, {})
+    cached = cache.get(user_id)
+    # 之前只看過作者 (沒有頭貼)，這次有頭貼的話要補上去
+    if cached and not (cached[3] is None and avatar_url is not None):
+        return cached
+
+    cursor = await db.execute("""
+        INSERT INTO users (user_id, name, url, avatar_url)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            avatar_url = COALESCE(users.avatar_url, excluded.avatar_url)
+        RETURNING id, name, url, avatar_url
+    """, (user_id, name, url, avatar_url))
+    row = await cursor.fetchone()
+    await cursor.close()
+
+    if len(cache) >= _USER_CACHE_MAX:
+        cache.clear()
+    cache[user_id] = (row[0], row[1], row[2], row[3])
+    return cache[user_id]
+
+
+def _diff(value, base):
+    return None if value == base else value
+
+
+async def write_floors(db: aiosqlite.Connection, post_url: str, floors: list[dict[str, Any]]):
+    '''把一篇貼文的 floors 寫進 floors / comments (不會 commit)'''
+    await db.execute("DELETE FROM comments WHERE floor_id IN (SELECT id FROM floors WHERE post_url = ?)", (post_url,))
+    await db.execute("DELETE FROM floors WHERE post_url = ?", (post_url,))
+
+    for floor in floors:
+        author = floor['author']
+        user = await _intern_user(db, author['id'], author['name'], author['url'], None)
+
+        cursor = await db.execute("""
+            INSERT INTO floors (post_url, idx, author, author_name, author_url, time, tags, content, content_html, like_count, dislike_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            post_url,
+            floor['index'],
+            user[0],
+            _diff(author['name'], user[1]),
+            _diff(author['url'], user[2]),
+            floor['time'],
+            orjson.dumps(floor['tags']).decode() if floor['tags'] else None,
+            floor.get('content'),
+            floor.get('content_html'), # CONTENT_MODE=html (見 render.py)
+            floor['like_count'],
+            floor['dislike_count'],
+        ))
+        floor_id = cursor.lastrowid
+        await cursor.close()
+
+        rows = []
+        for seq, comment in enumerate(floor['comments']):
+            commenter = await _intern_user(
+                db,
+                user_id_from_url(comment['user_url']),
+                comment['user_name'],
+                comment['user_url'],
+                comment['avatar_url'],
+            )
+            rows.append((
+                floor_id,
+                seq,
+                commenter[0],
+                _diff(comment['user_name'], commenter[1]),
+                _diff(comment['user_url'], commenter[2]),
+                _diff(comment['avatar_url'], commenter[3]),
+                comment['comment_text'],
+                comment['floor'],
+                comment['time'],
+            ))
+
+        if rows:
+            await db.executemany("""
+                INSERT INTO comments (floor_id, seq, user, user_name, user_url, avatar_url, comment_text, floor, time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+
+async def read_floors(db: aiosqlite.Connection, post_url: str) -> list[dict[str, Any]] | None:
+    '''組回跟原本 JSON blob 一模一樣的 floors，沒有資料回傳 None'''
+    cursor = await db.execute("""
+        SELECT f.id, f.idx, f.tags,
+            COALESCE(f.author_name, u.name), u.user_id, COALESCE(f.author_url, u.url),
+            f.time, f.content, f.content_html, f.like_count, f.dislike_count
+        FROM floors f
+        JOIN users u ON u.id = f.author
+        WHERE f.post_url = ?
+        ORDER BY f.idx
+    """, (post_url,))
+    floor_rows = await cursor.fetchall()
+    if not floor_rows:
+        return None
+
+    floors = []
+    by_id: dict[int, list] = {}
+    for row in floor_rows:
+        comments = []
+        by_id[row[0]] = comments
+        floors.append({
+            'index': row[1],
+            'tags': orjson.loads(row[2]) if row[2] else {},
+            'author': {
+                'name': row[3],
+                'id': row[4],
+                'url': row[5],
+            },
+            'time': row[6],
+            **({'content': row[7]} if row[8] is None else {'content_html': row[8]}),
+            'like_count': row[9],
+            'dislike_count': row[10],
+            'comments': comments,
+        })
+
+    cursor = await db.execute("""
+        SELECT c.floor_id,
+            COALESCE(c.avatar_url, u.avatar_url), COALESCE(c.user_url, u.url), COALESCE(c.user_name, u.name),
+            c.comment_text, c.floor, c.time
+        FROM comments c
+        JOIN users u ON u.id = c.user
+        WHERE c.floor_id IN (SELECT id FROM floors WHERE post_url = ?)
+        ORDER BY c.floor_id, c.seq
+    """, (post_url,))
+    for row in await cursor.fetchall():
+        by_id[row[0]].append({
+            'avatar_url': row[1],
+            'user_url': row[2],
+            'user_name': row[3],
+            'comment_text': row[4],
+            'floor': row[5],
+            'time': row[6],
+        })
+
+    return floors
+
+
+async def migrate(batch_size: int = 500, vacuum: bool = True):
+    '''
+    把 post_info.floors 的 blob 搬進 users / floors / comments，搬完的列 floors 設為 NULL
+    沒有樓層的設成 '[]' (read_floors 讀不到東西，NULL 的話會被當成沒存過)
+    可以中斷後重跑，只會處理 floors 還不是 NULL (或 '[]') 的列
+    '''
+    from .client import get_client, init_tables, shard_ids, writing
+    from .codec import unpack_floors
+
+    await init_tables()
+    total = 0
+    for shard in shard_ids(): # DB_SHARDS 時一個 shard 一個 shard 搬
+        db = await get_client(shard)
+        await init_normalized_tables(db)
+
+        while True:
+            async with writing(db):
+                rows = await db.execute_fetchall(
+                    f"SELECT url, floors FROM post_info WHERE floors IS NOT NULL AND floors != '{EMPTY_FLOORS}' LIMIT ?", (batch_size,),
+                )
+                for url, floors in rows:
+                    floors = orjson.loads(await unpack_floors(floors))
+                    await write_floors(db, url, floors)
+                    await db.execute("UPDATE post_info SET floors = ? WHERE url = ?", (None if floors else EMPTY_FLOORS, url))
+                await db.commit()
+            if not rows:
+                break
+
+            total += len(rows)
+            logger.info(f'Migrated {total} posts to normalized layout')
+
+        if vacuum:
+            # 空出來的頁面要 VACUUM 之後檔案才會變小 (拿著寫入的鎖，才不會遇到別人開著的 transaction)
+            async with writing(db):
+                await db.execute("VACUUM")
+    return total
+
+
+if __name__ == '__main__':
+    from .client import close_client
+
+    async def _main():
+        try:
+            count = await migrate()
+            logger.info(f'Done, {count} posts migrated')
+        finally:
+            await close_client()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,500 @@
+'''
+每個看板、每天的活躍度 / 互動統計 (GET /api/stats)
+
+每次寫入 post_info 時順便更新 (STATS=0 可以關掉):
+    post_stats         -> 每篇貼文一列，記錄這篇對每一天貢獻了多少 (contrib)
+                          同一篇重爬時先扣掉舊的貢獻再加上新的，不會重複計算
+    board_daily_stats  -> (bsn, day) 一列: 貼文 / 樓層 / 留言數、讚 / 噓總和、讚數分布、不重複留言者 (HyperLogLog)
+
+day 是 UTC 日期: 貼文算在樓主發文那天、樓層算在該樓的時間、留言算在留言的時間
+不重複留言者只能加不能減 (HyperLogLog)，重爬時被刪掉的留言者還是會被算進去
+
+全部重算 (有 numpy 會用向量化的版本；舊的資料庫統計是用帶 tnum 的網址記的，啟動時會提醒要跑一次):
+    python -m src.append_to_db.stats
+'''
+import asyncio
+import heapq
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import aiosqlite
+import orjson
+
+from ..hll import HyperLogLog, hash64, add_hashes, M as HLL_M
+from ..records import Floor, HtmlFloor
+from ..utils import post_key, canonical_post_url
+from .normalized import user_id_from_url
+
+logger = logging.getLogger(__name__)
+
+STATS = os.getenv("STATS", "1") != "0"
+
+# 讚數分布的區間 (下限)，最後一格是 1000 以上 (包含「爆」)
+LIKE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000)
+LIKE_BUCKET_LABELS = ('0', '1-4', '5-9', '10-49', '50-99', '100-499', '500-999', '1000+')
+_LIKE_COLUMNS = tuple(f'like_{i}' for i in range(len(LIKE_BUCKETS)))
+
+# 每天的貢獻: [posts, floors, comments, likes, dislikes, like_0 ... like_7]
+_COUNT_COLUMNS = ('posts', 'floors', 'comments', 'likes', 'dislikes') + _LIKE_COLUMNS
+_VECTOR_SIZE = len(_COUNT_COLUMNS)
+
+SORT_KEYS = ('comments', 'posts', 'floors', 'likes', 'dislikes')
+
+USE_NUMPY = True # bench 用來跟純 Python 的版本比
+
+
+def _numpy():
+    '''numpy 很重 (只開 API 的時候用不到)，重算的時候才 import，沒裝的話回傳 None'''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+async def init_stats_tables(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS post_stats (
+            url TEXT PRIMARY KEY,
+            bsn INTEGER,
+            title TEXT,
+            post_day TEXT,
+            floors INTEGER,
+            comments INTEGER,
+            likes INTEGER,
+            dislikes INTEGER,
+            contrib BLOB
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_post_stats_likes ON post_stats (likes)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_post_stats_bsn_day ON post_stats (bsn, post_day)")
+
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS board_daily_stats (
+            bsn INTEGER,
+            day TEXT,
+            {', '.join(f'{column} INTEGER DEFAULT 0' for column in _COUNT_COLUMNS)},
+            commenters BLOB,
+            PRIMARY KEY (bsn, day)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_board_daily_stats_day ON board_daily_stats (day)")
+
+
+def _like_bucket(like_count: int) -> int:
+    for i in range(len(LIKE_BUCKETS) - 1, -1, -1):
+        if like_count >= LIKE_BUCKETS[i]:
+            return i
+    return 0
+
+
+def _floor_fields(floor: dict[str, Any] | Floor | HtmlFloor) -> tuple[str, int, int, list[tuple[str, str]]]:
+    '''(time, like_count, dislike_count, [(留言 time, user_url)])，從資料庫讀的 dict 跟剛解析好的 Floor 都可以'''
+    if isinstance(floor, dict):
+        comments = [(comment['time'], comment['user_url']) for comment in floor['comments']]
+        return floor['time'], floor['like_count'], floor['dislike_count'], comments
+    return floor.time, floor.like_count, floor.dislike_count, [(comment.time, comment.user_url) for comment in floor.comments]
+
+
+def post_contribution(floors: list[dict[str, Any]] | list[Floor | HtmlFloor]) -> tuple[dict[str, list[int]], dict[str, set[str]]]:
+    '''
+    Returns:
+        ({day: [posts, floors, comments, likes, dislikes, like_0...]}, {day: {留言者 user id}})
+    '''
+    contrib: dict[str, list[int]] = defaultdict(lambda: [0] * _VECTOR_SIZE)
+    commenters: dict[str, set[str]] = defaultdict(set)
+    if not floors:
+        return {}, {}
+
+    for i, floor in enumerate(floors):
+        time, like_count, dislike_count, comments = _floor_fields(floor)
+        vector = contrib[time[:10]]
+        if i == 0:
+            vector[0] += 1 # 貼文算在樓主發文那天
+        vector[1] += 1
+        vector[3] += like_count
+        vector[4] += dislike_count
+        vector[5 + _like_bucket(like_count)] += 1
+
+        for comment_time, user_url in comments:
+            day = comment_time[:10]
+            contrib[day][2] += 1
+            commenters[day].add(user_id_from_url(user_url))
+
+    return dict(contrib), dict(commenters)
+
+
+def _totals(contrib: dict[str, list[int]]) -> list[int]:
+    return [sum(vector[i] for vector in contrib.values()) for i in range(5)]
+
+
+_UPSERT_DAILY = f"""
+    INSERT INTO board_daily_stats (bsn, day, {', '.join(_COUNT_COLUMNS)})
+    VALUES (?, ?, {', '.join('?' * _VECTOR_SIZE)})
+    ON CONFLICT (bsn, day) DO UPDATE SET
+        {', '.join(f'{column} = {column} + excluded.{column}' for column in _COUNT_COLUMNS)}
+"""
+
+_UPSERT_POST = """
+    INSERT OR REPLACE INTO post_stats (url, bsn, title, post_day, floors, comments, likes, dislikes, contrib)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+async def record_post(db: aiosqlite.Connection, post_url: str, title: str, floors: list[dict[str, Any]] | list[Floor | HtmlFloor]):
+    '''
+    寫入 post_info 時呼叫 (同一個 transaction，不 commit)
+    呼叫端要拿著 client.writing(db)，HyperLogLog 是讀出來合併再寫回去的，兩篇同時寫會互相蓋掉
+    floors: 爬蟲剛解析好的 Post.floors 直接丟進來，不用再 orjson.loads 一次
+    '''
+    key = post_key(post_url)
+    if key is None or not floors:
+        return
+    bsn = key[0]
+    post_url = canonical_post_url(*key) # 帶 tnum 的網址也要算成同一篇
+
+    new, commenters = post_contribution(floors)
+    # 寫入的連線是共用的，execute 跟 fetch 分兩次的話中間別人 commit 會失敗 (statement 還沒跑完)
+    # execute_fetchall 在同一次裡跑完
+    existing = await db.execute_fetchall("SELECT contrib FROM post_stats WHERE url = ?", (post_url,))
+    old = orjson.loads(existing[0][0]) if existing and existing[0][0] else {}
+
+    # 只寫有變的那幾天
+    rows = []
+    for day in new.keys() | old.keys():
+        new_vector = new.get(day, [0] * _VECTOR_SIZE)
+        old_vector = old.get(day, [0] * _VECTOR_SIZE)
+        delta = [a - b for a, b in zip(new_vector, old_vector)]
+        if any(delta) or day in commenters:
+            rows.append((bsn, day, *delta))
+    if rows:
+        await db.executemany(_UPSERT_DAILY, rows)
+
+    if commenters:
+        days = list(commenters)
+        sketches = {
+            day: HyperLogLog.from_bytes(blob)
+            for day, blob in await db.execute_fetchall(
+                f"SELECT day, commenters FROM board_daily_stats WHERE bsn = ? AND day IN ({','.join('?' * len(days))})",
+                (bsn, *days),
+            )
+        }
+        updates = []
+        for day, users in commenters.items():
+            sketch = sketches.get(day) or HyperLogLog()
+            for user in users:
+                sketch.add(user)
+            updates.append((sketch.to_bytes(), bsn, day))
+        await db.executemany("UPDATE board_daily_stats SET commenters = ? WHERE bsn = ? AND day = ?", updates)
+
+    await db.execute(_UPSERT_POST, (
+        post_url, bsn, title, _floor_fields(floors[0])[0][:10], *_totals(new)[1:], orjson.dumps(new),
+    ))
+
+
+# 全部重算
+
+def _aggregate_python(bsn: int, posts: list[tuple[str, str, list[dict[str, Any]], str]]) -> tuple[list[tuple], list[tuple]]:
+    daily: dict[str, list[int]] = defaultdict(lambda: [0] * _VECTOR_SIZE)
+    sketches: dict[str, HyperLogLog] = defaultdict(HyperLogLog)
+    post_rows = []
+    for url, title, floors, _ in posts:
+        if not floors:
+            continue
+        contrib, commenters = post_contribution(floors)
+        for day, vector in contrib.items():
+            total = daily[day]
+            for i, value in enumerate(vector):
+                total[i] += value
+        for day, users in commenters.items():
+            for user in users:
+                sketches[day].add(user)
+        post_rows.append((url, bsn, title, floors[0]['time'][:10], *_totals(contrib)[1:], orjson.dumps(contrib)))
+
+    daily_rows = [
+        (bsn, day, *vector, sketches[day].to_bytes() if day in sketches else None)
+        for day, vector in daily.items()
+    ]
+    return post_rows, daily_rows
+
+
+def _aggregate_numpy(bsn: int, posts: list[tuple[str, str, list[dict[str, Any]], str]]) -> tuple[list[tuple], list[tuple]]:
+    '''跟 _aggregate_python 結果一樣，攤平成陣列之後用 bincount 分組加總'''
+    np = _numpy()
+    posts = [post for post in posts if post[2]]
+    day_ids: dict[str, int] = {}
+
+    def day_id(iso: str) -> int:
+        return day_ids.setdefault(iso[:10], len(day_ids))
+
+    user_hashes: dict[str, int] = {} # 同一個人會留很多次言，urlparse + hash 只做一次
+
+    post_day, floor_post, floor_day, likes, dislikes = [], [], [], [], []
+    comment_post, comment_day, comment_hash = [], [], []
+    for i, (_, _, floors, _) in enumerate(posts):
+        post_day.append(day_id(floors[0]['time']))
+        for floor in floors:
+            floor_post.append(i)
+            floor_day.append(day_id(floor['time']))
+            likes.append(floor['like_count'])
+            dislikes.append(floor['dislike_count'])
+            for comment in floor['comments']:
+                comment_post.append(i)
+                comment_day.append(day_id(comment['time']))
+                user_url = comment['user_url']
+                user_hash = user_hashes.get(user_url)
+                if user_hash is None:
+                    user_hash = user_hashes[user_url] = hash64(user_id_from_url(user_url))
+                comment_hash.append(user_hash)
+
+    n_posts, n_days = len(posts), max(len(day_ids), 1)
+    post_day = np.array(post_day, dtype=np.int64)
+    floor_day = np.array(floor_day, dtype=np.int64)
+    comment_day = np.array(comment_day, dtype=np.int64)
+    likes = np.array(likes, dtype=np.int64)
+    dislikes = np.array(dislikes, dtype=np.int64)
+    buckets = np.searchsorted(LIKE_BUCKETS, likes, side='right') - 1
+
+    def vectors(post_group, floor_group, comment_group, size: int) -> np.ndarray:
+        '''每一組的 [posts, floors, comments, likes, dislikes, like_0...]，shape (size, _VECTOR_SIZE)'''
+        result = np.zeros((size, _VECTOR_SIZE), dtype=np.int64)
+        result[:, 0] = np.bincount(post_group, minlength=size)
+        result[:, 1] = np.bincount(floor_group, minlength=size)
+        result[:, 2] = np.bincount(comment_group, minlength=size)
+        result[:, 3] = np.bincount(floor_group, weights=likes, minlength=size)
+        result[:, 4] = np.bincount(floor_group, weights=dislikes, minlength=size)
+        result[:, 5:] = np.bincount(
+            floor_group * len(LIKE_BUCKETS) + buckets, minlength=size * len(LIKE_BUCKETS),
+        ).reshape(size, len(LIKE_BUCKETS))
+        return result
+
+    # 每天 (整個看板)
+    daily = vectors(post_day, floor_day, comment_day, n_days)
+    registers = np.zeros((n_days, HLL_M), dtype=np.uint8)
+    has_comments = np.bincount(comment_day, minlength=n_days) > 0
+    add_hashes(registers, comment_day, np.array(comment_hash, dtype=np.uint64))
+
+    days = list(day_ids)
+    daily_rows = [
+        (bsn, days[d], *daily[d].tolist(), registers[d].tobytes() if has_comments[d] else None)
+        for d in range(len(days))
+    ]
+
+    # 每篇 x 每天: 只算有出現的 (post, day) 組合，n_posts x n_days 整個攤開的話很長的看板會好幾 GB
+    post_keys = np.arange(n_posts, dtype=np.int64) * n_days + post_day
+    floor_keys = np.array(floor_post, dtype=np.int64) * n_days + floor_day
+    comment_keys = np.array(comment_post, dtype=np.int64) * n_days + comment_day
+    keys, inverse = np.unique(np.concatenate((post_keys, floor_keys, comment_keys)), return_inverse=True)
+    post_group, floor_group, comment_group = np.split(inverse.ravel(), [len(post_keys), len(post_keys) + len(floor_keys)])
+    per_key = vectors(post_group, floor_group, comment_group, len(keys)).tolist()
+
+    # keys 排好了，同一篇的會連在一起 (day 也照 day_ids 的順序，跟 _aggregate_python 一樣)
+    key_days = (keys % n_days).tolist()
+    bounds = np.searchsorted(keys // n_days, np.arange(n_posts + 1)).tolist()
+    post_rows = []
+    for i, (url, title, floors, _) in enumerate(posts):
+        contrib = {days[key_days[k]]: per_key[k] for k in range(bounds[i], bounds[i + 1])}
+        post_rows.append((url, bsn, title, floors[0]['time'][:10], *_totals(contrib)[1:], orjson.dumps(contrib)))
+    return post_rows, daily_rows
+
+
+async def rebuild() -> int:
+    '''清掉統計，從 post_info 全部重算 (一個 shard 一個 shard、一個看板一個看板來，記憶體才不會爆)'''
+    from .client import init_tables, shard_ids
+
+    await init_tables()
+    count = 0
+    for shard in shard_ids():
+        count += await rebuild_shard(shard)
+    return count
+
+
+async def has_stale_keys(db: aiosqlite.Connection) -> bool:
+    '''post_stats 裡還有不是 canonical_post_url 的 (以前用帶 tnum 的網址記的)，要重算'''
+    rows = await db.execute_fetchall("""
+        SELECT 1 FROM post_stats
+        WHERE url NOT GLOB 'https://forum.gamer.com.tw/C.php?bsn=[0-9]*&snA=[0-9]*' OR url GLOB '*&snA=*[^0-9]*'
+        LIMIT 1
+    """)
+    return bool(rows)
+
+
+async def rebuild_shard(shard: int | None) -> int:
+    from .client import get_client, get_reader, writing
+    from .func import load_posts
+
+    async with get_reader(shard) as reader:
+        cursor = await reader.execute("SELECT url FROM post_info")
+        urls = [row[0] for row in await cursor.fetchall()]
+
+    # 同一篇 (post_key 一樣) 只算一次，網址一律用 canonical_post_url
+    by_board: dict[int, dict[int, str]] = defaultdict(dict)
+    for url in urls:
+        key = post_key(url)
+        if key is not None:
+            by_board[key[0]].setdefault(key[1], url)
+
+    aggregate = _aggregate_numpy if USE_NUMPY and _numpy() is not None else _aggregate_python
+    db = await get_client(shard)
+    async with writing(db):
+        await db.execute("DELETE FROM post_stats")
+        await db.execute("DELETE FROM board_daily_stats")
+        count = 0
+        for bsn, board_urls in by_board.items():
+            posts = [
+                (canonical_post_url(*post_key(url)), title, floors, updated_at)
+                for url, title, floors, updated_at in await load_posts(list(board_urls.values()))
+            ]
+            post_rows, daily_rows = await asyncio.to_thread(aggregate, bsn, posts)
+            await db.executemany(_UPSERT_POST, post_rows)
+            await db.executemany(f"""
+                INSERT INTO board_daily_stats (bsn, day, {', '.join(_COUNT_COLUMNS)}, commenters)
+                VALUES (?, ?, {', '.join('?' * _VECTOR_SIZE)}, ?)
+            """, daily_rows)
+            count += len(post_rows)
+            logger.info(f'Rebuilt stats for {bsn} ({len(post_rows)} posts)')
+        await db.commit()
+    return count
+
+
+# 查詢
+
+async def _query_shard(db: aiosqlite.Connection, days: int, since: str, bsn: int | None, sort: str, limit: int) -> dict[str, Any]:
+    '''一個 shard 裡的 boards / top_posts / like_histogram (同一個看板只會在一個 shard，所以每個看板的數字是完整的)'''
+    board_filter, params = ("AND bsn = ?", (since, bsn)) if bsn is not None else ("", (since,))
+
+    cursor = await db.execute(f"""
+        SELECT bsn, {', '.join(f'SUM({column})' for column in _COUNT_COLUMNS)}
+        FROM board_daily_stats
+        WHERE day >= ? {board_filter}
+        GROUP BY bsn
+        ORDER BY SUM({sort}) DESC
+        LIMIT ?
+    """, (*params, limit))
+    board_rows = await cursor.fetchall()
+
+    boards = []
+    for row in board_rows:
+        boards.append({
+            'bsn': row[0],
+            **{column: row[i + 1] for i, column in enumerate(_COUNT_COLUMNS[:5])},
+            'comments_per_day': round(row[3] / days, 2),
+            'unique_commenters': 0,
+        })
+
+    if boards:
+        # 只合併這一頁看板的 sketch
+        placeholders = ','.join('?' * len(boards))
+        cursor = await db.execute(f"""
+            SELECT bsn, commenters FROM board_daily_stats
+            WHERE day >= ? AND bsn IN ({placeholders}) AND commenters IS NOT NULL
+        """, (since, *[board['bsn'] for board in boards]))
+        sketches: dict[int, HyperLogLog] = {}
+        for board_bsn, blob in await cursor.fetchall():
+            sketch = HyperLogLog.from_bytes(blob)
+            if board_bsn in sketches:
+                sketches[board_bsn].merge(sketch)
+            else:
+                sketches[board_bsn] = sketch
+        for board in boards:
+            if board['bsn'] in sketches:
+                board['unique_commenters'] = sketches[board['bsn']].count()
+
+    cursor = await db.execute(f"""
+        SELECT url, bsn, title, post_day, floors, comments, likes, dislikes
+        FROM post_stats
+        WHERE post_day >= ? {board_filter}
+        ORDER BY likes DESC
+        LIMIT ?
+    """, (*params, limit))
+    top_posts = [dict(row) for row in await cursor.fetchall()]
+
+    cursor = await db.execute(f"""
+        SELECT {', '.join(f'COALESCE(SUM({column}), 0)' for column in _LIKE_COLUMNS)}
+        FROM board_daily_stats
+        WHERE day >= ? {board_filter}
+    """, params)
+    histogram = list(await cursor.fetchone())
+
+    return {'boards': boards, 'top_posts': top_posts, 'like_histogram': histogram}
+
+
+async def query_stats(days: int = 7, bsn: int | None = None, sort: str = 'comments', limit: int = 20) -> dict[str, Any]:
+    '''
+    最近 days 天 (UTC，含今天) 的統計，DB_SHARDS 時每個 shard 同時查再合併
+
+    Returns:
+        boards: 依 sort 排序的看板 (含不重複留言者、每天平均留言數)
+        top_posts: 這段期間發的文裡讚數最多的
+        like_histogram: 樓層讚數分布
+        daily: 有指定 bsn 時，每天的數字
+    '''
+    from .client import fan_out, get_reader, shard_of
+
+    if sort not in SORT_KEYS:
+        raise ValueError(f'sort must be one of {SORT_KEYS}')
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+
+    if bsn is not None:
+        async with get_reader(shard_of(bsn)) as db:
+            parts = [await _query_shard(db, days, since, bsn, sort, limit)]
+    else:
+        parts = await fan_out(lambda db: _query_shard(db, days, since, bsn, sort, limit))
+
+    boards = heapq.nlargest(limit, (board for part in parts for board in part['boards']), key=lambda board: board[sort])
+    if boards:
+        async with get_reader() as db: # all_themes 在 catalog
+            cursor = await db.execute(
+                f"SELECT bsn, title FROM all_themes WHERE bsn IN ({','.join('?' * len(boards))})",
+                [str(board['bsn']) for board in boards],
+            )
+            titles = {int(row[0]): row[1] for row in await cursor.fetchall()}
+        for board in boards:
+            board['title'] = titles.get(board['bsn'], '')
+
+    result = {
+        'days': days,
+        'since': since,
+        'sort': sort,
+        'boards': boards,
+        'top_posts': heapq.nlargest(limit, (post for part in parts for post in part['top_posts']), key=lambda post: post['likes']),
+        'like_histogram': dict(zip(LIKE_BUCKET_LABELS, (sum(counts) for counts in zip(*(part['like_histogram'] for part in parts))))),
+    }
+
+    if bsn is not None:
+        async with get_reader(shard_of(bsn)) as db:
+            cursor = await db.execute("""
+                SELECT day, posts, floors, comments, likes, dislikes, commenters
+                FROM board_daily_stats
+                WHERE day >= ? AND bsn = ?
+                ORDER BY day
+            """, (since, bsn))
+            result['daily'] = [
+                {
+                    'day': row[0], 'posts': row[1], 'floors': row[2], 'comments': row[3],
+                    'likes': row[4], 'dislikes': row[5],
+                    'unique_commenters': HyperLogLog.from_bytes(row[6]).count() if row[6] else 0,
+                }
+                for row in await cursor.fetchall()
+            ]
+
+    return result
+
+
+async def _main():
+    from .client import close_client
+
+    try:
+        count = await rebuild()
+        logger.info(f'Done, stats rebuilt from {count} posts')
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    from ..utils import init_runtime
+    init_runtime()
+    asyncio.run(_main())
@@ -0,0 +1,55 @@
+'''
+原始 HTML 的存檔 (ARCHIVE_RAW=1 時啟用)
+
+每次抓到的 C.php 以 sha256 為檔名，gzip 後存在 data/archive/objects/ 底下 (內容一樣就只存一份)
+raw_pages 表記錄 (bsn, snA, fetched_at) -> sha256，之後可以用 `python -m src.reparse` 重新解析
+'''
+import asyncio
+import gzip
+import os
+from datetime import datetime, timezone
+from hashlib import sha256
+from pathlib import Path
+
+from .append_to_db import get_client as get_db_client
+from .append_to_db.client import writing
+from .utils import post_key
+
+ARCHIVE_DIR = Path('data/archive')
+ARCHIVE_RAW = os.getenv('ARCHIVE_RAW', '0') == '1'
+
+
+def object_path(digest: str) -> Path:
+    return ARCHIVE_DIR / 'objects' / digest[:2] / f'{digest[2:]}.gz'
+
+
+def _write_object(data: bytes) -> str:
+    digest = sha256(data).hexdigest()
+    path = object_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(gzip.compress(data, 6))
+        tmp.replace(path) # 寫完才換名，避免讀到一半的檔案
+    return digest
+
+
+def read_object(digest: str) -> str:
+    return gzip.decompress(object_path(digest).read_bytes()).decode()
+
+
+async def archive_page(post_url: str, html: str):
+    key = post_key(post_url)
+    if key is None:
+        return
+
+    fetched_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    digest = await asyncio.to_thread(_write_object, html.encode())
+
+    db = await get_db_client()
+    async with writing(db):
+        await db.execute("""
+            INSERT OR IGNORE INTO raw_pages (bsn, snA, fetched_at, url, sha256)
+            VALUES (?, ?, ?, ?, ?)
+        """, (key[0], key[1], fetched_at, post_url, digest))
+        await db.commit()
@@ -0,0 +1,71 @@
+'''
+從資料庫匯出每個看板的 JSONL (data/{bsn}-{title}.jsonl)
+CONTENT_MODE=html 時爬蟲不會寫 JSONL，內文在這裡才轉成 markdown
+
+    python -m src.export [--bsn 60076]
+'''
+import argparse
+import asyncio
+import logging
+
+import orjson
+
+from .append_to_db import init_tables, get_reader, close_client, get_post_info, shard_of
+from .render import render_floors
+from .utils import DATA_DIR, safe_filename, init_runtime
+
+logger = logging.getLogger(__name__)
+
+
+async def export_board(bsn: str, title: str) -> int:
+    async with get_reader(shard_of(bsn)) as db:
+        cursor = await db.execute("SELECT post_url FROM all_posts WHERE bsn = ?", (bsn,))
+        urls = [row[0] for row in await cursor.fetchall()]
+
+    count = 0
+    with open(DATA_DIR / f'{bsn}-{safe_filename(title)}.jsonl', 'wb') as f:
+        for url in urls:
+            info = await get_post_info(url)
+            if info is None:
+                continue
+            floors = await asyncio.to_thread(render_floors, orjson.loads(info['floors']))
+            f.write(orjson.dumps({
+                'theme_title': title,
+                'title': info['title'],
+                'url': url,
+                'floors': floors,
+            }) + b'\n')
+            count += 1
+    return count
+
+
+async def export(bsn: str | None = None):
+    await init_tables()
+
+    sql = "SELECT bsn, title FROM all_themes"
+    params = ()
+    if bsn:
+        sql += " WHERE bsn = ?"
+        params = (bsn,)
+    async with get_reader() as db:
+        cursor = await db.execute(sql, params)
+        themes = await cursor.fetchall()
+
+    for theme_bsn, title in themes:
+        count = await export_board(theme_bsn, title)
+        logger.info(f'Exported {count} posts for {theme_bsn} ({title})')
+
+
+async def _main(args: argparse.Namespace):
+    try:
+        await export(args.bsn)
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export posts from the database to JSONL')
+    parser.add_argument('--bsn', help='only export this board')
+    args = parser.parse_args()
+    init_runtime()
+    asyncio.run(_main(args))
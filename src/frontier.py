@@ -0,0 +1,340 @@
+'''
+爬的時候記「看過哪些貼文」用的緊湊結構
+
+每篇貼文用一個整數 key = (bsn << 32) | snA 表示，不存完整網址字串
+- PostFrontier: 一個看板 B.php 列表上的貼文 (去重 + 回覆數 / GP / 最後回覆時間)，全部存在 array 裡，一篇約 40 bytes
+- BloomFilter: 存進 post_info 過的貼文 (跨次執行)，SEEN_BLOOM=1 時啟用，存在 data/seen.bloom (每個看板爬完存一次)
+  超過 SEEN_BLOOM_CAPACITY 篇的話會用 post_info 重建一個兩倍大的
+  不在裡面的一定沒存過，可以省掉一次查資料庫；在裡面的還是要查 (有誤判)
+
+    python -m bench.frontier   # 每篇佔幾 bytes
+'''
+import asyncio
+import logging
+import math
+import os
+import struct
+from array import array
+from hashlib import blake2b
+from typing import Iterator
+
+from .append_to_db import fan_out
+from .records import PostListing
+from .utils import DATA_DIR, canonical_post_url, post_key
+
+logger = logging.getLogger(__name__)
+
+
+def pack_key(bsn: int, snA: int) -> int:
+    return (bsn << 32) | snA
+
+
+def unpack_key(key: int) -> tuple[int, int]:
+    return key >> 32, key & 0xFFFFFFFF
+
+
+def _pack_time(last_reply: str | None) -> int:
+    '''
+    'YYYY-MM-DD HH:MM' -> YYYYMMDDHHMM，'YYYY-MM-DD' -> YYYYMMDD (位數不同，解得回來)，None -> 0
+    '''
+    if not last_reply:
+        return 0
+    try:
+        return int(last_reply.replace('-', '').replace(' ', '').replace(':', ''))
+    except ValueError:
+        return 0
+
+
+def _unpack_time(value: int) -> str | None:
+    if value == 0:
+        return None
+    text = str(value)
+    result = f'{text[:4]}-{text[4:6]}-{text[6:8]}'
+    if len(text) > 8:
+        result += f' {text[8:10]}:{text[10:12]}'
+    return result
+
+
+_GOLDEN = 0x9E3779B97F4A7C15
+_U64 = 0xFFFFFFFFFFFFFFFF
+
+
+class PostFrontier:
+    '''
+    一個看板列表上的貼文，照第一次看到的順序
+    同一篇出現很多次 (標題連結、最後回覆連結...) 只留一筆，有列表資訊的會蓋掉沒有的
+
+    open addressing 的 hash 表 (_slots 存位置 + 1，0 是空的)，資料放在平行的 array 裡
+    '''
+    __slots__ = ('_keys', '_reply_count', '_gp', '_last_reply', '_slots', '_mask', '_shift')
+
+    def __init__(self):
+        self._keys = array('Q')
+        self._reply_count = array('i') # -1 是不知道
+        self._gp = array('i')
+        self._last_reply = array('Q') # 見 _pack_time
+        self._slots = array('L', bytes(array('L').itemsize * 16))
+        self._mask = 15
+        self._shift = 64 - 4
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: int) -> bool:
+        return self._find(key)[1] >= 0
+
+    def _home(self, key: int) -> int:
+        # Fibonacci hashing: 乘完取高位，不同 bsn (只差在高 32 bit) 才不會擠在同一格
+        return ((key * _GOLDEN) & _U64) >> self._shift
+
+    def _find(self, key: int) -> tuple[int, int]:
+        '''(slot, 位置)，沒有的話位置是 -1，slot 是可以放的空位'''
+        slot = self._home(key)
+        while True:
+            index = self._slots[slot] - 1
+            if index < 0 or self._keys[index] == key:
+                return slot, index
+            slot = (slot + 1) & self._mask
+
+    def _grow(self):
+        size = (self._mask + 1) * 2
+        self._slots = array('L', bytes(self._slots.itemsize * size))
+        self._mask = size - 1
+        self._shift -= 1
+        for index, key in enumerate(self._keys):
+            slot = self._home(key)
+            while self._slots[slot]:
+                slot = (slot + 1) & self._mask
+            self._slots[slot] = index + 1
+
+    def add(self, key: int, listing: PostListing | None = None) -> bool:
+        '''新的回傳 True'''
+        slot, index = self._find(key)
+        reply_count = -1 if listing is None or listing.reply_count is None else listing.reply_count
+        gp = -1 if listing is None or listing.gp is None else listing.gp
+        last_reply = 0 if listing is None else _pack_time(listing.last_reply)
+
+        if index >= 0:
+            if listing is not None:
+                self._reply_count[index] = reply_count
+                self._gp[index] = gp
+                self._last_reply[index] = last_reply
+            return False
+
+        self._slots[slot] = len(self._keys) + 1
+        self._keys.append(key)
+        self._reply_count.append(reply_count)
+        self._gp.append(gp)
+        self._last_reply.append(last_reply)
+        if len(self._keys) * 3 > (self._mask + 1) * 2: # load factor 2/3
+            self._grow()
+        return True
+
+    def items(self) -> Iterator[tuple[str, PostListing | None]]:
+        '''
+        (canonical_post_url, 列表資訊) 一次組一筆，不會同時全部留在記憶體
+        不在列表的列裡面的連結 (什麼都不知道) 是 None
+        '''
+        for i, key in enumerate(self._keys):
+            url = canonical_post_url(*unpack_key(key))
+            reply_count, gp, last_reply = self._reply_count[i], self._gp[i], self._last_reply[i]
+            if reply_count < 0 and gp < 0 and last_reply == 0:
+                yield url, None
+            else:
+                yield url, PostListing(
+                    url=url,
+                    reply_count=None if reply_count < 0 else reply_count,
+                    gp=None if gp < 0 else gp,
+                    last_reply=_unpack_time(last_reply),
+                )
+
+    def rows(self, bsn: str) -> Iterator[tuple[str, str, int | None, int | None, str | None]]:
+        '''給 add_to_all_posts 的 (post_url, bsn, reply_count, gp, last_reply)'''
+        for url, listing in self.items():
+            if listing is None:
+                yield url, bsn, None, None, None
+            else:
+                yield url, bsn, listing.reply_count, listing.gp, listing.last_reply
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self._keys, self._reply_count, self._gp, self._last_reply, self._slots))
+
+
+class BloomFilter:
+    '''
+    k 個 hash 用 double hashing (一次 blake2b 切兩半)
+    count 是加進來的 (有翻到新 bit 的) 篇數，超過 capacity 之後誤判率會一直往上，要換一個大的 (見 full)
+    '''
+    _HEADER = struct.Struct('<4sQIQQ') # magic, 幾個 bit, 幾個 hash, capacity, count
+    _HEADER_V1 = struct.Struct('<4sQI') # 舊的檔案沒有 capacity / count
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: int) -> Iterator[int]:
+        digest = blake2b(key.to_bytes(8, 'little'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: int) -> bool:
+        '''新的 (至少翻到一個 bit) 回傳 True'''
+        new = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+    def to_bytes(self) -> bytes:
+        return self._HEADER.pack(b'BLM2', self.size, self.hashes, self.capacity, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        bloom = cls.__new__(cls)
+        magic = data[:4]
+        if magic == b'BLM2':
+            _, bloom.size, bloom.hashes, bloom.capacity, bloom.count = cls._HEADER.unpack_from(data)
+            bloom.bits = bytearray(data[cls._HEADER.size:])
+        elif magic == b'BLM1':
+            _, bloom.size, bloom.hashes = cls._HEADER_V1.unpack_from(data)
+            bloom.bits = bytearray(data[cls._HEADER_V1.size:])
+            # 從 bit 的數量反推大概加過幾篇
+            bloom.capacity = max(1, round(bloom.size * math.log(2) ** 2 / -math.log(0.01))) # 以前都是用預設的誤判 1% 建的
+            ones = int.from_bytes(bloom.bits).bit_count()
+            bloom.count = bloom.capacity * 2 if ones >= bloom.size else round(-bloom.size / bloom.hashes * math.log(1 - ones / bloom.size))
+        else:
+            raise ValueError('not a bloom filter file')
+        return bloom
+
+
+# 跨次執行的 (SEEN_BLOOM=1)
+
+SEEN_BLOOM = os.getenv('SEEN_BLOOM', '0') == '1'
+SEEN_BLOOM_CAPACITY = int(os.getenv('SEEN_BLOOM_CAPACITY', 2_000_000)) # 預設約 2.3 MiB，誤判 1%
+SEEN_PATH = DATA_DIR / 'seen.bloom'
+
+SEEN: BloomFilter | None = None
+_BUILDING: BloomFilter | None = None # 重建中的 (建好之前 mark_seen 的也要加進去)
+_GROW_TASK: asyncio.Task | None = None
+_SEEN_LOCK = asyncio.Lock() # 很多篇同時第一次用的時候只建一次
+_SAVE_LOCK = asyncio.Lock() # 好幾個看板同時爬完的話，一次只寫一個
+_UNSAVED = 0 # 上次存檔之後新加了幾篇
+
+
+async def _build_seen(capacity: int) -> BloomFilter:
+    '''用每個 shard 的 post_info 建一個新的 (post_info 本來就比 capacity 多的話再放大重建)'''
+    global _BUILDING
+    while True:
+        bloom = _BUILDING = BloomFilter(capacity)
+
+        async def scan(db):
+            cursor = await db.execute("SELECT url FROM post_info")
+            while rows := await cursor.fetchmany(10000):
+                for (url,) in rows:
+                    key = post_key(url)
+                    if key is not None:
+                        bloom.add(pack_key(*key))
+
+        try:
+            await fan_out(scan)
+        finally:
+            _BUILDING = None
+        if not bloom.full:
+            return bloom
+        capacity = bloom.count * 2
+
+
+async def load_seen() -> BloomFilter | None:
+    '''第一次用的時候從 data/seen.bloom 讀；沒有檔案 (或是已經超過 capacity) 的話用 post_info 建一個'''
+    global SEEN, _UNSAVED
+    if not SEEN_BLOOM or SEEN is not None:
+        return SEEN
+
+    async with _SEEN_LOCK:
+        if SEEN is not None:
+            return SEEN
+
+        capacity = SEEN_BLOOM_CAPACITY
+        try:
+            saved = BloomFilter.from_bytes(SEEN_PATH.read_bytes())
+            if not saved.full:
+                SEEN = saved
+                return SEEN
+            capacity = max(capacity, saved.capacity * 2)
+            logger.info(f'{SEEN_PATH} has {saved.count} posts (capacity {saved.capacity}), rebuilding with capacity {capacity}')
+        except FileNotFoundError:
+            pass
+
+        SEEN = await _build_seen(capacity)
+        _UNSAVED += 1 # 下次 flush_seen 要存
+        logger.info(f'Built {SEEN_PATH} from post_info')
+        return SEEN
+
+
+async def _grow_seen():
+    '''超過 capacity 了: 建一個兩倍大的換掉 (Bloom filter 沒辦法直接放大，要重新加一次)'''
+    global SEEN, _UNSAVED
+    async with _SEEN_LOCK:
+        if SEEN is None or not SEEN.full:
+            return
+        capacity = SEEN.capacity * 2
+        logger.info(f'seen.bloom has {SEEN.count} posts, rebuilding with capacity {capacity}')
+        SEEN = await _build_seen(capacity)
+        _UNSAVED += 1
+
+
+def mark_seen(key: int):
+    '''存進 post_info 之後呼叫'''
+    global _UNSAVED, _GROW_TASK
+    if SEEN is not None:
+        SEEN.add(key)
+        if _BUILDING is not None:
+            _BUILDING.add(key) # 重建的時候可能已經掃過這篇了
+        _UNSAVED += 1
+        if SEEN.full and _GROW_TASK is None:
+            # 重建的期間還是用舊的 (誤判多一點而已)
+            _GROW_TASK = asyncio.create_task(_grow_seen(), name='grow_seen')
+            _GROW_TASK.add_done_callback(_on_grow_done)
+
+
+def _on_grow_done(task: asyncio.Task):
+    global _GROW_TASK
+    _GROW_TASK = None
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Error while rebuilding seen.bloom', exc_info=task.exception())
+
+
+def save_seen():
+    global _UNSAVED
+    if SEEN is None:
+        return
+    added, data = _UNSAVED, SEEN.to_bytes()
+    DATA_DIR.mkdir(exist_ok=True)
+    tmp = SEEN_PATH.with_suffix('.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, SEEN_PATH)
+    _UNSAVED -= added # 寫檔的期間加的下次再存
+
+
+async def flush_seen():
+    '''有新加的才存 (每個看板爬完呼叫)，當掉的話最多只少掉正在爬的看板存的那些'''
+    if SEEN is None or not _UNSAVED:
+        return
+    async with _SAVE_LOCK:
+        if _UNSAVED:
+            await asyncio.to_thread(save_seen)
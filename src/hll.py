@@ -0,0 +1,89 @@
+'''
+HyperLogLog: 用固定大小 (2^p bytes) 估計不重複的數量，誤差約 1.04 / sqrt(2^p)
+p=10 -> 1 KiB，誤差約 3%
+
+用來算每個看板每天有幾個不同的留言者；只能加不能減，合併 (union) 就是每個 register 取 max
+有 numpy 的話 merge / 大量 add 會用向量化的版本 (見 add_hashes)，numpy 很重所以用到才 import
+'''
+from hashlib import blake2b
+from math import log
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+P = 10
+M = 1 << P
+_W_BITS = 64 - P
+_W_MASK = (1 << _W_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / M)
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    __slots__ = ('registers',)
+
+    def __init__(self, registers: bytes | bytearray | None = None):
+        self.registers = bytearray(registers) if registers else bytearray(M)
+
+    def add(self, value: str):
+        h = hash64(value)
+        idx = h >> _W_BITS
+        rho = _W_BITS - (h & _W_MASK).bit_length() + 1 # 剩下的 bits 前面有幾個 0，+1
+        if rho > self.registers[idx]:
+            self.registers[idx] = rho
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        if np is not None:
+            merged = np.maximum(np.frombuffer(self.registers, np.uint8), np.frombuffer(other.registers, np.uint8))
+            self.registers[:] = merged.tobytes()
+        else:
+            self.registers[:] = bytes(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        zeros = self.registers.count(0)
+        estimate = _ALPHA * M * M / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * M and zeros:
+            estimate = M * log(M / zeros) # 數量少的時候用 linear counting 比較準
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes | None) -> 'HyperLogLog':
+        return cls(data)
+
+
+def add_hashes(registers: 'np.ndarray', groups: 'np.ndarray', hashes: 'np.ndarray'):
+    '''
+    向量化的大量 add (bulk recompute 用)
+
+    Args:
+        registers: shape (組數, M) 的 uint8
+        groups: 每個值屬於哪一組
+        hashes: 每個值的 hash64 (uint64)
+    '''
+    import numpy as np
+
+    idx = (hashes >> np.uint64(_W_BITS)).astype(np.int64)
+    w = hashes & np.uint64(_W_MASK)
+
+    # bit_length，二分搜尋 6 次 (w < 2^54)
+    bit_length = np.zeros(len(w), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (w >> np.uint64(shift)) != 0
+        bit_length += np.where(high, shift, 0)
+        w = np.where(high, w >> np.uint64(shift), w)
+    bit_length += (w != 0)
+
+    rho = (_W_BITS - bit_length + 1).astype(np.uint8)
+    np.maximum.at(registers, (groups, idx), rho)
@@ -1,108 +1,153 @@
 import asyncio
 import logging
-import random
+import os
+from typing import AsyncIterator
 
-from . import utils
-from .utils import HttpxClient, SCRAPERS, update_status, init_httpx_client, close_httpx_client
+from . import utils, metrics
+from .utils import SCRAPERS, TASKS, SEM, update_status, init_httpx_client, close_httpx_client, fetch_with_retry
 from .scraper import Scraper
+from .monitor import MONITOR
+from .status import Status
 from .append_to_db import (
     init_tables,
-    get_client as get_db_client,
+    get_reader,
     close_client as close_db_client,
     add_to_all_themes,
 )
 from .append_to_db.type import ThemeModel
+from .frontier import save_seen
+from . import media
 
 logger = logging.getLogger(__name__)
-page_count = 0
-TASKS = []
+
+# board_list.php 同時預抓幾頁 (一樣要搶 SEM)
+DISCOVERY_PREFETCH = int(os.getenv('DISCOVERY_PREFETCH', '3'))
+
+# /metrics 被抓的時候才算
+metrics.QUEUE_DEPTH.set_function(lambda: len(utils.WRITE_DB_TASKS), queue='write_db')
+metrics.QUEUE_DEPTH.set_function(lambda: sum(len(s.running_tasks) for s in SCRAPERS.values()), queue='post')
+metrics.QUEUE_DEPTH.set_function(lambda: len(TASKS), queue='scraper')
+metrics.QUEUE_DEPTH.set_function(lambda: len(utils.SEM._waiters or ()), queue='sem_waiters')
+
+async def _cached_theme_pages() -> dict[int, list[tuple[str, str]]]:
+    """7 天內的看板列表快取，一次查完全部頁數 {page_count: [(title, bsn), ...]}"""
+    async with get_reader() as conn:
+        cursor = await conn.execute("""
+            SELECT page_count, title, bsn FROM all_themes
+            WHERE updated_at >= datetime('now', '-7 days')
+            ORDER BY page_count, rowid
+        """)
+        rows = await cursor.fetchall()
+
+    pages: dict[int, list[tuple[str, str]]] = {}
+    for page, title, bsn in rows:
+        pages.setdefault(page, []).append((title, bsn))
+    return pages
+
+
+async def _fetch_theme_page(page: int) -> list[tuple[str, str]] | None:
+    """抓一頁 board_list.php，失敗回傳 None，沒資料了回傳空 list"""
+    url = f'https://api.gamer.com.tw/forum/v1/board_list.php?category=&page={page}&origin=forum'
+    async with metrics.timed_acquire(SEM, 'board_list'):
+        resp = await fetch_with_retry(url)
+
+    if not resp or resp.status_code != 200:
+        logger.error(f"Failed to fetch board list: {resp.status_code if resp else 'No response'}")
+        return None
+
+    with metrics.PARSE_SECONDS.time(page='board_list'):
+        themes = [
+            (item['title'].strip(), str(item["bsn"]))
+            for item in resp.json()['data']['list']
+        ]
+
+    if themes:
+        # update to db
+        utils.spawn_db_write(add_to_all_themes([
+            ThemeModel(title=title, bsn=bsn, page_count=page)
+            for title, bsn in themes
+        ]))
+    return themes
+
+
+async def discover_boards() -> AsyncIterator[tuple[int, str, str]]:
+    """
+    依排名順序一個一個吐出看板 (page, title, bsn)
+    有快取的頁直接用，沒有的同時預抓 DISCOVERY_PREFETCH 頁；遇到空頁或抓失敗就停
+    """
+    cached = await _cached_theme_pages()
+    prefetch: dict[int, asyncio.Task] = {}
+    page = 1
+    try:
+        while True:
+            for p in range(page, page + DISCOVERY_PREFETCH):
+                if p not in cached and p not in prefetch:
+                    prefetch[p] = asyncio.create_task(_fetch_theme_page(p), name=f'board_list:{p}')
+
+            if page in cached:
+                metrics.CACHE_REQUESTS_TOTAL.inc(cache='theme', result='hit')
+                logger.info(f"Using cached themes for page {page}")
+                themes = cached[page]
+            else:
+                metrics.CACHE_REQUESTS_TOTAL.inc(cache='theme', result='miss')
+                themes = await prefetch.pop(page)
+
+            if not themes:
+                break # 資料抓完了 (或是抓不到)
+
+            for title, bsn in themes:
+                yield page, title, bsn
+            page += 1
+    finally:
+        # 預抓超過最後一頁的就不要了
+        for task in prefetch.values():
+            task.cancel()
+
 
 async def main():
-    global page_count, TASKS
     try:
+        # event loop lag 監控 (API server 已經啟動的話不會重複)
+        MONITOR.start()
+
         # init httpx client
         await init_httpx_client()
-        assert HttpxClient is not None
 
         # init tables
         await init_tables()
 
-        page_count = 1
+        Status.page_count = 1
         logger.info('Fetching all themes...')
         update_status('fetching_all_themes_start')
 
-        conn = await get_db_client()
-        while True:
-            # 1. 嘗試從資料庫讀取這頁的「新鮮」快取 (7天內)
-            cursor = await conn.execute("""
-                SELECT title, bsn FROM all_themes 
-                WHERE page_count = ? 
-                AND updated_at >= datetime('now', '-7 days')
-            """, (page_count,))
-            cached_rows = await cursor.fetchall()
-            
-            current_page_themes = []
-
-            if cached_rows:
-                logger.info(f"Using cached themes for page {page_count}")
-                # 轉換回 (title, bsn) 格式
-                current_page_themes = [(row[0], row[1]) for row in cached_rows]
-            else:
-                # 2. 如果沒有快取或已過期，則抓取 API
-                url = f'https://api.gamer.com.tw/forum/v1/board_list.php?category=&page={page_count}&origin=forum'
-                
-                # Retry logic for 429
-                resp = None
-                for _ in range(5):
-                    resp = await HttpxClient.get(url)
-                    if resp.status_code == 429:
-                        if resp.headers.get('Retry-After'):
-                            wait_time = int(resp.headers.get('Retry-After'))
-                        else:
-                            wait_time = 5
-
-                        logger.warning(f"Got 429 for {url}, waiting {wait_time}s(isRetryAfter: {resp.headers.get('Retry-After') is not None})...")
-                        await asyncio.sleep(wait_time + random.uniform(5, 10))
-                        continue
-                    break
-
-                if not resp or resp.status_code != 200:
-                    logger.error(f"Failed to fetch board list: {resp.status_code if resp else 'No response'}")
-                    break
-
-                data = resp.json()
-                all_list = data['data']['list']
-                if not all_list: 
-                    break # 資料抓完了，跳出 while
-
-                current_page_themes = [
-                    (item['title'].strip(), str(item["bsn"])) 
-                    for item in all_list
-                ]
-
-                # update to db
-                utils.WRITE_DB_TASKS.append(asyncio.create_task(add_to_all_themes([
-                    ThemeModel(title=title, bsn=bsn, page_count=page_count)
-                    for title, bsn in current_page_themes
-                ])))
-
-            # create scraper
-            for title, bsn in current_page_themes:
-                scraper = Scraper(title, bsn)
-                SCRAPERS.append(scraper)
-                await asyncio.sleep(0.00001)
-
-            page_count += 1
-            update_status(f'fetching_all_themes_{page_count}')
+        # 一找到看板就開始爬，不用等全部頁數都列完
+        seen: set[str] = set()
+        async for page, title, bsn in discover_boards():
+            if bsn in seen:
+                continue # 排名在兩頁之間變動的話可能會重複出現
+            seen.add(bsn)
+            if page != Status.page_count:
+                Status.page_count = page
+                update_status(f'fetching_all_themes_{page}')
+
+            scraper = SCRAPERS[bsn] = Scraper(title, bsn)
+            task = asyncio.create_task(scraper.scrape(), name=f'scraper:{bsn}')
+            TASKS.add(task)
+            task.add_done_callback(TASKS.discard)
 
         update_status('fetching_all_themes_end')
 
-        TASKS = [asyncio.create_task(scraper.scrape()) for scraper in SCRAPERS]
         logger.info('Scraping all themes...')
         update_status('scraping_all_themes_start')
         await asyncio.gather(*TASKS)
         update_status('scraping_all_themes_end')
 
+        if media.MEDIA_CACHE:
+            # 貼文的寫入做完 (圖片才都進了佇列) 之後，等圖片抓完
+            update_status('fetching_media_start')
+            await asyncio.gather(*list(utils.WRITE_DB_TASKS), return_exceptions=True)
+            await media.drain()
+            update_status('fetching_media_end')
+
     except (asyncio.CancelledError, KeyboardInterrupt): 
         pass
     except:
@@ -111,31 +156,45 @@ async def main():
         logger.info('Closing...')
 
         # close scraper
-        for scraper in SCRAPERS:
+        for scraper in list(SCRAPERS.values()):
             await scraper.close()
 
         # close db write tasks
-        for task in utils.WRITE_DB_TASKS:
+        pending_writes = list(utils.WRITE_DB_TASKS)
+        for task in pending_writes:
             task.cancel()
 
         try:
-            await asyncio.gather(*utils.WRITE_DB_TASKS)
+            await asyncio.gather(*pending_writes)
         except asyncio.CancelledError:
             pass
         except:
             logger.error('Error while closing WRITE_DB_TASKS', exc_info=True)
 
+        # 頭貼 / 圖片的 worker
+        try:
+            await media.close()
+        except:
+            logger.error('Error while closing media workers', exc_info=True)
+
         # close tasks for scraper
-        for task in TASKS:
+        pending_tasks = list(TASKS)
+        for task in pending_tasks:
             task.cancel()
 
         try:
-            await asyncio.gather(*TASKS)
+            await asyncio.gather(*pending_tasks)
         except asyncio.CancelledError:
             pass
         except:
             logger.error('Error while closing TASKS', exc_info=True)
 
+        # 下次執行用 (SEEN_BLOOM=1)
+        try:
+            save_seen()
+        except:
+            logger.error('Error while saving seen.bloom', exc_info=True)
+
         # close db client
         await close_db_client()
 
@@ -144,4 +203,5 @@ async def main():
 
 
 if __name__ == '__main__':
+    utils.init_runtime()
     asyncio.run(main())
@@ -0,0 +1,273 @@
+'''
+頭貼 / 內文圖片的快取 (MEDIA_CACHE=1 時啟用)
+
+新抓到的貼文裡的 avatar_url 跟內文的圖片 (markdown 的 ![](...)，CONTENT_MODE=html 的 <img src>) 丟進佇列
+同一個網址只會抓一次: MEDIA_CONCURRENCY 個 worker 在抓，每次還是要搶 SEM (跟 C.php 共用的上限)
+檔案以內容的 sha256 為檔名存在 data/media/objects/ 底下 (不同網址內容一樣也只存一份)
+media 表 (catalog) 記錄 url -> sha256 跟 ETag / Last-Modified，media_refs 記錄每篇貼文引用了哪些網址
+body 是串流讀的，Content-Length 或讀到的量超過 MEDIA_MAX_BYTES 就放棄
+超過 MEDIA_REVALIDATE_DAYS 天又遇到的話帶 If-None-Match / If-Modified-Since 問一次，304 就不用重新下載
+
+    python -m src.media              # 去重比例、省下的流量
+    curl localhost:15913/api/media
+'''
+import asyncio
+import html
+import logging
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from . import metrics
+from .append_to_db import get_client as get_db_client, get_reader
+from .append_to_db.client import writing
+from .records import Post
+from .utils import SEM, canonical_post_url, fetch_with_retry, post_key
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE = os.getenv('MEDIA_CACHE', '0') == '1'
+MEDIA_CONCURRENCY = int(os.getenv('MEDIA_CONCURRENCY', '2')) # 最多佔掉 SEM 的幾個位置
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(8 * 1024 * 1024))) # 超過的不存
+MEDIA_REVALIDATE_DAYS = int(os.getenv('MEDIA_REVALIDATE_DAYS', '7'))
+MEDIA_DIR = Path('data/media')
+
+_MARKDOWN_IMAGE = re.compile(r'!\[[^\]]*\]\(<?(https?://[^\s)>]+)')
+_HTML_IMAGE = re.compile(r'<img\b[^>]*?\ssrc="(https?://[^"]+)"')
+
+# 預設的 header 是開網頁用的，圖片要像 <img> 發出去的請求
+_HEADERS = {
+    'Accept': 'image/avif,image/webp,*/*',
+    'Sec-Fetch-Dest': 'image',
+    'Sec-Fetch-Mode': 'no-cors',
+    'Sec-Fetch-Site': 'cross-site',
+}
+
+_QUEUE: asyncio.Queue[str] | None = None
+_QUEUED: set[str] = set() # 排隊中 / 正在抓的，同一個網址不會排兩次
+_WORKERS: list[asyncio.Task] = []
+
+
+class _BodySink:
+    '''fetch_with_retry 的 sink: bytes 原樣收起來，超過 MEDIA_MAX_BYTES 的 fetch_with_retry 會放棄'''
+    binary = True
+
+    def __init__(self):
+        self.max_bytes = MEDIA_MAX_BYTES
+        self._chunks: list[bytes] = []
+
+    def reset(self):
+        self._chunks.clear()
+
+    def feed(self, chunk: bytes):
+        self._chunks.append(chunk)
+
+    def close(self) -> bytes:
+        return b''.join(self._chunks)
+
+
+def object_path(digest: str) -> Path:
+    return MEDIA_DIR / 'objects' / digest[:2] / digest[2:]
+
+
+def _write_object(data: bytes) -> str:
+    digest = sha256(data).hexdigest()
+    path = object_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(data) # 圖片本來就壓過了，不用再 gzip
+        tmp.replace(path)
+    return digest
+
+
+def media_urls(post: Post) -> Counter[str]:
+    '''貼文裡的頭貼 / 圖片網址跟出現次數'''
+    urls: Counter[str] = Counter()
+    for floor in post.floors:
+        for comment in floor.comments:
+            if comment.avatar_url.startswith(('http://', 'https://')):
+                urls[comment.avatar_url] += 1
+        content = getattr(floor, 'content', None)
+        if content is not None:
+            urls.update(_MARKDOWN_IMAGE.findall(content))
+        else:
+            urls.update(html.unescape(url) for url in _HTML_IMAGE.findall(floor.content_html))
+    return urls
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+async def collect(post: Post):
+    '''新抓到的貼文: 整篇的引用換成這次的 (重抓不會重複算)，還沒抓過 (或該重新驗證) 的網址丟進佇列'''
+    global _QUEUE
+    counts = media_urls(post)
+    key = post_key(post.url)
+    post_url = canonical_post_url(*key) if key is not None else post.url
+
+    urls = [url for url in counts if url not in _QUEUED]
+    stale = (datetime.now(timezone.utc) - timedelta(days=MEDIA_REVALIDATE_DAYS)).isoformat(timespec='seconds')
+    db = await get_db_client()
+    async with writing(db):
+        await db.execute("DELETE FROM media_refs WHERE post_url = ?", (post_url,))
+        await db.executemany(
+            "INSERT INTO media_refs (post_url, media_url, count) VALUES (?, ?, ?)",
+            [(post_url, url, count) for url, count in counts.items()],
+        )
+        await db.executemany("INSERT OR IGNORE INTO media (url) VALUES (?)", [(url,) for url in counts])
+        await db.commit()
+        # 要抓的也在鎖裡面查，不會讀到別人寫到一半的 media
+        rows = await db.execute_fetchall("""
+            SELECT url FROM media
+            WHERE url IN (SELECT value FROM json_each(?)) AND (checked_at IS NULL OR checked_at < ?)
+        """, (orjson.dumps(urls), stale)) if urls else []
+
+    if not rows:
+        return
+    if _QUEUE is None:
+        _QUEUE = asyncio.Queue()
+    for (url,) in rows:
+        if url not in _QUEUED:
+            _QUEUED.add(url)
+            _QUEUE.put_nowait(url)
+    if rows and not _WORKERS:
+        _WORKERS.extend(asyncio.create_task(_worker(_QUEUE), name=f'media:{i}') for i in range(MEDIA_CONCURRENCY))
+
+
+async def _worker(queue: asyncio.Queue[str]):
+    while True:
+        url = await queue.get()
+        try:
+            await fetch_media(url)
+        except Exception:
+            logger.error(f'Error while fetching media {url}', exc_info=True)
+        finally:
+            _QUEUED.discard(url)
+            queue.task_done()
+
+
+async def fetch_media(url: str):
+    '''抓一個網址 (有舊的檔案的話先問有沒有變)，結果寫進 media 表'''
+    # 唯讀連線查，不會看到寫入連線上別人還沒 commit 的東西
+    async with get_reader() as db:
+        rows = await db.execute_fetchall("SELECT sha256, etag, last_modified FROM media WHERE url = ?", (url,))
+    digest, etag, last_modified = rows[0] if rows else (None, None, None)
+
+    headers = {}
+    if digest is not None and object_path(digest).exists():
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    sink = _BodySink()
+    async with metrics.timed_acquire(SEM, 'media'):
+        # 太大的 fetch_with_retry 會在讀完之前放棄，回傳 None
+        resp = await fetch_with_retry(url, retries=3, sink=sink, headers={**_HEADERS, **headers})
+
+    if resp is not None and resp.status_code == 200:
+        body = sink.close()
+        metrics.MEDIA_REQUESTS_TOTAL.inc(result='fetched')
+        metrics.MEDIA_BYTES_TOTAL.inc(len(body))
+        digest = await asyncio.to_thread(_write_object, body)
+
+    db = await get_db_client()
+    async with writing(db):
+        if resp is not None and resp.status_code == 304:
+            metrics.MEDIA_REQUESTS_TOTAL.inc(result='not_modified')
+            await db.execute("""
+                UPDATE media SET status = 304, not_modified = not_modified + 1, checked_at = ? WHERE url = ?
+            """, (_now(), url))
+        elif resp is not None and resp.status_code == 200:
+            await db.execute("""
+                UPDATE media SET sha256 = ?, size = ?, content_type = ?, etag = ?, last_modified = ?, status = 200, checked_at = ?
+                WHERE url = ?
+            """, (
+                digest,
+                len(body),
+                resp.headers.get('Content-Type'),
+                resp.headers.get('ETag'),
+                resp.headers.get('Last-Modified'),
+                _now(),
+                url,
+            ))
+        else:
+            # 失敗 (或太大) 的也記 checked_at，MEDIA_REVALIDATE_DAYS 天內不會一直重試
+            metrics.MEDIA_REQUESTS_TOTAL.inc(result='error')
+            status = None if resp is None else resp.status_code
+            await db.execute("UPDATE media SET status = ?, checked_at = ? WHERE url = ?", (status, _now(), url))
+        await db.commit()
+
+
+async def drain():
+    '''等佇列裡的都抓完 (爬完之後呼叫)'''
+    if _QUEUE is not None:
+        await _QUEUE.join()
+
+
+async def close():
+    global _QUEUE
+    for task in _WORKERS:
+        task.cancel()
+    await asyncio.gather(*_WORKERS, return_exceptions=True)
+    _WORKERS.clear()
+    _QUEUED.clear()
+    _QUEUE = None
+
+
+async def media_stats() -> dict[str, Any]:
+    '''
+    Returns:
+        urls: 不同的網址數，references: 在貼文裡出現的總次數 (每篇貼文算最新抓到的那一次)
+        objects / bytes_stored: 實際存下來的檔案 (內容一樣的只算一份)
+        dedupe_ratio: 抓到的網址被引用的次數 / 檔案數
+        bytes_saved: 每次出現都下載一次的話要多抓的量；not_modified_bytes: 其中靠 304 省下的
+    '''
+    async with get_reader() as db:
+        (urls, references, fetched, fetched_refs, referenced_bytes, not_modified, not_modified_bytes), = await db.execute_fetchall("""
+            SELECT COUNT(*), COALESCE(SUM(r.refs), 0), COUNT(sha256),
+                COALESCE(SUM(CASE WHEN sha256 IS NOT NULL THEN r.refs END), 0),
+                COALESCE(SUM(r.refs * size), 0),
+                COALESCE(SUM(not_modified), 0), COALESCE(SUM(not_modified * size), 0)
+            FROM media
+            LEFT JOIN (SELECT media_url, SUM(count) AS refs FROM media_refs GROUP BY media_url) AS r ON r.media_url = media.url
+        """)
+        (objects, stored_bytes), = await db.execute_fetchall("""
+            SELECT COUNT(*), COALESCE(SUM(size), 0)
+            FROM (SELECT MAX(size) AS size FROM media WHERE sha256 IS NOT NULL GROUP BY sha256)
+        """)
+
+    return {
+        'urls': urls,
+        'references': references,
+        'fetched': fetched,
+        'objects': objects,
+        'bytes_stored': stored_bytes,
+        'dedupe_ratio': round(fetched_refs / objects, 2) if objects else None,
+        'bytes_saved': max(referenced_bytes - stored_bytes, 0),
+        'not_modified': not_modified,
+        'not_modified_bytes': not_modified_bytes,
+    }
+
+
+if __name__ == '__main__':
+    from .append_to_db import init_tables, close_client
+    from .utils import init_runtime
+
+    async def _main():
+        try:
+            await init_tables()
+            logger.info(f'Media cache: {await media_stats()}')
+        finally:
+            await close_client()
+
+    init_runtime()
+    asyncio.run(_main())
@@ -0,0 +1,190 @@
+'''
+Prometheus 格式的 metrics (GET /metrics)
+
+不想為了這個多裝 prometheus_client，只實作了用得到的 Counter / Gauge / Histogram
+每秒貼文數之類的請用 PromQL 的 rate(baha_posts_total[1m]) 算
+'''
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
+from time import perf_counter, perf_counter_ns
+from typing import Callable, Iterator
+from urllib.parse import urlparse
+
+from . import tracing
+
+REGISTRY: list['_Metric'] = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._functions: dict[tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        '''抓 /metrics 的時候才呼叫 function 取值 (例如 queue 長度)'''
+        self._functions[self._key(labels)] = function
+
+    def _samples(self):
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key: [每個 bucket 的數量 (非累計)..., sum, count]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-2])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}'
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+@asynccontextmanager
+async def timed_acquire(sem: asyncio.Semaphore, stage: str):
+    '''跟 `async with sem` 一樣，順便記錄排隊等了多久 (histogram + trace span)'''
+    start = perf_counter_ns()
+    async with sem:
+        end = perf_counter_ns()
+        SEM_WAIT_SECONDS.observe((end - start) / 1e9, stage=stage)
+        tracing.record('sem_wait', 'sem', start, end, {'stage': stage})
+        yield
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).hostname or ''
+
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram('baha_http_request_seconds', 'HTTP fetch latency', ('host', 'status'))
+HTTP_429_TOTAL = Counter('baha_http_429_total', 'Responses with status 429', ('host',))
+HTTP_RETRIES_TOTAL = Counter('baha_http_retries_total', 'Retried HTTP requests', ('host', 'reason'))
+
+# 排隊 / 解析
+SEM_WAIT_SECONDS = Histogram('baha_sem_wait_seconds', 'Time spent waiting for a concurrency slot', ('stage',))
+PARSE_SECONDS = Histogram('baha_parse_seconds', 'HTML parse time', ('page',))
+MARKDOWNIFY_SECONDS = Histogram('baha_markdownify_seconds', 'markdownify time per floor', buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+
+# 資料庫
+DB_WRITE_SECONDS = Histogram('baha_db_write_seconds', 'DB write statement latency', ('table',))
+DB_COMMIT_SECONDS = Histogram('baha_db_commit_seconds', 'DB commit latency', ('table',))
+
+# 快取 (post_list / post / theme)
+CACHE_REQUESTS_TOTAL = Counter('baha_cache_requests_total', 'Cache lookups', ('cache', 'result'))
+
+# 產出
+POSTS_TOTAL = Counter('baha_posts_total', 'Posts written', ('source',))
+
+# 頭貼 / 圖片快取 (MEDIA_CACHE=1)
+MEDIA_REQUESTS_TOTAL = Counter('baha_media_requests_total', 'Media fetches', ('result',))
+MEDIA_BYTES_TOTAL = Counter('baha_media_bytes_total', 'Media bytes downloaded')
+QUEUE_DEPTH = Gauge('baha_queue_depth', 'Pending items per queue', ('queue',))
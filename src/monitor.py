@@ -0,0 +1,238 @@
+'''
+event loop 的健康狀況
+
+- LoopMonitor: 定時 sleep 一小段，看實際醒來晚了多少 (= event loop lag)，超過 SLOW_CALLBACK_SECONDS 的記成一次卡住
+  預設不知道是誰卡住的，要找的話 SLOW_CALLBACK_MODE:
+  - debug: loop.set_debug + slow_callback_duration，收 asyncio 自己印的 "Executing ... took" (debug mode 整體會慢一點)
+  - patch: 把 asyncio 的 Handle._run (私有的) 包一層，可以看到是哪個 task、停在哪一行
+- task_summary: 目前所有 asyncio task 依 coroutine 分組計數
+- memory_report: tracemalloc 的前幾名與跟上一次 baseline 的差異
+
+API 見 /api/debug/*
+'''
+import asyncio
+import asyncio.events
+import logging
+import os
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Any
+
+from . import metrics
+
+SLOW_CALLBACK_SECONDS = float(os.getenv('SLOW_CALLBACK_SECONDS', '0.1'))
+# lag | debug | patch
+SLOW_CALLBACK_MODE = os.getenv('SLOW_CALLBACK_MODE', 'lag')
+
+LOOP_LAG_SECONDS = metrics.Histogram(
+    'baha_event_loop_lag_seconds', 'Event loop scheduling lag',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SLOW_CALLBACKS_TOTAL = metrics.Counter('baha_slow_callbacks_total', 'Event loop callbacks slower than SLOW_CALLBACK_SECONDS')
+
+
+def _describe_handle(handle: asyncio.Handle) -> str:
+    callback = handle._callback
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        desc = f'Task {owner.get_name()} {getattr(coro, "__qualname__", coro)}'
+        # 跑完這一步之後停在哪個 await，通常就在卡住的那段程式碼後面
+        frame = getattr(coro, 'cr_frame', None)
+        if frame is not None:
+            desc += f' (now at {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})'
+        return desc
+    return repr(handle)[:300]
+
+
+class _SlowCallbackHandler(logging.Handler):
+    '''debug mode 下 asyncio 的 logger.warning('Executing %s took %.3f seconds', handle, dt)'''
+
+    def __init__(self, monitor: 'LoopMonitor', loop: asyncio.AbstractEventLoop):
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+        self.loop = loop
+
+    def emit(self, record: logging.LogRecord):
+        if record.msg.startswith('Executing ') and len(record.args) == 2:
+            handle, duration = record.args
+            self.monitor._record_slow(duration, str(handle)[:300])
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.25, history: int = 2400):
+        self.interval = interval
+        self.lags: deque[tuple[float, float]] = deque(maxlen=history) # (time, lag)
+        self.slow_callbacks: deque[dict[str, Any]] = deque(maxlen=200)
+        self._task: asyncio.Task | None = None
+        self._original_run = None
+        self._debug_handler: _SlowCallbackHandler | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._sample(), name='loop-monitor')
+        if SLOW_CALLBACK_MODE == 'debug':
+            self._enable_debug()
+        elif SLOW_CALLBACK_MODE == 'patch':
+            self._patch_handle()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+        if self._debug_handler is not None:
+            logging.getLogger('asyncio').removeHandler(self._debug_handler)
+            self._debug_handler.loop.set_debug(False)
+            self._debug_handler = None
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append((time.time(), lag))
+            LOOP_LAG_SECONDS.observe(lag)
+            if SLOW_CALLBACK_MODE == 'lag' and lag >= SLOW_CALLBACK_SECONDS:
+                # 只知道這段期間卡了多久，不知道是誰
+                self._record_slow(lag, None)
+
+    def _record_slow(self, duration: float, callback: str | None):
+        SLOW_CALLBACKS_TOTAL.inc()
+        self.slow_callbacks.append({
+            'time': time.time(),
+            'duration': duration,
+            'callback': callback,
+        })
+
+    def _enable_debug(self):
+        if self._debug_handler is not None:
+            return
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = SLOW_CALLBACK_SECONDS
+        self._debug_handler = _SlowCallbackHandler(self, loop)
+        logging.getLogger('asyncio').addHandler(self._debug_handler)
+
+    def _patch_handle(self):
+        if self._original_run is not None:
+            return
+        original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            original_run(handle)
+            duration = time.perf_counter() - start
+            if duration >= SLOW_CALLBACK_SECONDS:
+                monitor._record_slow(duration, _describe_handle(handle))
+
+        self._original_run = original_run
+        asyncio.events.Handle._run = _run
+
+    def report(self, window: float = 60) -> dict[str, Any]:
+        since = time.time() - window
+        lags = sorted(lag for t, lag in self.lags if t >= since)
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'window': window,
+            'samples': len(lags),
+            'lag_avg': sum(lags) / len(lags) if lags else 0,
+            'lag_p99': lags[int(len(lags) * 0.99)] if lags else 0,
+            'lag_max': lags[-1] if lags else 0,
+            'slow_callback_threshold': SLOW_CALLBACK_SECONDS,
+            'slow_callback_mode': SLOW_CALLBACK_MODE,
+            'slow_callbacks': sorted(self.slow_callbacks, key=lambda x: x['duration'], reverse=True)[:50],
+        }
+
+
+MONITOR = LoopMonitor()
+
+
+def task_summary() -> dict[str, Any]:
+    from . import utils
+
+    groups: Counter[str] = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        groups[getattr(coro, '__qualname__', type(coro).__name__)] += 1
+
+    def _count(tasks) -> dict[str, int]:
+        pending = sum(not t.done() for t in tasks)
+        return {'total': len(tasks), 'pending': pending, 'done': len(tasks) - pending}
+
+    return {
+        'tasks_total': sum(groups.values()),
+        'by_coroutine': dict(groups.most_common()),
+        'containers': {
+            'SCRAPERS': len(utils.SCRAPERS),
+            'TASKS': _count(utils.TASKS),
+            'WRITE_DB_TASKS': _count(utils.WRITE_DB_TASKS),
+            'running_tasks': _count([t for s in utils.SCRAPERS.values() for t in s.running_tasks]),
+        },
+    }
+
+
+_baseline: tracemalloc.Snapshot | None = None
+
+
+def start_tracemalloc(frames: int = 10):
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _baseline = None
+
+
+def stop_tracemalloc():
+    global _baseline
+    tracemalloc.stop()
+    _baseline = None
+
+
+def _stat(stat) -> dict[str, Any]:
+    frame = stat.traceback[0]
+    return {
+        'location': f'{frame.filename}:{frame.lineno}',
+        'size': stat.size,
+        'count': stat.count,
+    }
+
+
+def memory_report(limit: int = 20, reset_baseline: bool = False) -> dict[str, Any]:
+    '''很慢 (要掃過所有 allocation)，請在 thread 裡呼叫'''
+    global _baseline
+    if not tracemalloc.is_tracing():
+        return {'tracing': False}
+
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+    report = {
+        'tracing': True,
+        'current': current,
+        'peak': peak,
+        'top': [_stat(stat) for stat in snapshot.statistics('lineno')[:limit]],
+        'diff': None,
+    }
+    if _baseline is not None:
+        report['diff'] = [
+            {**_stat(stat), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+            for stat in snapshot.compare_to(_baseline, 'lineno')[:limit]
+        ]
+    if _baseline is None or reset_baseline:
+        _baseline = snapshot
+    return report
@@ -0,0 +1,293 @@
+'''
+把資料庫裡的貼文匯出成 Parquet，給 pandas / polars / duckdb 分析用 (不用每次都解析巨大的巢狀 JSONL)
+
+    data/parquet/posts/bsn=<bsn>/month=<YYYY-MM>/part-0.parquet     每篇貼文一列
+    data/parquet/floors/bsn=<bsn>/month=<YYYY-MM>/part-0.parquet    每一樓一列
+    data/parquet/comments/bsn=<bsn>/month=<YYYY-MM>/part-0.parquet  每則留言一列
+
+- month 是樓主發文的月份 (UTC)，一篇貼文的三張表都在同一個分區
+- 時間欄位是 timestamp (UTC)，讚數是 int，使用者相關欄位用 dictionary 編碼
+- 增量: 依 post_info.updated_at，只重寫有新資料的 (bsn, month) 分區，進度記在 data/parquet/_state.json
+- 需要 pyarrow (選用): pip install pyarrow
+
+    python -m src.parquet_export [--full]
+
+讀取: pyarrow.parquet.read_table('data/parquet/floors') 或 pandas.read_parquet，bsn / month 會變成分區欄位
+'''
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from .utils import DATA_DIR, post_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_DIR = DATA_DIR / 'parquet'
+_STATE_FILE = '_state.json'
+_EXPORT_LOCK = asyncio.Lock() # CLI 跟 API 同時觸發的話排隊，不然會寫到同一個暫存檔
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError('Parquet export needs pyarrow: pip install pyarrow')
+
+
+def _schemas() -> dict[str, 'pa.Schema']:
+    ts = pa.timestamp('us', tz='UTC')
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return {
+        'posts': pa.schema([
+            ('url', pa.string()),
+            ('snA', pa.int64()),
+            ('theme_title', dict_str),
+            ('title', pa.string()),
+            ('post_time', ts),
+            ('floor_count', pa.int32()),
+            ('updated_at', ts),
+        ]),
+        'floors': pa.schema([
+            ('url', pa.string()),
+            ('snA', pa.int64()),
+            ('idx', pa.int32()),
+            ('tags', pa.list_(dict_str)),
+            ('author_id', dict_str),
+            ('author_name', dict_str),
+            ('author_url', dict_str),
+            ('time', ts),
+            ('content', pa.string()),
+            ('like_count', pa.int32()),
+            ('dislike_count', pa.int32()),
+            ('comment_count', pa.int32()),
+        ]),
+        'comments': pa.schema([
+            ('url', pa.string()),
+            ('snA', pa.int64()),
+            ('floor_idx', pa.int32()),
+            ('seq', pa.int32()), # B1 -> 1
+            ('user_id', dict_str),
+            ('user_name', dict_str),
+            ('user_url', dict_str),
+            ('avatar_url', dict_str),
+            ('comment_text', pa.string()),
+            ('time', ts),
+        ]),
+    }
+
+
+def _ts(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _sqlite_ts(value: str | None) -> datetime | None:
+    # CURRENT_TIMESTAMP 是 UTC 但沒有時區
+    return datetime.fromisoformat(value + '+00:00') if value else None
+
+
+def _seq(floor: str) -> int | None:
+    try:
+        return int(floor[1:])
+    except (TypeError, ValueError):
+        return None
+
+
+def build_tables(posts: list[tuple[str, str, list[dict[str, Any]], str | None]], theme_title: str) -> dict[str, 'pa.Table']:
+    '''
+    一個分區的資料轉成三張 Arrow table (CPU 重，請在 thread 裡跑)
+
+    Args:
+        posts: [(url, title, floors, updated_at), ...]
+    '''
+    from .append_to_db.normalized import user_id_from_url
+    from .render import render_floors
+
+    columns: dict[str, dict[str, list]] = {
+        name: {field.name: [] for field in schema}
+        for name, schema in _schemas().items()
+    }
+    post_cols, floor_cols, comment_cols = columns['posts'], columns['floors'], columns['comments']
+
+    for url, title, floors, updated_at in posts:
+        snA = post_key(url)[1]
+        floors = render_floors(floors) # CONTENT_MODE=html 存的是 HTML
+
+        post_cols['url'].append(url)
+        post_cols['snA'].append(snA)
+        post_cols['theme_title'].append(theme_title)
+        post_cols['title'].append(title)
+        post_cols['post_time'].append(_ts(floors[0]['time']) if floors else None)
+        post_cols['floor_count'].append(len(floors))
+        post_cols['updated_at'].append(_sqlite_ts(updated_at))
+
+        for floor in floors:
+            author = floor['author']
+            floor_cols['url'].append(url)
+            floor_cols['snA'].append(snA)
+            floor_cols['idx'].append(floor['index'])
+            floor_cols['tags'].append(list(floor['tags']))
+            floor_cols['author_id'].append(author['id'])
+            floor_cols['author_name'].append(author['name'])
+            floor_cols['author_url'].append(author['url'])
+            floor_cols['time'].append(_ts(floor['time']))
+            floor_cols['content'].append(floor['content'])
+            floor_cols['like_count'].append(floor['like_count'])
+            floor_cols['dislike_count'].append(floor['dislike_count'])
+            floor_cols['comment_count'].append(len(floor['comments']))
+
+            for comment in floor['comments']:
+                comment_cols['url'].append(url)
+                comment_cols['snA'].append(snA)
+                comment_cols['floor_idx'].append(floor['index'])
+                comment_cols['seq'].append(_seq(comment['floor']))
+                comment_cols['user_id'].append(user_id_from_url(comment['user_url']))
+                comment_cols['user_name'].append(comment['user_name'])
+                comment_cols['user_url'].append(comment['user_url'])
+                comment_cols['avatar_url'].append(comment['avatar_url'])
+                comment_cols['comment_text'].append(comment['comment_text'])
+                comment_cols['time'].append(_ts(comment['time']))
+
+    return {
+        name: pa.Table.from_pydict(columns[name], schema=schema)
+        for name, schema in _schemas().items()
+    }
+
+
+def write_partition(bsn: str, month: str, tables: dict[str, 'pa.Table'], root: Path = PARQUET_DIR):
+    for name, table in tables.items():
+        directory = root / name / f'bsn={bsn}' / f'month={month}'
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / 'part-0.parquet'
+        tmp = path.with_suffix('.parquet.tmp')
+        # 先寫暫存檔再換掉，讀的人不會讀到寫一半的檔案
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+
+
+def _load_state(root: Path) -> dict[str, Any]:
+    try:
+        return orjson.loads((root / _STATE_FILE).read_bytes())
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(root: Path, state: dict[str, Any]):
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = root / (_STATE_FILE + '.tmp')
+    tmp.write_bytes(orjson.dumps(state))
+    os.replace(tmp, root / _STATE_FILE)
+
+
+async def _scan(since: str | None) -> tuple[dict[tuple[str, str], list[str]], str | None]:
+    '''
+    掃過 post_info (不讀 floors 內容)，找出要重寫的分區
+
+    Returns:
+        ({(bsn, month): [url, ...]}, 下次從哪個 updated_at 開始)
+    '''
+    from .append_to_db import client, get_reader, fan_out
+    from .append_to_db.codec import unpack_floors
+
+    # post_time 是後來才加的欄位，舊資料從 floors 裡拿 (壓過的 BLOB 不能 json_extract，拿回來在 Python 解開)
+    post_time = "COALESCE(post_time, CASE WHEN typeof(floors) = 'text' THEN json_extract(floors, '$[0].time') END)"
+    if client.DB_LAYOUT == 'normalized':
+        post_time = f"COALESCE({post_time}, (SELECT f.time FROM floors f WHERE f.post_url = post_info.url AND f.idx = 0))"
+
+    async with get_reader() as db:
+        # 掃描開始的時間當作下次的起點，掃描途中才寫入的下次會再匯出
+        cursor = await db.execute("SELECT CURRENT_TIMESTAMP")
+        watermark = (await cursor.fetchone())[0]
+
+    async def scan(db):
+        cursor = await db.execute(f"""
+            SELECT url, {post_time} AS time_iso, updated_at,
+                CASE WHEN post_time IS NULL AND typeof(floors) = 'blob' THEN floors END
+            FROM post_info
+        """)
+        return await cursor.fetchall()
+
+    rows = [row for shard_rows in await fan_out(scan) for row in shard_rows] # DB_SHARDS 時每個 shard 一起掃
+
+    partitions: dict[tuple[str, str], list[str]] = defaultdict(list)
+    changed: set[tuple[str, str]] = set()
+    for url, time_iso, updated_at, packed in rows:
+        key = post_key(url)
+        if key is None:
+            continue
+        if time_iso is None and packed is not None:
+            floors = orjson.loads(await unpack_floors(packed))
+            time_iso = floors[0].get('time') if floors else None
+        partition = (str(key[0]), time_iso[:7] if time_iso else 'unknown')
+        partitions[partition].append(url)
+        # updated_at 只到秒，同一秒內可能還有後來寫入的，所以用 >= (多重寫一次沒關係)
+        if since is None or updated_at >= since:
+            changed.add(partition)
+
+    return {partition: partitions[partition] for partition in changed}, watermark
+
+
+async def export_parquet(full: bool = False, root: Path = PARQUET_DIR) -> dict[str, Any]:
+    '''
+    Args:
+        full: 忽略 _state.json，全部重寫
+
+    Returns:
+        {'partitions': 重寫了幾個分區, 'posts': 幾篇貼文, 'watermark': 這次匯出到的 updated_at}
+    '''
+    _require_pyarrow()
+    async with _EXPORT_LOCK:
+        return await _export(full, root)
+
+
+async def _export(full: bool, root: Path) -> dict[str, Any]:
+    from .append_to_db import init_tables, get_reader, load_posts
+
+    await init_tables()
+    state = {} if full else _load_state(root)
+    partitions, watermark = await _scan(state.get('watermark'))
+
+    async with get_reader() as db:
+        cursor = await db.execute("SELECT bsn, title FROM all_themes")
+        theme_titles = {bsn: title for bsn, title in await cursor.fetchall()}
+
+    total_posts = 0
+    for (bsn, month), urls in sorted(partitions.items()):
+        posts = await load_posts(urls)
+        tables = await asyncio.to_thread(build_tables, posts, theme_titles.get(bsn, ''))
+        await asyncio.to_thread(write_partition, bsn, month, tables, root)
+        total_posts += len(posts)
+        logger.info(f'Wrote parquet partition bsn={bsn} month={month} ({len(posts)} posts)')
+
+    _save_state(root, {'watermark': watermark})
+    return {'partitions': len(partitions), 'posts': total_posts, 'watermark': watermark}
+
+
+async def _main(args: argparse.Namespace):
+    from .append_to_db import close_client
+
+    try:
+        result = await export_parquet(args.full)
+        logger.info(f"Done, {result['partitions']} partitions ({result['posts']} posts) rewritten")
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export posts / floors / comments to partitioned Parquet')
+    parser.add_argument('--full', action='store_true', help='rewrite every partition instead of only changed ones')
+    args = parser.parse_args()
+
+    from .utils import init_runtime
+    init_runtime()
+    asyncio.run(_main(args))
@@ -0,0 +1,222 @@
+'''
+C.php / B.php 的解析，跟網路 / 資料庫無關
+爬蟲跟 reparse (重新解析 archive) 共用，所以要能在 subprocess 裡跑
+'''
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+from urllib.parse import urljoin
+from datetime import datetime, timedelta, timezone
+import re
+from markdownify import markdownify as md
+
+from .records import Post, Floor, HtmlFloor, Author, Comment, PostListing
+from .render import sanitize_html
+from .metrics import MARKDOWNIFY_SECONDS
+from . import tracing
+
+
+def parse_title(soup: BeautifulSoup) -> str:
+    # 該篇貼文的 標題
+    return soup.select('.c-post__header__title')[0].text.strip()
+
+
+def parse_post(html: str, post_url: str, theme_title: str, content_mode: str = 'markdown') -> Post: # C.php, 單一貼文
+    """
+    Args:
+        content_mode (str): markdown 直接轉好存在 content (Floor)；html 只存精簡過的 HTML 在 content_html (HtmlFloor，見 render.py)
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    FINAL_RESULT = Post(theme_title=theme_title, title=parse_title(soup), url=post_url, floors=[])
+    for idx, post in enumerate(soup.select('.c-post')):
+        FINAL_RESULT.floors.append(parse_floor(post, idx, post_url, content_mode))
+
+    return FINAL_RESULT
+
+
+def parse_floor(post: Tag, idx: int, post_url: str, content_mode: str = 'markdown') -> Floor | HtmlFloor: # 單一樓層 (.c-post)
+    """串流解析 (stream_parse.py) 也是一樓一樓丟進來"""
+    assert isinstance(post, Tag)
+
+    # get tag，基本上一篇文章只有一個 tag
+    floor_tags = {}
+    tags = post.select('.tag-category a')
+    for tag in tags:
+        tag_href = tag.get('href')
+        tag_text = tag.find('div').get_text(strip=True)
+        floor_tags[tag_text] = tag_href
+
+    # 取得 author 資訊
+    div_author = post.select('.c-post__header__author')[0]
+    author_name = div_author.select('.username')[0].text.strip()
+    author_id = div_author.select('.userid')[0].text.strip()
+    author_url = urljoin(post_url, div_author.select('.userid')[0].get('href'))
+    author = Author(name=author_name, id=author_id, url=author_url)
+
+    # 取得時間資訊
+    div_info = post.select('.c-post__header__info')[0]
+    time_str = div_info.select('.edittime')[0].get('data-mtime')
+    utc8_time = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
+    utc_time = utc8_time.astimezone(timezone.utc)
+    floor_time = utc_time.isoformat()
+
+    # 取得內文
+    article = post.select('article div')[0]
+    if content_mode == 'html':
+        article_text = sanitize_html(article)
+    else:
+        with MARKDOWNIFY_SECONDS.time(), tracing.span('markdownify', 'cpu'):
+            article_text = md(str(article))
+
+    # 取得點讚
+    div_button_bar = post.select('.c-post__body__buttonbar')[0]
+    assert isinstance(div_button_bar, Tag)
+    like_count = div_button_bar.select('.gp a')[0].text.strip()
+    dislike_count = div_button_bar.select('.bp a')[0].text.strip()
+
+    if like_count == '-': # - 代表沒人點
+        like_count = 0
+    if dislike_count == '-': # - 代表沒人點
+        dislike_count = 0
+
+    try:
+        like_count = int(like_count)
+    except:
+        like_count = 1000 # 有可能出現為爆
+    try:
+        dislike_count = int(dislike_count)
+    except:
+        dislike_count = 1000 # 有可能出現為爆
+
+    # 取得留言
+    comments = set()
+
+    div_comment = post.select('.c-reply')[0]
+    assert isinstance(div_comment, Tag)
+    for div in div_comment.select('div'): # 每個留言
+        assert isinstance(div, Tag)
+        div_reply_item = div.select('div')
+        if not div_reply_item:
+            continue
+        div_reply_item = div_reply_item[0]
+        assert isinstance(div_reply_item, Tag)
+
+        # Start 找頭貼
+        a_reply_avatar = div_reply_item.select('.reply-avatar')
+        if not a_reply_avatar:
+            continue
+        a_reply_avatar = a_reply_avatar[0]
+        assert isinstance(a_reply_avatar, Tag)
+
+        # End 找頭貼
+        avatar_url = a_reply_avatar.select('img')[0].get('data-src').strip()
+
+        # Start 找使用者
+        div_reply_content = div_reply_item.select('.reply-content')[0]
+        user_href = div_reply_content.select('a')[0].get('href').strip()
+
+        # End 找使用者
+        user_url = urljoin(post_url, user_href)
+        user_name = div_reply_content.select('a')[0].text.strip()
+        comment_text = div_reply_content.select('article span')[0].text.strip()
+
+        # Start 找時間
+        div_all_edit_time = div_reply_item.find_all('div', class_='edittime')
+
+        # End 找時間
+        utc8_time = ' '.join(div_all_edit_time[1].get('data-tippy-content').split()[1:])
+        utc_time = datetime.strptime(utc8_time, '%Y-%m-%d %H:%M:%S')
+        utc_time = utc_time.astimezone(timezone.utc)
+        utc_time_iso = utc_time.isoformat()
+
+        floor = div_all_edit_time[0].text.strip()
+
+        comments.add(Comment( # 我不知道為什麼會有重複的
+            avatar_url=avatar_url,
+            user_url=user_url,
+            user_name=user_name,
+            comment_text=comment_text,
+            floor=floor,
+            time=utc_time_iso,
+        ))
+
+    comments = sorted(comments, key=lambda x: int(x.floor[1:])) # B1 -> 1
+
+    floor_cls = HtmlFloor if content_mode == 'html' else Floor
+    return floor_cls(
+        idx, floor_tags, author, floor_time, article_text, like_count, dislike_count, comments,
+    )
+
+
+# B.php
+
+_TW = timezone(timedelta(hours=8)) # 列表上的時間是台灣時間
+_LIST_DATE = re.compile(r'(?:(\d{4})/)?(\d{1,2})/(\d{1,2})(?:\s+(\d{1,2}):(\d{2}))?')
+_LIST_TODAY = re.compile(r'(今日|昨日)\s*(\d{1,2}):(\d{2})')
+
+
+def parse_list_time(text: str, now: datetime | None = None) -> str | None:
+    """
+    列表上的最後回覆時間 -> 'YYYY-MM-DD HH:MM' 或 'YYYY-MM-DD'
+    今日 19:12 / 昨日 19:12 / 10/12 / 2023/10/12，看不懂的回傳 None
+    """
+    now = (now or datetime.now(timezone.utc)).astimezone(_TW)
+    text = text.strip()
+
+    match = _LIST_TODAY.search(text)
+    if match:
+        day = now.date() - timedelta(days=1 if match[1] == '昨日' else 0)
+        return f'{day.isoformat()} {int(match[2]):02d}:{match[3]}'
+
+    match = _LIST_DATE.search(text)
+    if match:
+        year, month, day = int(match[1] or now.year), int(match[2]), int(match[3])
+        if match[1] is None and (month, day) > (now.month, now.day):
+            year -= 1 # 沒寫年份又比今天晚，是去年的
+        result = f'{year:04d}-{month:02d}-{day:02d}'
+        if match[4] is not None:
+            result += f' {int(match[4]):02d}:{match[5]}'
+        return result
+    return None
+
+
+def _list_int(text: str | None) -> int | None:
+    if text is None:
+        return None
+    text = text.strip()
+    if text in ('', '-'):
+        return 0
+    if text == '爆':
+        return 1000 # 跟樓層的讚數一樣
+    try:
+        return int(text.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def parse_list_row(row: Tag, now: datetime | None = None) -> PostListing | None: # B.php 的一列 (tr.b-list__row)
+    """沒有 C.php 連結的列 (廣告之類的) 回傳 None"""
+    link = row.select_one('a[href^="C.php"]')
+    if link is None:
+        return None
+
+    gp = row.select_one('.b-list__summary__gp')
+    replies = row.select_one('.b-list__count__number span') or row.select_one('.b-list__count__number')
+    last_reply = row.select_one('.b-list__time__edittime')
+    return PostListing(
+        url=link.get('href'),
+        reply_count=_list_int(replies.get_text().split('/')[0]) if replies else None,
+        gp=_list_int(gp.get_text()) if gp else None,
+        last_reply=parse_list_time(last_reply.get_text(), now) if last_reply else None,
+    )
+
+
+def parse_post_list(html: str) -> tuple[list[str], list[PostListing]]: # B.php
+    """
+    Returns:
+        (頁面上全部 C.php 開頭的 href, 每一列的 PostListing)，都還沒 urljoin
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    hrefs = [a['href'] for a in soup.find_all('a') if a.get('href', '').startswith('C.php')]
+    rows = [row for row in map(parse_list_row, soup.select('.b-list__row')) if row is not None]
+    return hrefs, rows
@@ -0,0 +1,98 @@
+'''
+解析完的貼文 (parse_post 的結果)
+
+用 slots dataclass 而不是一層層的 dict：每個欄位不用再存一次 key，orjson 也能直接序列化 dataclass
+JSON 格式跟以前的 dict 一模一樣 (欄位順序 = key 順序)，所以 DB 裡的舊資料 / JSONL 都不用改
+'''
+from dataclasses import dataclass
+
+import orjson
+
+
+@dataclass(slots=True)
+class Author:
+    name: str
+    id: str
+    url: str
+
+
+@dataclass(slots=True, frozen=True)
+class Comment:
+    # frozen 才能丟進 set 去重 (同一則留言有時候會出現兩次)
+    avatar_url: str
+    user_url: str
+    user_name: str
+    comment_text: str
+    floor: str # B1, B2, ...
+    time: str
+
+
+@dataclass(slots=True)
+class Floor:
+    index: int
+    tags: dict[str, str]
+    author: Author
+    time: str
+    content: str # markdown
+    like_count: int
+    dislike_count: int
+    comments: list[Comment]
+
+
+@dataclass(slots=True)
+class HtmlFloor:
+    '''CONTENT_MODE=html，內文是精簡過的 HTML (見 render.py)'''
+    index: int
+    tags: dict[str, str]
+    author: Author
+    time: str
+    content_html: str
+    like_count: int
+    dislike_count: int
+    comments: list[Comment]
+
+
+@dataclass(slots=True)
+class Post:
+    theme_title: str
+    title: str
+    url: str
+    floors: list[Floor | HtmlFloor]
+
+    @property
+    def post_time(self) -> str | None:
+        '''樓主發文時間 (ISO)，存進 post_info.post_time，快取判斷就不用解開 floors'''
+        return self.floors[0].time if self.floors else None
+
+    def encode_floors(self) -> bytes:
+        return orjson.dumps(self.floors)
+
+
+@dataclass(slots=True)
+class PostListing:
+    '''
+    B.php 列表上的一篇 (見 parser.parse_list_row)
+    last_reply 是台灣時間 'YYYY-MM-DD HH:MM'，列表上只顯示日期的話就只有 'YYYY-MM-DD'
+    '''
+    url: str
+    reply_count: int | None
+    gp: int | None
+    last_reply: str | None
+
+    def same_as(self, reply_count: int | None, last_reply: str | None) -> bool:
+        '''跟上次抓 C.php 時列表上的樣子比，回覆數跟最後回覆時間都沒變才算 (不知道的都當作有變)'''
+        if self.reply_count is None or self.last_reply is None or reply_count is None or last_reply is None:
+            return False
+        # 同一個時間過幾天後列表上只剩日期，比較短的那個就好
+        n = min(len(self.last_reply), len(last_reply))
+        return self.reply_count == reply_count and self.last_reply[:n] == last_reply[:n]
+
+
+def jsonl_line(title: str, url: str, floors_json: bytes | str, theme_title: str | None = None) -> bytes:
+    '''
+    組出 JSONL 的一行，floors 是已經編碼好的 JSON (剛 encode 的或 DB 裡的)，直接嵌進去不再解開
+    theme_title 為 None 時不輸出這個 key (快取命中時以前就沒有)
+    '''
+    record = {} if theme_title is None else {'theme_title': theme_title}
+    record.update(title=title, url=url, floors=orjson.Fragment(floors_json))
+    return orjson.dumps(record) + b'\n'
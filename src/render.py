@@ -0,0 +1,135 @@
+'''
+floors 內文的 markdown 轉換
+
+CONTENT_MODE=html 時爬蟲只存精簡過的 `article div` HTML (floor['content_html'])
+要匯出或從 API 讀的時候才用 render_floors 轉成 markdown
+結果先放 LRU，再放到 data/md_cache/ (以 HTML + 轉換參數的 sha256 為檔名)，所以同一段內容只會轉一次
+data/md_cache/ 超過 MD_CACHE_MAX_BYTES 的話從最久沒用到的開始刪 (讀到的時候會更新 mtime)
+'''
+import os
+import threading
+from functools import lru_cache
+from hashlib import sha256
+from pathlib import Path
+from typing import Any
+
+from bs4.element import Tag
+from markdownify import markdownify as md
+import orjson
+
+from .metrics import MARKDOWNIFY_SECONDS
+
+# markdown | html
+CONTENT_MODE = os.getenv('CONTENT_MODE', 'markdown')
+
+# 傳給 markdownify 的參數，改了之後舊的 memo 自動失效 (key 不同)，不需要重爬
+MARKDOWN_OPTIONS: dict[str, Any] = {}
+
+MD_CACHE_DIR = Path('data/md_cache')
+MD_CACHE_MAX_BYTES = int(os.getenv('MD_CACHE_MAX_BYTES', str(256 * 1024 * 1024))) # 0 是不存檔，只用 LRU
+_MD_CACHE_LOW_WATER = 0.8 # 清到剩幾成，不用每寫一個就清一次
+
+_cache_bytes: int | None = None # data/md_cache 現在多大，第一次寫的時候掃一次
+_cache_lock = threading.Lock() # render_floors 會在 to_thread 裡跑
+
+# markdownify 會用到的屬性，其他的 (class, style, data-* ...) 都丟掉
+_KEEP_ATTRS = {'href', 'src', 'alt', 'title', 'colspan', 'rowspan'}
+_DROP_TAGS = ['script', 'style', 'noscript', 'iframe']
+
+
+def sanitize_html(article: Tag) -> str:
+    '''把 `article div` 精簡成只剩轉 markdown 需要的部分'''
+    # 直接改原本的 tag，反正整頁的 soup 解析完就丟了
+    for tag in article.find_all(_DROP_TAGS):
+        tag.decompose()
+    for tag in [article, *article.find_all(True)]:
+        tag.attrs = {k: v for k, v in tag.attrs.items() if k in _KEEP_ATTRS}
+    return str(article)
+
+
+def _options_key() -> bytes:
+    return orjson.dumps(MARKDOWN_OPTIONS, option=orjson.OPT_SORT_KEYS)
+
+
+def _memo_key(html: str, options: bytes) -> str:
+    return sha256(options + b'\0' + html.encode()).hexdigest()
+
+
+def render_markdown(html: str) -> str:
+    # MARKDOWN_OPTIONS 改了的話 LRU 也要換 key，不然會拿到舊參數轉的結果
+    return _render_markdown(html, _options_key())
+
+
+@lru_cache(maxsize=4096)
+def _render_markdown(html: str, options: bytes) -> str:
+    key = _memo_key(html, options)
+    path = MD_CACHE_DIR / key[:2] / f'{key[2:]}.md'
+    try:
+        text = path.read_text(encoding='utf-8')
+        os.utime(path) # 最近用過，清的時候排後面
+        return text
+    except FileNotFoundError:
+        pass
+
+    with MARKDOWNIFY_SECONDS.time():
+        text = md(html, **orjson.loads(options))
+
+    if MD_CACHE_MAX_BYTES > 0:
+        _store(path, text.encode('utf-8'))
+    return text
+
+
+def _store(path: Path, data: bytes):
+    global _cache_bytes
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _cache_files())
+        else:
+            _cache_bytes += len(data)
+        if _cache_bytes > MD_CACHE_MAX_BYTES:
+            _cache_bytes = _evict(int(MD_CACHE_MAX_BYTES * _MD_CACHE_LOW_WATER))
+
+
+def _cache_files() -> list[tuple[float, int, Path]]:
+    files = []
+    for path in MD_CACHE_DIR.glob('*/*.md'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue # 另一個 process 剛清掉
+        files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def _evict(target: int) -> int:
+    '''從最久沒用到的開始刪，刪到不超過 target，回傳剩多大'''
+    files = sorted(_cache_files())
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= target:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
+
+
+def render_floors(floors: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    '''把 content_html 換成 content (位置不變)，已經是 markdown 的樓層原樣回傳'''
+    rendered = []
+    for floor in floors:
+        if 'content_html' not in floor:
+            rendered.append(floor)
+            continue
+        new_floor = {}
+        for key, value in floor.items():
+            if key == 'content_html':
+                new_floor['content'] = render_markdown(value)
+            else:
+                new_floor[key] = value
+        rendered.append(new_floor)
+    return rendered
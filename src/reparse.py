@@ -0,0 +1,94 @@
+'''
+用目前的 parse_post 重新解析 archive 裡的原始 HTML，覆寫 post_info
+不需要重新爬，用本機所有 CPU 跑
+
+    python -m src.reparse [--bsn 60076] [--workers 8]
+'''
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+from .parser import parse_post
+from .render import CONTENT_MODE
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_object(path: str, post_url: str, content_mode: str) -> tuple[str, str, str, str | None] | None:
+    # 在 subprocess 裡跑，只回傳要寫進 post_info 的東西
+    # content_mode 跟爬蟲一樣 (CONTENT_MODE=html 的資料庫重跑完還是存 HTML)
+    try:
+        with gzip.open(path, 'rb') as f:
+            html = f.read().decode()
+        result = parse_post(html, post_url, '', content_mode)
+        return post_url, result.title, result.encode_floors().decode(), result.post_time
+    except Exception:
+        logger.error(f'Error while reparsing {post_url}', exc_info=True)
+        return None
+
+
+async def reparse(bsn: str | None = None, workers: int | None = None) -> tuple[int, int]:
+    from .append_to_db import init_tables, get_reader, add_to_post_info
+    from .archive import object_path
+
+    await init_tables()
+
+    # 每篇貼文只取最新抓到的那份 (SQLite 的 MAX() 會讓其他欄位取同一列)
+    sql = "SELECT url, sha256, MAX(fetched_at) FROM raw_pages"
+    params = ()
+    if bsn:
+        sql += " WHERE bsn = ?"
+        params = (int(bsn),)
+    sql += " GROUP BY bsn, snA"
+    async with get_reader() as db:
+        cursor = await db.execute(sql, params)
+        rows = await cursor.fetchall()
+    logger.info(f'Reparsing {len(rows)} archived posts...')
+
+    workers = workers or os.cpu_count() or 1
+    loop = asyncio.get_running_loop()
+    done = failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 分批送，避免一次塞幾百萬個 future
+        batch_size = workers * 16
+        for start in range(0, len(rows), batch_size):
+            futures = [
+                loop.run_in_executor(pool, _parse_object, str(object_path(digest)), url, CONTENT_MODE)
+                for url, digest, _ in rows[start:start + batch_size]
+            ]
+            for result in await asyncio.gather(*futures):
+                if result is None:
+                    failed += 1
+                    continue
+                await add_to_post_info(*result)
+                done += 1
+
+            logger.info(f'Reparsed {done} posts ({failed} failed)')
+
+    return done, failed
+
+
+async def _main(args: argparse.Namespace):
+    from .append_to_db import close_client
+
+    try:
+        done, failed = await reparse(args.bsn, args.workers)
+        logger.info(f'Done, {done} posts rewritten, {failed} failed')
+    finally:
+        await close_client()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-parse archived C.php pages into post_info')
+    parser.add_argument('--bsn', help='only reparse this board')
+    parser.add_argument('--workers', type=int, help='number of processes (default: cpu count)')
+    args = parser.parse_args()
+
+    from .utils import init_runtime
+    init_runtime()
+    asyncio.run(_main(args))
@@ -1,312 +1,237 @@
 # 一托答辯的代碼
 
-from bs4 import BeautifulSoup
-from bs4.element import Tag
-from urllib.parse import urljoin
 import asyncio
 from datetime import datetime, timezone
-from httpx import Response
-from markdownify import markdownify as md
-from frozendict import frozendict
 import orjson
 import aiofiles
 import logging
-from typing import Any
+from typing import TYPE_CHECKING
+import os
 import random
-
-from .append_to_db import get_post_info, add_to_post_info, add_to_all_posts, get_client as get_db_client
-from .append_to_db.type import PostModel
-from . import utils
-from .utils import HttpxClient, SEM, DATA_DIR, init_httpx_client, safe_filename
-from .status import Status
+from time import perf_counter_ns
+
+from .append_to_db import get_post_info, add_to_post_info, add_to_all_posts, get_reader, shard_of
+from . import utils, metrics, tracing
+from .utils import SEM, DATA_DIR, init_httpx_client, safe_filename, post_key
+from .status import Status, ListState, PostState
+from .parser import parse_post, parse_post_list
+from .records import PostListing, jsonl_line
+from .render import CONTENT_MODE
+from .archive import ARCHIVE_RAW, archive_page
+from .media import MEDIA_CACHE, collect as collect_media
+from .stream_parse import STREAM_PARSE, StreamSink, PostStreamParser, PostListStreamParser
+from .frontier import PostFrontier, pack_key, load_seen, mark_seen, flush_seen
+
+if TYPE_CHECKING:
+    from httpx import Response
 
 logger = logging.getLogger(__name__)
 
+# 一個看板同時排隊的 C.php task 上限 (真正同時在抓的還是看 SEM)，不用一次幫幾十萬篇都開好 task
+POST_TASKS_PER_BOARD = int(os.getenv('POST_TASKS_PER_BOARD', 200))
+
 class Scraper:
     def __init__(self, title: str, bsn: str):
         self.title = title # theme title
         self.bsn = bsn
 
-        self.running_tasks: list[asyncio.Task] = []
-        Status.scrapers_status[self.bsn] = {
-            'theme_title': self.title,
-            'post_list_status': 'none',
-            'post_status': 'none',
-            'start_time': datetime.now(timezone.utc),
-            'end_time': None
-        }   
+        # 做完的 task 會自己移除
+        self.running_tasks: set[asyncio.Task] = set()
+        Status.register(self.bsn, self.title)
 
         self.is_first_run: bool = True
 
         self.WRITE_LOCK = asyncio.Lock()
 
-    def _update_status(self, key: str, value: Any):
-        if key not in Status.scrapers_status[self.bsn]:
-            raise ValueError(f'Invalid key: {key}')
-        Status.scrapers_status[self.bsn][key] = value
+    def _set_post_state(self, state: PostState, post_url: str):
+        key = post_key(post_url)
+        Status.set_post_state(self.bsn, state, key[1] if key else 0)
     
-    async def _fetch_with_retry(self, url: str, retries: int = 5) -> Response | None:
-        base_delay = 5
-        assert HttpxClient is not None
-        for i in range(retries):
-            try:
-                resp = await HttpxClient.get(url)
-                if resp.status_code == 429:
-                    if not resp.headers.get('Retry-After'):
-                        wait_time = base_delay * (2 ** i)
-                    else:
-                        wait_time = int(resp.headers.get('Retry-After'))
-                        
-                    logger.warning(f"Got 429 for {url}, waiting {wait_time:.2f}s(isRetryAfter: {resp.headers.get('Retry-After') is not None})...")
-                    self._update_status('post_status', f'waiting_429_{int(wait_time)}s')
-                    await asyncio.sleep(wait_time + random.uniform(5, 10))
-                    continue
-                return resp
-            except Exception as e:
-                logger.error(f"Error fetching {url}: {e}")
-                await asyncio.sleep(random.uniform(1, 3))
-        return None
-
-    async def _get_post_list(self) -> set[str]: # B.php, 單一bsn 的全部貼文連結
-        async with SEM:
-            await init_httpx_client()
-            assert HttpxClient is not None
-
-            self._update_status('post_list_status', 'fetching')
-
-            # 快取檢查
-            db = await get_db_client()
-            cursor = await db.execute("""
-                SELECT post_url FROM all_posts 
-                WHERE bsn = ? 
-                AND updated_at >= datetime('now', '-1 hour')
-            """, (self.bsn,))
-            cached_rows = await cursor.fetchall()
-                
-            if cached_rows:
-                cached_list = list(cached_rows)
-                logger.info(f"Cache hit for post list: {self.bsn} ({len(cached_list)} posts)")
-                self._update_status('post_list_status', 'fetched')
-                return set(row[0] for row in cached_list)
-
-            # 沒有快取，執行爬取
-            page_count = 1
-            all_urls = set()
-
-            while True:
-                resp = await self._fetch_with_retry(f'https://forum.gamer.com.tw/B.php?page={page_count}&bsn={self.bsn}')
-                if not resp or resp.status_code != 200: 
-                    logger.info(f'Failed to get {self.bsn}\'s post list, status code: {resp.status_code if resp else "None"}')
-                    break
-
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                
-                all_a = soup.findAll('a')
-                _all_urls = set(urljoin(str(resp.url), a['href']) for a in all_a if a.get('href', '').startswith('C.php'))
-                all_urls.update(_all_urls)
-                
-                page_count += 1
-                await asyncio.sleep(random.uniform(5, 10))
-
-            # 存入快取
-            utils.WRITE_DB_TASKS.append(asyncio.create_task(
-                add_to_all_posts([PostModel(bsn=self.bsn, post_url=url) for url in all_urls])
-            ))
-
-            self._update_status('post_list_status', 'fetched')
-            return all_urls
-
-
-    async def _get_post(self, post_url: str): # C.php, 單一貼文
+    async def _write_jsonl(self, line: bytes):
+        """line: 已經編碼好的一行 (見 records.jsonl_line)"""
+        if CONTENT_MODE == 'html':
+            # 內文還是 HTML，JSONL 交給 `python -m src.export` 匯出時再轉 markdown
+            return
+
+        async with self.WRITE_LOCK:
+            if self.is_first_run:
+                # 第一次啟動的話就清空原本的檔案，因為可能會手動進行多次爬蟲
+                self.is_first_run = False
+                DATA_DIR.mkdir(exist_ok=True) # 沒有呼叫 init_runtime 的話 (例如 test.py)
+                async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'wb') as f:
+                    await f.write(b'')
+
+            async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'ab') as f:
+                await f.write(line)
+
+    async def _fetch_with_retry(self, url: str, retries: int = 5, sink: StreamSink | None = None) -> 'Response | None':
+        return await utils.fetch_with_retry(
+            url, retries,
+            on_429=lambda wait_time: Status.set_post_state(self.bsn, PostState.WAITING_429, int(wait_time)),
+            sink=sink,
+        )
+
+    async def _get_post_list(self) -> PostFrontier: # B.php, 單一bsn 的全部貼文連結
+        """
+        Returns:
+            PostFrontier: items() 是 (C.php 網址 (canonical_post_url), 列表上的回覆數 / 最後回覆時間)
+        """
+        Status.set_list_state(self.bsn, ListState.FETCHING)
+
+        # 快取檢查
+        with tracing.span('cache_lookup', 'db'):
+            async with get_reader(shard_of(self.bsn)) as db:
+                cursor = await db.execute("""
+                    SELECT post_url, reply_count, gp, last_reply FROM all_posts 
+                    WHERE bsn = ? 
+                    AND updated_at >= datetime('now', '-1 hour')
+                """, (self.bsn,))
+                frontier = PostFrontier()
+                while rows := await cursor.fetchmany(10000):
+                    for row in rows:
+                        key = post_key(row[0])
+                        if key is not None:
+                            frontier.add(pack_key(*key), PostListing(*row))
+            
+        if frontier:
+            metrics.CACHE_REQUESTS_TOTAL.inc(cache='post_list', result='hit')
+            logger.info(f"Cache hit for post list: {self.bsn} ({len(frontier)} posts)")
+            Status.set_list_state(self.bsn, ListState.FETCHED)
+            return frontier
+
+        # 沒有快取，執行爬取
+        metrics.CACHE_REQUESTS_TOTAL.inc(cache='post_list', result='miss')
+        page_count = 1
+
+        while True:
+            sink = PostListStreamParser() if STREAM_PARSE else None
+            # SEM 只在抓這一頁的時候拿著，頁跟頁中間休息的時候要讓給別人 (discover_boards 的預抓也在等)
+            async with metrics.timed_acquire(SEM, 'post_list'):
+                resp = await self._fetch_with_retry(f'https://forum.gamer.com.tw/B.php?page={page_count}&bsn={self.bsn}', sink=sink)
+            if not resp or resp.status_code != 200: 
+                logger.info(f'Failed to get {self.bsn}\'s post list, status code: {resp.status_code if resp else "None"}')
+                break
+
+            if sink is not None:
+                # 邊下載邊解析完了
+                hrefs, rows = sink.close()
+                metrics.PARSE_SECONDS.observe(sink.parse_seconds, page='post_list')
+            else:
+                with metrics.PARSE_SECONDS.time(page='post_list'), tracing.span('parse', 'cpu'):
+                    hrefs, rows = parse_post_list(resp.text)
+
+            # tnum (回覆數) 會變，同一篇用 (bsn, snA) 當 key，不然每次有人回覆就多一筆
+            # href 都是 C.php?bsn=...&snA=... 的相對網址，只看 query 就好
+            for href in hrefs:
+                key = post_key(href)
+                if key is not None:
+                    frontier.add(pack_key(*key))
+            for row in rows:
+                key = post_key(row.url)
+                if key is not None:
+                    frontier.add(pack_key(*key), row)
+            
+            page_count += 1
+            await asyncio.sleep(random.uniform(5, 10))
+
+        # 存入快取
+        utils.spawn_db_write(add_to_all_posts(frontier.rows(self.bsn)))
+
+        Status.set_list_state(self.bsn, ListState.FETCHED)
+        return frontier
+
+    async def _get_post(self, post_url: str, listing: PostListing | None = None): # C.php, 單一貼文
         # 這長度大概算是一種屎山代碼了哈哈
-        async with SEM:
-            await init_httpx_client()
-            assert HttpxClient is not None
-
+        post_start = perf_counter_ns()
+        fetched = False
+        async with metrics.timed_acquire(SEM, 'post'):
             try:
-                self._update_status('post_status', f'fetching_{post_url}')
-
-                # 快取
-                cached_data = await get_post_info(post_url)
+                self._set_post_state(PostState.FETCHING, post_url)
+
+                # 快取 (Bloom filter 說沒存過的就不用查)
+                seen = await load_seen()
+                key = post_key(post_url)
+                if seen is not None and key is not None and pack_key(*key) not in seen:
+                    cached_data = None
+                else:
+                    with tracing.span('cache_lookup', 'db'):
+                        cached_data = await get_post_info(post_url)
                 
                 if cached_data:
-                    floors = orjson.loads(cached_data['floors'])
-                    if floors and len(floors) > 0:
-                        iso_time = floors[0].get('time')
-                        if iso_time:
-                            post_time = datetime.fromisoformat(iso_time)
-                            # 如果樓主貼文超過 30 天，直接使用快取
-                            # 因為我希望他有機會的話，去更新留言。一篇貼聞過 30 天大概也不會火了 (吧
-                            if (datetime.now(timezone.utc) - post_time).days > 30:
-                                CACHED_RESULT = {
-                                    'title': cached_data['title'],
-                                    'url': post_url,
-                                    'floors': floors
-                                }
-                                # 寫入檔案
-                                async with self.WRITE_LOCK:
-                                    # 第一次跑就清空檔案
-                                    if self.is_first_run:
-                                        self.is_first_run = False
-                                        async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'wb') as f:
-                                            await f.write(b'')
-                                    async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'ab') as f:
-                                        await f.write(orjson.dumps(CACHED_RESULT) + b'\n')
-
-                                logger.info(f'Wrote {post_url} (Cache hit)')
-                                self._update_status('post_status', f'fetched_{post_url}')
-                                return
-
-
-
-                resp = await self._fetch_with_retry(post_url)
+                    # 列表上的回覆數 / 最後回覆時間跟上次抓的時候一樣，內容不會變，不用再抓
+                    unchanged = listing is not None and listing.same_as(cached_data['list_reply_count'], cached_data['list_last_reply'])
+
+                    iso_time = cached_data['post_time']
+                    if iso_time is None and not unchanged:
+                        # 加 post_time 欄位之前存的，只好解開 floors 看
+                        floors = orjson.loads(cached_data['floors'])
+                        iso_time = floors[0].get('time') if floors else None
+                    # 如果樓主貼文超過 30 天，直接使用快取
+                    # 因為我希望他有機會的話，去更新留言。一篇貼聞過 30 天大概也不會火了 (吧
+                    if unchanged or (iso_time and (datetime.now(timezone.utc) - datetime.fromisoformat(iso_time)).days > 30):
+                        # floors 直接原封不動放進 JSONL，不用 decode 再 encode
+                        line = jsonl_line(cached_data['title'], post_url, cached_data['floors'])
+                        # 寫入檔案
+                        with tracing.span('jsonl_write', 'io'):
+                            await self._write_jsonl(line)
+
+                        metrics.CACHE_REQUESTS_TOTAL.inc(cache='post', result='hit')
+                        metrics.POSTS_TOTAL.inc(source='unchanged' if unchanged else 'cache')
+                        logger.info(f'Wrote {post_url} ({"Unchanged on list" if unchanged else "Cache hit"})')
+                        Status.count_post(self.bsn, 'cached')
+                        self._set_post_state(PostState.FETCHED, post_url)
+                        return
+
+
+
+                metrics.CACHE_REQUESTS_TOTAL.inc(cache='post', result='miss')
+                # 要存原始 HTML 的話只能整頁讀進來
+                sink = PostStreamParser(post_url, self.title, CONTENT_MODE) if STREAM_PARSE and not ARCHIVE_RAW else None
+                fetched = True
+                resp = await self._fetch_with_retry(post_url, sink=sink)
                 if not resp or resp.status_code != 200: 
                     logger.info(f'Failed to get {post_url}, status code: {resp.status_code if resp else "None"}')
+                    Status.count_post(self.bsn, 'failed')
                     return
-                    
-                soup = BeautifulSoup(resp.text, 'html.parser')
-
-                # 該篇貼文的 標題
-                title = soup.select('.c-post__header__title')[0].text.strip()
-                FINAL_RESULT = {
-                    'theme_title': self.title,
-                    'title': title,
-                    'url': post_url,
-                    'floors': []
-                }
-
-                for idx, post in enumerate(soup.select('.c-post')):
-                    assert isinstance(post, Tag)
-                    FINAL_RESULT['floors'].append({'index': idx})
-
-                    # get tag，基本上一篇文章只有一個 tag
-                    FINAL_RESULT['floors'][idx]['tags'] = {}
-                    tags = post.select('.tag-category a')
-                    for tag in tags:
-                        tag_href = tag.get('href')
-                        tag_text = tag.find('div').get_text(strip=True)
-                        FINAL_RESULT['floors'][idx]['tags'][tag_text] = tag_href
-
-                    # 取得 author 資訊
-                    div_author = post.select('.c-post__header__author')[0]
-                    author_name = div_author.select('.username')[0].text.strip()
-                    author_id = div_author.select('.userid')[0].text.strip()
-                    author_url = urljoin(post_url, div_author.select('.userid')[0].get('href'))
-                    FINAL_RESULT['floors'][idx]['author'] = {
-                        'name': author_name,
-                        'id': author_id,
-                        'url': author_url
-                    }
-                    
-                    # 取得時間資訊
-                    div_info = post.select('.c-post__header__info')[0]
-                    time_str = div_info.select('.edittime')[0].get('data-mtime')
-                    utc8_time = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-                    utc_time = utc8_time.astimezone(timezone.utc)
-                    utc_time_iso = utc_time.isoformat()
-                    FINAL_RESULT['floors'][idx]['time'] = utc_time_iso    
-                    
-                    # 取得內文
-                    article = post.select('article div')[0]
-                    article_text = md(str(article))
-                    FINAL_RESULT['floors'][idx]['content'] = article_text
-
-                    # 取得點讚
-                    div_button_bar = post.select('.c-post__body__buttonbar')[0]
-                    assert isinstance(div_button_bar, Tag)
-                    like_count = div_button_bar.select('.gp a')[0].text.strip()
-                    dislike_count = div_button_bar.select('.bp a')[0].text.strip()
-                    
-                    if like_count == '-': # - 代表沒人點
-                        like_count = 0
-                    if dislike_count == '-': # - 代表沒人點
-                        dislike_count = 0
-                        
-                    try:
-                        FINAL_RESULT['floors'][idx]['like_count'] = int(like_count)
-                    except:
-                        FINAL_RESULT['floors'][idx]['like_count'] = 1000 # 有可能出現為爆
-                    try:
-                        FINAL_RESULT['floors'][idx]['dislike_count'] = int(dislike_count)
-                    except:
-                        FINAL_RESULT['floors'][idx]['dislike_count'] = 1000 # 有可能出現為爆
-                    
-                    # 取得留言
-                    comments = set()
-
-                    div_comment = post.select('.c-reply')[0]
-                    assert isinstance(div_comment, Tag)
-                    for div in div_comment.select('div'): # 每個留言
-                        assert isinstance(div, Tag)
-                        div_reply_item = div.select('div')
-                        if not div_reply_item:
-                            continue
-                        div_reply_item = div_reply_item[0]
-                        assert isinstance(div_reply_item, Tag)
-
-                        # Start 找頭貼
-                        a_reply_avatar = div_reply_item.select('.reply-avatar')
-                        if not a_reply_avatar:
-                            continue
-                        a_reply_avatar = a_reply_avatar[0]
-                        assert isinstance(a_reply_avatar, Tag)
-
-                        # End 找頭貼
-                        avatar_url = a_reply_avatar.select('img')[0].get('data-src').strip()
-
-                        # Start 找使用者
-                        div_reply_content = div_reply_item.select('.reply-content')[0]
-                        user_href = div_reply_content.select('a')[0].get('href').strip()
-
-                        # End 找使用者
-                        user_url = urljoin(post_url, user_href)
-                        user_name = div_reply_content.select('a')[0].text.strip()
-                        comment_text = div_reply_content.select('article span')[0].text.strip()
-
-                        # Start 找時間
-                        div_all_edit_time = div_reply_item.find_all('div', class_='edittime')
-
-                        # End 找時間
-                        utc8_time = ' '.join(div_all_edit_time[1].get('data-tippy-content').split()[1:])
-                        utc_time = datetime.strptime(utc8_time, '%Y-%m-%d %H:%M:%S')
-                        utc_time = utc_time.astimezone(timezone.utc)
-                        utc_time_iso = utc_time.isoformat()
-
-                        floor = div_all_edit_time[0].text.strip()
-
-                        comments.add(frozendict({ # 我不知道為什麼會有重複的
-                            'avatar_url': avatar_url,
-                            'user_url': user_url,
-                            'user_name': user_name,
-                            'comment_text': comment_text,
-                            'floor': floor,
-                            'time': utc_time_iso
-                        }))
-
-                    comments = list(comments)
-                    comments.sort(key=lambda x: int(x['floor'][1:])) # B1 -> 1
-                    FINAL_RESULT['floors'][idx]['comments'] = comments
+
+                if sink is not None:
+                    FINAL_RESULT = sink.close()
+                    metrics.PARSE_SECONDS.observe(sink.parse_seconds, page='post')
+                else:
+                    if ARCHIVE_RAW:
+                        # 先存原始 HTML，之後 parser 有改就能用 reparse 重跑
+                        utils.spawn_db_write(archive_page(post_url, resp.text))
+
+                    with metrics.PARSE_SECONDS.time(page='post'), tracing.span('parse', 'cpu'):
+                        FINAL_RESULT = parse_post(resp.text, post_url, self.title, CONTENT_MODE)
+
+                # floors 只 encode 一次，資料庫跟 JSONL 共用
+                floors_json = FINAL_RESULT.encode_floors()
 
                 # 同步到資料庫
-                await add_to_post_info(post_url, title, orjson.dumps(FINAL_RESULT['floors']).decode())
+                with tracing.span('db_upsert', 'db'):
+                    await add_to_post_info(post_url, FINAL_RESULT.title, floors_json.decode(), FINAL_RESULT.post_time, listing, FINAL_RESULT)
+                if seen is not None and key is not None:
+                    mark_seen(pack_key(*key))
+                if MEDIA_CACHE:
+                    # 頭貼 / 圖片在背景抓 (MEDIA_CONCURRENCY 個 worker)，不用等
+                    utils.spawn_db_write(collect_media(FINAL_RESULT))
 
                 # 寫入檔案
-                async with self.WRITE_LOCK:
-                    if self.is_first_run:
-                        # 第一次啟動的話就清空原本的檔案，因為可能會手動進行多次爬蟲
-                        self.is_first_run = False
-                        async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'wb') as f:
-                            await f.write(b'')
-
-                    async with aiofiles.open(DATA_DIR / f'{self.bsn}-{safe_filename(self.title)}.jsonl', 'ab') as f:
-                        await f.write(orjson.dumps(FINAL_RESULT) + b'\n')
+                with tracing.span('jsonl_write', 'io'):
+                    await self._write_jsonl(jsonl_line(FINAL_RESULT.title, post_url, floors_json, self.title))
 
+                metrics.POSTS_TOTAL.inc(source='fetch')
                 logger.info(f'Wrote {post_url}')
-                self._update_status('post_status', f'fetched_{post_url}')
+                Status.count_post(self.bsn, 'posts')
+                self._set_post_state(PostState.FETCHED, post_url)
             except:
                 logger.error(f'Error while fetching {post_url}', exc_info=True)
+                Status.count_post(self.bsn, 'failed')
             finally:
-                await asyncio.sleep(random.uniform(5, 10)) # 休息 5-10 秒
+                tracing.record('post', 'post', post_start, perf_counter_ns(), {'url': post_url})
+                if fetched:
+                    await asyncio.sleep(random.uniform(5, 10)) # 休息 5-10 秒 (沒有真的去抓就不用)
 
     
     async def scrape(self):
@@ -314,12 +239,24 @@ class Scraper:
             await init_httpx_client()
             post_list = await self._get_post_list()
 
-            for post_url in post_list:
-                self.running_tasks.append(asyncio.create_task(self._get_post(post_url)))
+            for post_url, listing in post_list.items():
+                if len(self.running_tasks) >= POST_TASKS_PER_BOARD:
+                    await asyncio.wait(self.running_tasks, return_when=asyncio.FIRST_COMPLETED)
+                task = asyncio.create_task(self._get_post(post_url, listing), name=f'post:{post_url}')
+                self.running_tasks.add(task)
+                task.add_done_callback(self.running_tasks.discard)
 
             await asyncio.gather(*self.running_tasks)
         finally:
             await self.close()
+            try:
+                await flush_seen() # SEEN_BLOOM=1: 不用等到正常結束才存
+            except Exception:
+                logger.error('Error while saving seen.bloom', exc_info=True)
+            Status.finish(self.bsn)
+            # 做完就放掉這個 Scraper，狀態只留 Status 裡的 BoardState
+            if utils.SCRAPERS.get(self.bsn) is self:
+                del utils.SCRAPERS[self.bsn]
 
     async def close(self):
         try:
@@ -327,6 +264,5 @@ class Scraper:
                 task.cancel()
 
             await asyncio.gather(*self.running_tasks)
-            self._update_status('end_time', datetime.now(timezone.utc))
         except asyncio.CancelledError:
             pass
\ No newline at end of file
@@ -1,28 +1,188 @@
-from typing import TypedDict
-from datetime import datetime
+from enum import IntEnum
+from collections import deque
+from bisect import insort
+from datetime import datetime, timezone
+import asyncio
+import time
 
-class ScraperStatus(TypedDict):
-    theme_title: str
-    post_list_status: str
-    post_status: str
-    start_time: datetime
-    end_time: datetime | None
+class ListState(IntEnum):
+    NONE = 0
+    FETCHING = 1
+    FETCHED = 2
+
+
+class PostState(IntEnum):
+    NONE = 0
+    FETCHING = 1
+    FETCHED = 2
+    WAITING_429 = 3
+
+
+class BoardState:
+    '''
+    單一看板的狀態，看板多的時候會有上千個，所以用 __slots__ + 整數編碼，不存 datetime 跟長字串
+    detail: FETCHING / FETCHED 時是貼文的 snA，WAITING_429 時是要等幾秒
+    看板爬完之後 Scraper 物件會被釋放，只留下這筆 (含 posts / cached / failed 統計)
+    '''
+    __slots__ = ('title', 'search_key', 'list_state', 'post_state', 'detail', 'start_time', 'end_time', 'posts', 'cached', 'failed')
+
+    def __init__(self, bsn: str, title: str):
+        self.title = title
+        self.search_key = f'{bsn}\0{title}'.lower()
+        self.list_state = ListState.NONE
+        self.post_state = PostState.NONE
+        self.detail = 0
+        self.start_time = time.time()
+        self.end_time = 0.0
+        self.posts = 0
+        self.cached = 0
+        self.failed = 0
+
+    @property
+    def post_status(self) -> str:
+        match self.post_state:
+            case PostState.NONE:
+                return 'none'
+            case PostState.WAITING_429:
+                return f'waiting_429_{self.detail}s'
+            case state:
+                return f'{state.name.lower()}_{self.detail}'
+
+    def to_dict(self) -> dict:
+        '''給 API / 前端用的格式'''
+        return {
+            'theme_title': self.title,
+            'post_list_status': self.list_state.name.lower(),
+            'post_status': self.post_status,
+            'start_time': datetime.fromtimestamp(self.start_time, timezone.utc),
+            'end_time': datetime.fromtimestamp(self.end_time, timezone.utc) if self.end_time else None,
+            'posts': self.posts,
+            'cached': self.cached,
+            'failed': self.failed,
+        }
 
 
 class _Status:
+    '''
+    scrapers_status 只能透過 register / set_* 修改
+    這樣才能順便維護排序好的 bsn、active 數量跟版本號，/api/status 跟 SSE 都不用每次掃過全部看板
+    '''
+    CHANGE_LOG_SIZE = 50_000
+
     def __init__(self):
-        self.curr_status = 'none'
+        self._curr_status = 'none'
+        self.page_count = 0 # 看板列表抓到第幾頁 (main 會更新)
+
+        self.scrapers_status: dict[str, BoardState] = {} # bsn: status
 
-        self.scrapers_status: dict[str, ScraperStatus] = {} # bsn: status
+        self.sorted_bsns: list[str] = []
+        self.active_count = 0 # post_state != NONE 的數量
+
+        # 每次有變動 version + 1，change_log 記錄 (從哪個 version, 到哪個 version, bsn)，bsn 為 None 代表全域狀態
+        # 同一個看板連續的變動 (每篇貼文都會算一次) 合併成一筆，不然 change_log 很快就被擠掉
+        self.version = 0
+        self._change_log: deque[tuple[int, int, str | None]] = deque(maxlen=self.CHANGE_LOG_SIZE)
+        self._changed = asyncio.Event()
+
+    def _bump(self, bsn: str | None):
+        self.version += 1
+        if self._change_log and self._change_log[-1][2] == bsn:
+            self._change_log[-1] = (self._change_log[-1][0], self.version, bsn)
+        else:
+            self._change_log.append((self.version, self.version, bsn))
+        # 叫醒所有在等的 SSE，再換一個新的 Event 給下一輪
+        self._changed.set()
+        self._changed = asyncio.Event()
 
     @property
-    def page_count(self):
-        from .main import page_count
-        return page_count
+    def curr_status(self) -> str:
+        return self._curr_status
+
+    @curr_status.setter
+    def curr_status(self, value: str):
+        self._curr_status = value
+        self._bump(None)
+
+    def register(self, bsn: str, title: str) -> BoardState:
+        old = self.scrapers_status.get(bsn)
+        if old is None:
+            insort(self.sorted_bsns, bsn)
+        elif old.post_state != PostState.NONE:
+            self.active_count -= 1
+
+        state = self.scrapers_status[bsn] = BoardState(bsn, title)
+        self._bump(bsn)
+        return state
+
+    def set_list_state(self, bsn: str, list_state: ListState):
+        self.scrapers_status[bsn].list_state = list_state
+        self._bump(bsn)
+
+    def set_post_state(self, bsn: str, post_state: PostState, detail: int = 0):
+        state = self.scrapers_status[bsn]
+        self.active_count += (post_state != PostState.NONE) - (state.post_state != PostState.NONE)
+        state.post_state = post_state
+        state.detail = detail
+        self._bump(bsn)
+
+    def count_post(self, bsn: str, result: str):
+        '''result: posts / cached / failed'''
+        state = self.scrapers_status[bsn]
+        setattr(state, result, getattr(state, result) + 1)
+        self._bump(bsn) # SSE 多久推一次是 /api/status/stream 的 interval 決定的，這裡不用另外節流
+
+    def finish(self, bsn: str):
+        self.scrapers_status[bsn].end_time = time.time()
+        self._bump(bsn)
+
+    def query(self, page: int, limit: int, q: str = '') -> tuple[list[tuple[str, BoardState]], int, int]:
+        '''
+        Returns:
+            (這一頁的 (bsn, status), 符合搜尋的數量, 符合搜尋中 active 的數量)
+        '''
+        q = q.lower().strip()
+        start = (page - 1) * limit
+
+        if not q:
+            bsns = self.sorted_bsns[start:start + limit]
+            return [(bsn, self.scrapers_status[bsn]) for bsn in bsns], len(self.sorted_bsns), self.active_count
+
+        matched = [bsn for bsn in self.sorted_bsns if q in self.scrapers_status[bsn].search_key]
+        active = sum(1 for bsn in matched if self.scrapers_status[bsn].post_state != PostState.NONE)
+        return [(bsn, self.scrapers_status[bsn]) for bsn in matched[start:start + limit]], len(matched), active
+
+    def changes_since(self, version: int) -> tuple[dict[str, BoardState], bool] | None:
+        '''
+        Returns:
+            ({bsn: status}, 全域狀態是否有變)；太舊 (change_log 已經被擠掉) 回傳 None，要重新拿一次完整的
+        '''
+        if version >= self.version:
+            return {}, False
+        if not self._change_log or self._change_log[0][0] > version + 1:
+            return None
+
+        changed: dict[str, BoardState] = {}
+        global_changed = False
+        for _, ver, bsn in reversed(self._change_log):
+            if ver <= version:
+                break
+            if bsn is None:
+                global_changed = True
+            elif bsn not in changed:
+                changed[bsn] = self.scrapers_status[bsn]
+        return changed, global_changed
+
+    async def wait_for_change(self, version: int, timeout: float):
+        if self.version > version:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
     @property
     def tasks(self):
-        from .main import TASKS
+        from .utils import TASKS
         return TASKS
 
     @property
@@ -30,4 +190,4 @@ class _Status:
         from .utils import SCRAPERS
         return SCRAPERS
 
-Status = _Status()
\ No newline at end of file
+Status = _Status()
@@ -0,0 +1,226 @@
+'''
+串流解析: 邊下載邊解析，不用整頁讀進來再建整棵 DOM (STREAM_PARSE=0 關掉)
+
+C.php 一頁大部分是 script、側欄、廣告，真正要的只有 .c-post
+- SubtreeCapture 用 html.parser 掃過去，只把指定 class 的元素 (含子孫) 的原始 HTML 留下來，其他看過就丟
+- PostStreamParser 每收完一個 .c-post 就馬上交給 parse_floor，同時間只有一樓的 DOM
+- PostListStreamParser (B.php) 收 C.php 連結的 href，每一列 (.b-list__row) 收完交給 parse_list_row
+
+ARCHIVE_RAW=1 時 C.php 還是整頁讀 (要存原始 HTML)
+'''
+import os
+from html.parser import HTMLParser
+from time import perf_counter
+from typing import Callable
+
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLTreeBuilder
+
+from .parser import parse_floor, parse_list_row
+from .records import Post, PostListing
+
+STREAM_PARSE = os.getenv('STREAM_PARSE', '1') != '0'
+
+_VOID_TAGS = HTMLTreeBuilder.empty_element_tags # 沒有 end tag 的 (br, img...)，跟 bs4 一樣
+
+
+class SubtreeCapture(HTMLParser):
+    '''
+    class 有 capture_classes 其中一個的元素 (已經在收的裡面的不算)，收完整個 subtree 就呼叫 on_subtree(html)
+    html 是原始的 HTML (entity 不轉換)，丟給 BeautifulSoup 解析結果跟整頁解析一樣
+    '''
+    def __init__(self, capture_classes: set[str], on_subtree: Callable[[str], None]):
+        super().__init__(convert_charrefs=False) # &lt; 要原樣留著，不然丟給 bs4 會變成 tag
+        self._classes = frozenset(capture_classes)
+        self._on_subtree = on_subtree
+        self._stack: list[str] = [] # 正在收的 subtree 裡還沒關的 tag
+        self._parts: list[str] = []
+
+    def _wanted(self, attrs: list[tuple[str, str | None]]) -> bool:
+        for name, value in attrs:
+            if name == 'class' and value and not self._classes.isdisjoint(value.split()):
+                return True
+        return False
+
+    def _flush(self):
+        html = ''.join(self._parts)
+        self._parts.clear()
+        self._on_subtree(html)
+
+    def handle_starttag(self, tag, attrs):
+        if not self._stack and not self._wanted(attrs):
+            return
+        self._parts.append(self.get_starttag_text())
+        if tag not in _VOID_TAGS:
+            self._stack.append(tag)
+        elif not self._stack:
+            self._flush()
+
+    def handle_startendtag(self, tag, attrs):
+        if not self._stack and not self._wanted(attrs):
+            return
+        self._parts.append(self.get_starttag_text())
+        if not self._stack:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return # 沒在收，或是沒開過的 end tag (bs4 也是直接忽略)
+        self._parts.append(f'</{tag}>')
+        # 中間沒關的 tag 一起關掉 (跟 bs4 的 html.parser 一樣)
+        while self._stack.pop() != tag:
+            pass
+        if not self._stack:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._stack:
+            self._parts.append(data)
+
+    def handle_entityref(self, name):
+        if self._stack:
+            self._parts.append(f'&{name};')
+
+    def handle_charref(self, name):
+        if self._stack:
+            self._parts.append(f'&#{name};')
+
+    def handle_comment(self, data):
+        if self._stack:
+            self._parts.append(f'<!--{data}-->')
+
+
+class StreamSink:
+    '''
+    utils.fetch_with_retry(sink=...) 每讀到一塊 body 就 feed 一次
+    - 每次 (重試) 開始讀之前會呼叫 reset()
+    - 解析的錯誤先存起來，close() 才丟出來，不然會被當成連線錯誤一直重試
+    '''
+    def __init__(self):
+        self.parse_seconds = 0.0
+        self._error: Exception | None = None
+
+    def reset(self):
+        self.parse_seconds = 0.0
+        self._error = None
+
+    def feed(self, text: str):
+        if self._error is not None:
+            return
+        start = perf_counter()
+        try:
+            self._feed(text)
+        except Exception as e:
+            self._error = e
+        finally:
+            self.parse_seconds += perf_counter() - start
+
+    def close(self):
+        if self._error is None:
+            start = perf_counter()
+            try:
+                self._close()
+            except Exception as e:
+                self._error = e
+            finally:
+                self.parse_seconds += perf_counter() - start
+        if self._error is not None:
+            raise self._error
+        return self._result()
+
+    def _feed(self, text: str):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _result(self):
+        raise NotImplementedError
+
+
+class PostStreamParser(StreamSink):
+    '''C.php，close() 回傳跟 parse_post 一樣的 Post'''
+    def __init__(self, post_url: str, theme_title: str, content_mode: str = 'markdown'):
+        self.post_url = post_url
+        self.theme_title = theme_title
+        self.content_mode = content_mode
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self._title: str | None = None
+        self._floors = []
+        # 標題在第一樓裡面，不在的話也會單獨收到
+        self._capture = SubtreeCapture({'c-post', 'c-post__header__title'}, self._on_subtree)
+
+    def _on_subtree(self, html: str):
+        soup = BeautifulSoup(html, 'html.parser')
+        if self._title is None:
+            titles = soup.select('.c-post__header__title')
+            if titles:
+                self._title = titles[0].text.strip()
+        for post in soup.select('.c-post'):
+            self._floors.append(parse_floor(post, len(self._floors), self.post_url, self.content_mode))
+        _decompose(soup)
+
+    def _feed(self, text: str):
+        self._capture.feed(text)
+
+    def _close(self):
+        self._capture.close()
+        if self._title is None:
+            raise ValueError(f'No title found in {self.post_url}')
+
+    def _result(self) -> Post:
+        return Post(theme_title=self.theme_title, title=self._title, url=self.post_url, floors=self._floors)
+
+
+class _ListCapture(SubtreeCapture):
+    '''收 .b-list__row 的同時，順便記下整頁所有 C.php 開頭的 href'''
+    def __init__(self, on_row: Callable[[str], None]):
+        super().__init__({'b-list__row'}, on_row)
+        self.hrefs: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href') or ''
+            if href.startswith('C.php'):
+                self.hrefs.append(href)
+        super().handle_starttag(tag, attrs)
+
+
+class PostListStreamParser(StreamSink):
+    '''B.php，close() 回傳跟 parser.parse_post_list 一樣的 (hrefs, rows)'''
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self._rows: list[PostListing] = []
+        self._capture = _ListCapture(self._on_row)
+
+    def _on_row(self, html: str):
+        soup = BeautifulSoup(html, 'html.parser')
+        for row in soup.select('.b-list__row'):
+            listing = parse_list_row(row)
+            if listing is not None:
+                self._rows.append(listing)
+        _decompose(soup)
+
+    def _feed(self, text: str):
+        self._capture.feed(text)
+
+    def _close(self):
+        self._capture.close()
+
+    def _result(self) -> tuple[list[str], list[PostListing]]:
+        return self._capture.hrefs, self._rows
+
+
+def _decompose(soup: BeautifulSoup):
+    # bs4 的樹是循環參照，不拆掉的話要等 GC 才會釋放 (解析的結果都是 str，沒有留著 Tag)
+    # 要從最上層的元素拆，BeautifulSoup 本身 decompose 只會清掉自己
+    for element in list(soup.contents):
+        element.decompose()
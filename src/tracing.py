@@ -0,0 +1,147 @@
+'''
+輕量的 trace span，存在 ring buffer 裡，可以從 GET /api/trace 下載成 Chrome trace-event JSON
+(chrome://tracing 或 https://ui.perfetto.dev 打開)
+
+TRACE=1 時才記 (預設關掉)
+每個 asyncio task 是一條 "thread"，所以同一篇貼文的 sem_wait / fetch / parse / db_upsert 會排在同一列
+
+另外有一個取樣式的 profiler (POST /api/profile/start, /api/profile/stop)
+會定時抓 event loop 那條 thread 的 stack，輸出 folded stacks，可以丟給 flamegraph.pl 或 speedscope
+'''
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+from time import perf_counter_ns, sleep
+from typing import Any
+
+TRACE_ENABLED = os.getenv('TRACE', '0') == '1'
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '100000'))
+
+# (name, cat, start_ns, end_ns, tid, args)
+SPANS: deque[tuple[str, str, int, int, int, dict[str, Any] | None]] = deque(maxlen=TRACE_BUFFER_SIZE)
+_TASK_NAMES: dict[int, str] = {}
+# id(task) 在 task 結束之後會被別的 task 重用，所以每個 task 另外發一個遞增的編號
+_TASK_IDS: weakref.WeakKeyDictionary[asyncio.Task, int] = weakref.WeakKeyDictionary()
+_NEXT_TID = itertools.count(1)
+_PID = os.getpid()
+
+
+def _tid() -> int:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is None:
+        return threading.get_ident()
+
+    tid = _TASK_IDS.get(task)
+    if tid is None:
+        tid = _TASK_IDS[task] = next(_NEXT_TID)
+        if len(_TASK_NAMES) > TRACE_BUFFER_SIZE:
+            _TASK_NAMES.clear()
+        _TASK_NAMES[tid] = task.get_name()
+    return tid
+
+
+def record(name: str, cat: str, start_ns: int, end_ns: int, args: dict[str, Any] | None = None):
+    if TRACE_ENABLED:
+        SPANS.append((name, cat, start_ns, end_ns, _tid(), args))
+
+
+@contextmanager
+def span(name: str, cat: str = '', **args):
+    '''sync / async 都可以用 `with tracing.span(...)`'''
+    if not TRACE_ENABLED:
+        yield args
+        return
+
+    start = perf_counter_ns()
+    try:
+        yield args # 可以在 with 裡面補 args，例如 status code
+    finally:
+        record(name, cat, start, perf_counter_ns(), args or None)
+
+
+def to_chrome_trace() -> dict[str, Any]:
+    events = []
+    tids = set()
+    for name, cat, start, end, tid, args in list(SPANS):
+        tids.add(tid)
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': (end - start) / 1000,
+            'pid': _PID,
+            'tid': tid,
+        }
+        if args:
+            event['args'] = args
+        events.append(event)
+
+    for tid in tids:
+        events.append({
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': _PID,
+            'tid': tid,
+            'args': {'name': _TASK_NAMES.get(tid, f'thread-{tid}')},
+        })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+class SamplingProfiler:
+    '''在另一條 thread 定時抓目標 thread 的 stack (預設是呼叫 start 的 thread，也就是 event loop)'''
+
+    def __init__(self):
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._target: int | None = None
+        self.samples: Counter[str] = Counter()
+        self.interval = 0.005
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.005):
+        if self.running:
+            return
+        self.samples = Counter()
+        self.interval = interval
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.folded()
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+            sleep(self.interval)
+
+    def folded(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+PROFILER = SamplingProfiler()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-import httpx
 import asyncio
+import codecs
 from typing import TYPE_CHECKING
 from pathlib import Path
 import logging
@@ -9,13 +9,20 @@ import logging.handlers
 import sys
 import os
 import re
+import random
+from time import perf_counter
+from typing import Callable
+from urllib.parse import urlparse, parse_qs
+
+from . import metrics, tracing
 
 if TYPE_CHECKING:
+    import httpx
     from scraper import Scraper
+    from .stream_parse import StreamSink
 
 TOP_SCRAPE_TASK: asyncio.Task | None = None
 
-_limit = httpx.Limits(max_keepalive_connections=51, max_connections=50)
 headers = {
     "User-Agent": (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -33,13 +40,15 @@ headers = {
     "Sec-Fetch-User": "?1",
 }
 
-HttpxClient: httpx.AsyncClient | None = httpx.AsyncClient(limits=_limit, headers=headers, proxy=os.getenv("HTTP_PROXY"))
+# 第一次要抓東西的時候才建立 (只開 API 的話根本用不到)
+HttpxClient: httpx.AsyncClient | None = None
 
 async def init_httpx_client():
     global HttpxClient
     if HttpxClient is None or HttpxClient.is_closed:
+        import httpx
         HttpxClient = httpx.AsyncClient(
-            limits=_limit, 
+            limits=httpx.Limits(max_keepalive_connections=51, max_connections=50), 
             headers=headers, 
             proxy=os.getenv("HTTP_PROXY")
         )
@@ -50,16 +59,112 @@ async def close_httpx_client():
         await HttpxClient.aclose()
     HttpxClient = None
 
-SCRAPERS: list[Scraper] = []
-WRITE_DB_TASKS: list[asyncio.Task] = []
+# 串流讀取 (sink) 時 body 的上限 (解壓後)，超過就放棄這一頁
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", 16 * 1024 * 1024))
+
+class BodyTooLarge(Exception):
+    pass
+
+async def _stream_into(url: str, sink: StreamSink, headers: dict[str, str] | None = None) -> httpx.Response:
+    """
+    body 一塊一塊 decode 之後丟給 sink，不會整個留在記憶體裡 (resp.text 是空的)
+    sink.binary 為 True 的話不 decode，直接丟 bytes (圖片)；上限是 sink.max_bytes (沒有的話 MAX_BODY_BYTES)
+    """
+    limit = getattr(sink, 'max_bytes', MAX_BODY_BYTES)
+    binary = getattr(sink, 'binary', False)
+    sink.reset()
+    async with HttpxClient.stream('GET', url, headers=headers) as resp:
+        if resp.status_code != 200:
+            return resp # 429、304 之類的，body 不用讀
+
+        length = resp.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > limit:
+            raise BodyTooLarge(f'{url} is larger than {limit} bytes')
+
+        decoder = None if binary else codecs.getincrementaldecoder(resp.charset_encoding or 'utf-8')(errors='replace')
+        size = 0
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            if size > limit:
+                raise BodyTooLarge(f'{url} is larger than {limit} bytes')
+            sink.feed(chunk if decoder is None else decoder.decode(chunk))
+        if decoder is not None:
+            sink.feed(decoder.decode(b'', final=True))
+    return resp
+
+async def fetch_with_retry(url: str, retries: int = 5, on_429: Callable[[float], None] | None = None, sink: StreamSink | None = None, headers: dict[str, str] | None = None) -> httpx.Response | None:
+    """
+    GET + 429 / 連線錯誤重試，board_list / B.php / C.php 共用
+    on_429: 收到 429 要開始等之前呼叫 (參數是要等幾秒)，給 Status 顯示用
+    sink: 有的話用 stream 讀，200 的 body 邊讀邊丟給 sink (見 stream_parse.py)，結果用 sink.close() 拿
+    headers: 這次請求另外加的 header (例如 If-None-Match)
+    重試都失敗回傳 None，其他狀態碼原樣回傳讓呼叫端自己判斷；body 超過 MAX_BODY_BYTES 也是 None (不重試)
+    """
+    logger = logging.getLogger(__name__)
+    base_delay = 5
+    host = metrics.host_of(url)
+    for i in range(retries):
+        try:
+            await init_httpx_client()
+            assert HttpxClient is not None
+
+            start = perf_counter()
+            with tracing.span('fetch', 'http', url=url) as span_args:
+                try:
+                    resp = await (HttpxClient.get(url, headers=headers) if sink is None else _stream_into(url, sink, headers))
+                except BodyTooLarge:
+                    metrics.HTTP_REQUEST_SECONDS.observe(perf_counter() - start, host=host, status='too_large')
+                    raise
+                except Exception:
+                    metrics.HTTP_REQUEST_SECONDS.observe(perf_counter() - start, host=host, status='error')
+                    raise
+                span_args['status'] = resp.status_code
+            metrics.HTTP_REQUEST_SECONDS.observe(perf_counter() - start, host=host, status=resp.status_code)
+
+            if resp.status_code == 429:
+                metrics.HTTP_429_TOTAL.inc(host=host)
+                metrics.HTTP_RETRIES_TOTAL.inc(host=host, reason='429')
+                if not resp.headers.get('Retry-After'):
+                    wait_time = base_delay * (2 ** i)
+                else:
+                    wait_time = int(resp.headers.get('Retry-After'))
+
+                logger.warning(f"Got 429 for {url}, waiting {wait_time:.2f}s(isRetryAfter: {resp.headers.get('Retry-After') is not None})...")
+                if on_429 is not None:
+                    on_429(wait_time)
+                with tracing.span('backoff_429', 'http', wait=wait_time):
+                    await asyncio.sleep(wait_time + random.uniform(5, 10))
+                continue
+            return resp
+        except BodyTooLarge as e:
+            logger.warning(f"{e}, skipped")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching {url}: {e}")
+            metrics.HTTP_RETRIES_TOTAL.inc(host=host, reason='error')
+            await asyncio.sleep(random.uniform(1, 3))
+    return None
+
+SCRAPERS: dict[str, Scraper] = {} # bsn: Scraper，爬完的會自己移除
+TASKS: set[asyncio.Task] = set() # 每個看板的 scrape() task，只留還在跑的
+WRITE_DB_TASKS: set[asyncio.Task] = set() # 只留還沒做完的
+
+def spawn_db_write(coro) -> asyncio.Task:
+    """背景寫入資料庫，做完就從 WRITE_DB_TASKS 移除"""
+    task = asyncio.create_task(coro)
+    WRITE_DB_TASKS.add(task)
+    task.add_done_callback(_on_db_write_done)
+    return task
+
+def _on_db_write_done(task: asyncio.Task):
+    WRITE_DB_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.getLogger(__name__).error('Error while writing to db', exc_info=task.exception())
 
 SEM = asyncio.Semaphore(5)
 
 DATA_DIR = Path('data')
-DATA_DIR.mkdir(exist_ok=True)
-
 log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
 
 def setup_logging():
     # 格式器 (Formatter) 維持不變，寫得很好
@@ -117,9 +222,23 @@ class StreamToLogger:
     def isatty(self):
         return False
 
-sys.stdout = StreamToLogger(logging.getLogger("stdout"), logging.INFO)
-sys.stderr = StreamToLogger(logging.getLogger("stderr"), logging.ERROR)
-setup_logging()
+_initialized = False
+
+def init_runtime():
+    """
+    建資料夾、設定 logging、把 stdout / stderr 導到 logger
+    import 的時候不會做這些，請在程式進入點 (main.py、各個 CLI) 呼叫一次，重複呼叫沒關係
+    """
+    global _initialized
+    if _initialized:
+        return
+    _initialized = True
+
+    DATA_DIR.mkdir(exist_ok=True)
+    log_dir.mkdir(exist_ok=True)
+    sys.stdout = StreamToLogger(logging.getLogger("stdout"), logging.INFO)
+    sys.stderr = StreamToLogger(logging.getLogger("stderr"), logging.ERROR)
+    setup_logging()
 
 def update_status(status_str: str):
     from .status import Status
@@ -146,4 +265,16 @@ def safe_filename(filename: str, replacement="_") -> str:
         filename = "unnamed_file" + str(unname_file_idx)
         unname_file_idx += 1
         
-    return filename[:255]
\ No newline at end of file
+    return filename[:255]
+
+def post_key(post_url: str) -> tuple[int, int] | None:
+    """C.php?bsn=60076&snA=123&tnum=5 -> (60076, 123)，解析不到回傳 None"""
+    query = parse_qs(urlparse(post_url).query)
+    try:
+        return int(query['bsn'][0]), int(query['snA'][0])
+    except (KeyError, ValueError):
+        return None
+
+def canonical_post_url(bsn: int | str, snA: int | str) -> str:
+    """同一篇貼文的 tnum 等參數會變，用 (bsn, snA) 組出固定的網址"""
+    return f'https://forum.gamer.com.tw/C.php?bsn={bsn}&snA={snA}'
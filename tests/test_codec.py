@@ -0,0 +1,140 @@
+'''
+FLOORS_CODEC=zstd: pack_floors / unpack_floors 的 header (b'FZ' + 版本 + 字典 id)、TEXT 的舊列、找不到的字典、重壓 (migrate)
+沒有 zstd (Python 3.14 的 compression.zstd 或 zstandard) 的話跳過；資料庫放在暫存資料夾，不用連網路
+
+    python -m pytest tests/test_codec.py
+    python -m tests.test_codec
+'''
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+
+import orjson
+import pytest
+
+from src.append_to_db import client, codec
+from src.append_to_db.func import add_to_post_info, get_post_info
+
+FLOORS = orjson.dumps([{
+    'index': index,
+    'author': {'name': f'user{index}', 'id': f'user{index}', 'url': f'https://home.gamer.com.tw/homeindex.php?owner=user{index}'},
+    'time': f'2024-03-05T1{index}:07:33+00:00',
+    'content': '推' * index,
+    'like_count': index,
+    'dislike_count': 0,
+    'comments': [],
+} for index in range(5)]).decode()
+
+
+def _post_url(snA: int) -> str:
+    return f'https://forum.gamer.com.tw/C.php?bsn=60076&snA={snA}'
+
+
+def _skip_without_zstd():
+    if not codec.HAS_ZSTD:
+        pytest.skip('zstd is not available')
+
+
+@contextmanager
+def _codec(name: str):
+    saved = codec.FLOORS_CODEC, codec._CURRENT, dict(codec._CODECS)
+    codec.FLOORS_CODEC, codec._CURRENT = name, None
+    codec._CODECS.clear()
+    try:
+        yield
+    finally:
+        codec.FLOORS_CODEC, codec._CURRENT = saved[:2]
+        codec._CODECS.clear()
+        codec._CODECS.update(saved[2])
+
+
+@asynccontextmanager
+async def _database(directory: str):
+    saved = client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS
+    client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = os.path.join(directory, 'data.db'), 'blob', 0
+    try:
+        await client.init_tables()
+        yield await client.get_client()
+    finally:
+        await client.close_client()
+        client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = saved
+
+
+def test_text_fallback():
+    # FLOORS_CODEC=text (預設) 不壓，讀的時候 TEXT / 沒有 header 的 BLOB 都當 JSON
+    with _codec('text'):
+        assert codec.pack_floors(FLOORS) is FLOORS
+        assert asyncio.run(codec.unpack_floors(FLOORS)) is FLOORS
+        assert asyncio.run(codec.unpack_floors(FLOORS.encode())) == FLOORS.encode()
+        assert asyncio.run(codec.unpack_floors(None)) is None
+
+
+def test_round_trip_without_dict():
+    _skip_without_zstd()
+    with _codec('zstd'):
+        packed = codec.pack_floors(FLOORS)
+        assert isinstance(packed, bytes)
+        assert codec._HEADER.unpack_from(packed) == (b'FZ', 1, 0)
+        assert len(packed) < len(FLOORS.encode())
+        assert asyncio.run(codec.unpack_floors(packed)) == FLOORS.encode()
+        # str / bytes 壓出來一樣
+        assert codec.pack_floors(FLOORS.encode()) == packed
+
+
+def test_bad_header():
+    _skip_without_zstd()
+    with _codec('zstd'):
+        packed = codec.pack_floors(FLOORS)
+        unknown_version = codec._HEADER.pack(b'FZ', 2, 0) + packed[codec._HEADER.size:]
+        with pytest.raises(ValueError, match='version'):
+            asyncio.run(codec.unpack_floors(unknown_version))
+
+    async def unknown_dict(directory):
+        # 字典 id 在 floors_dicts 裡找不到
+        async with _database(directory):
+            with _codec('zstd'):
+                await codec.unpack_floors(codec._HEADER.pack(b'FZ', 1, 999) + packed[codec._HEADER.size:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        with pytest.raises(ValueError, match='999'):
+            asyncio.run(unknown_dict(directory))
+
+
+def test_train_and_migrate():
+    # 先用 text 存 (舊的列)，換成 zstd 之後 migrate 訓練字典、全部重壓，讀出來要一樣
+    _skip_without_zstd()
+    posts = codec.FLOORS_DICT_MIN_SAMPLES + 20
+
+    async def run(directory):
+        with _codec('text'):
+            async with _database(directory):
+                for snA in range(posts):
+                    await add_to_post_info(_post_url(snA), f'title {snA}', FLOORS.replace('推', f'推{snA}'))
+        with _codec('zstd'):
+            async with _database(directory) as db:
+                count = await codec.migrate(batch_size=50, pause=0)
+                again = await codec.migrate(batch_size=50, pause=0) # 都壓過了
+                rows = await db.execute_fetchall("SELECT floors FROM post_info")
+                headers = {codec._HEADER.unpack_from(value) for (value,) in rows}
+                floors = [(await get_post_info(_post_url(snA)))['floors'] for snA in range(posts)]
+            # 新開的 process: 字典要從 floors_dicts 讀回來
+            codec._CODECS.clear()
+            codec._CURRENT = None
+            async with _database(directory):
+                reloaded = (await get_post_info(_post_url(0)))['floors']
+        return count, again, headers, floors, reloaded
+
+    with tempfile.TemporaryDirectory() as directory:
+        count, again, headers, floors, reloaded = asyncio.run(run(directory))
+    assert (count, again) == (posts, 0)
+    assert len(headers) == 1 and headers.pop()[2] != 0 # 全部用新訓練的字典
+    assert [orjson.loads(value) for value in floors] == [orjson.loads(FLOORS.replace('推', f'推{snA}')) for snA in range(posts)]
+    assert orjson.loads(reloaded) == orjson.loads(FLOORS.replace('推', '推0'))
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
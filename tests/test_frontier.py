@@ -0,0 +1,187 @@
+'''
+PostFrontier (去重 / 放大 hash 表) 跟 BloomFilter (存檔讀回來、不會漏、超過 capacity 會重建)
+seen.bloom 的部分用暫存資料夾的資料庫，不用連網路
+
+    python -m pytest tests/test_frontier.py
+    python -m tests.test_frontier
+'''
+import asyncio
+import math
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from src import frontier
+from src.append_to_db import client
+from src.frontier import BloomFilter, PostFrontier, pack_key, unpack_key
+from src.records import PostListing
+from src.utils import canonical_post_url
+
+
+def test_pack_key():
+    for bsn, snA in [(1, 0), (60076, 8_000_000), (80000, 0xFFFFFFFF)]:
+        assert unpack_key(pack_key(bsn, snA)) == (bsn, snA)
+    # 只差在 bsn 的不能撞在一起
+    assert pack_key(1, 5) != pack_key(2, 5)
+
+
+def test_frontier_dedup_and_grow():
+    posts = PostFrontier()
+    keys = [pack_key(bsn, snA) for bsn in (60076, 60077) for snA in range(1000)] # 會放大好幾次
+    for key in keys:
+        assert posts.add(key)
+    for key in keys:
+        assert not posts.add(key) # 重複的不算
+    assert len(posts) == len(keys)
+    assert all(key in posts for key in keys)
+    assert pack_key(60078, 1) not in posts
+    # 照第一次看到的順序
+    assert [url for url, _ in posts.items()] == [canonical_post_url(*unpack_key(key)) for key in keys]
+
+
+def test_frontier_listing():
+    posts = PostFrontier()
+    key = pack_key(60076, 1)
+    url = canonical_post_url(60076, 1)
+    posts.add(key)
+    assert list(posts.items()) == [(url, None)] # 列表外的連結什麼都不知道
+
+    # 有列表資訊的蓋掉沒有的，之後再看到沒資訊的連結不會蓋回去
+    posts.add(key, PostListing(url=url + '&tnum=3', reply_count=3, gp=0, last_reply='2024-03-05 13:30'))
+    posts.add(key)
+    assert list(posts.items()) == [(url, PostListing(url=url, reply_count=3, gp=0, last_reply='2024-03-05 13:30'))]
+
+    # 只有日期的 (很久以前的) 跟不知道的欄位
+    posts.add(key, PostListing(url=url, reply_count=None, gp=12, last_reply='2019-01-02'))
+    assert list(posts.rows('60076')) == [(url, '60076', None, 12, '2019-01-02')]
+
+
+def test_bloom_round_trip():
+    bloom = BloomFilter(1000)
+    keys = [pack_key(60076, snA) for snA in range(0, 2000, 2)]
+    for key in keys:
+        bloom.add(key)
+    loaded = BloomFilter.from_bytes(bloom.to_bytes())
+    assert (loaded.size, loaded.hashes, loaded.capacity, loaded.count) == (bloom.size, bloom.hashes, 1000, bloom.count)
+    assert all(key in loaded for key in keys) # 不會漏
+    # 誤判率大概是 1% (給很寬的範圍)
+    false_positives = sum(pack_key(60076, snA) in loaded for snA in range(1, 20000, 2))
+    assert false_positives < 300
+
+
+def test_bloom_count_and_full():
+    bloom = BloomFilter(10)
+    assert bloom.add(pack_key(1, 1))
+    assert not bloom.add(pack_key(1, 1)) # 已經有了
+    assert bloom.count == 1 and not bloom.full
+    for snA in range(2, 30):
+        bloom.add(pack_key(1, snA))
+    assert bloom.full
+
+
+def test_bloom_old_file():
+    # BLM1 (沒有 capacity / count) 的檔案還讀得進來，count 用 bit 數估
+    bloom = BloomFilter(1000)
+    for snA in range(500):
+        bloom.add(pack_key(60076, snA))
+    old = BloomFilter._HEADER_V1.pack(b'BLM1', bloom.size, bloom.hashes) + bytes(bloom.bits)
+    loaded = BloomFilter.from_bytes(old)
+    assert all(pack_key(60076, snA) in loaded for snA in range(500))
+    assert math.isclose(loaded.capacity, 1000, rel_tol=0.05)
+    assert math.isclose(loaded.count, 500, rel_tol=0.05)
+
+    try:
+        BloomFilter.from_bytes(b'NOPE' + bytes(32))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('should raise')
+
+
+@asynccontextmanager
+async def _seen(directory: str, capacity: int, posts: int):
+    # post_info 先放 posts 篇，SEEN_BLOOM=1、SEEN_BLOOM_CAPACITY=capacity
+    saved_db = client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS
+    saved_seen = frontier.SEEN_BLOOM, frontier.SEEN_BLOOM_CAPACITY, frontier.SEEN_PATH, frontier.SEEN
+    client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = os.path.join(directory, 'data.db'), 'blob', 0
+    frontier.SEEN_BLOOM, frontier.SEEN_BLOOM_CAPACITY, frontier.SEEN_PATH, frontier.SEEN = True, capacity, Path(directory) / 'seen.bloom', None
+    try:
+        await client.init_tables()
+        db = await client.get_client()
+        async with client.writing(db):
+            await db.executemany(
+                "INSERT INTO post_info (url, title, floors) VALUES (?, '', '[]')",
+                [(canonical_post_url(60076, snA),) for snA in range(posts)],
+            )
+            await db.commit()
+        yield db
+    finally:
+        await client.close_client()
+        client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = saved_db
+        frontier.SEEN_BLOOM, frontier.SEEN_BLOOM_CAPACITY, frontier.SEEN_PATH, frontier.SEEN = saved_seen
+
+
+def test_seen_built_larger_than_capacity():
+    # post_info 本來就比 SEEN_BLOOM_CAPACITY 多: 直接建大一點的，不然一開始就一直誤判
+    async def run(directory):
+        async with _seen(directory, capacity=10, posts=100):
+            bloom = await frontier.load_seen()
+            return bloom.capacity, bloom.count, all(pack_key(60076, snA) in bloom for snA in range(100))
+
+    with tempfile.TemporaryDirectory() as directory:
+        capacity, count, complete = asyncio.run(run(directory))
+    assert capacity >= count >= 90 and complete
+
+
+def test_seen_grows_past_capacity():
+    async def run(directory):
+        async with _seen(directory, capacity=50, posts=40) as db:
+            bloom = await frontier.load_seen()
+            assert bloom.capacity == 50
+
+            # 爬到新的貼文: 先存進 post_info 再 mark_seen，超過 capacity 就在背景重建
+            async with client.writing(db):
+                await db.executemany(
+                    "INSERT INTO post_info (url, title, floors) VALUES (?, '', '[]')",
+                    [(canonical_post_url(60077, snA),) for snA in range(40)],
+                )
+                await db.commit()
+            for snA in range(40):
+                frontier.mark_seen(pack_key(60077, snA))
+            assert frontier._GROW_TASK is not None
+            await frontier._GROW_TASK
+
+            grown = frontier.SEEN
+            await frontier.flush_seen()
+            saved = BloomFilter.from_bytes(frontier.SEEN_PATH.read_bytes())
+            return grown, saved
+
+    with tempfile.TemporaryDirectory() as directory:
+        grown, saved = asyncio.run(run(directory))
+    assert grown.capacity == 100 and not grown.full
+    assert (saved.capacity, saved.count) == (grown.capacity, grown.count)
+    assert all(pack_key(bsn, snA) in saved for bsn in (60076, 60077) for snA in range(40))
+
+
+def test_seen_reloads_full_file():
+    # 上次存的已經超過 capacity 了: 讀的時候重建一個兩倍大的
+    async def run(directory):
+        full = BloomFilter(20)
+        for snA in range(60):
+            full.add(pack_key(60076, snA))
+        (Path(directory) / 'seen.bloom').write_bytes(full.to_bytes())
+        async with _seen(directory, capacity=20, posts=60):
+            return await frontier.load_seen()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bloom = asyncio.run(run(directory))
+    assert not bloom.full and bloom.capacity >= 60
+    assert all(pack_key(60076, snA) in bloom for snA in range(60))
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
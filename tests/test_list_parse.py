@@ -0,0 +1,75 @@
+'''
+B.php 列表上的欄位: parse_list_time (今日 / 昨日 / 沒有年份的日期)、_list_int ('爆'、'-')、PostListing.same_as
+不用連網路
+
+    python -m pytest tests/test_list_parse.py
+'''
+from datetime import datetime, timezone
+
+import pytest
+
+from src.parser import _list_int, parse_list_time
+from src.records import PostListing
+
+NOW = datetime(2024, 3, 5, 4, 0, tzinfo=timezone.utc) # 台灣時間 2024-03-05 12:00
+AFTER_MIDNIGHT = datetime(2024, 3, 4, 17, 0, tzinfo=timezone.utc) # UTC 還是前一天，台灣已經 2024-03-05 01:00
+NEW_YEAR = datetime(2023, 12, 31, 16, 30, tzinfo=timezone.utc) # 台灣時間 2024-01-01 00:30
+
+
+@pytest.mark.parametrize('now, text, expected', [
+    (NOW, '今日 19:12', '2024-03-05 19:12'),
+    (NOW, '昨日 9:05', '2024-03-04 09:05'),
+    (NOW, '\n  今日 00:01 \n', '2024-03-05 00:01'),
+    (AFTER_MIDNIGHT, '今日 00:30', '2024-03-05 00:30'), # 用台灣的日期，不是 UTC 的
+    (AFTER_MIDNIGHT, '昨日 23:59', '2024-03-04 23:59'),
+    (NEW_YEAR, '昨日 23:00', '2023-12-31 23:00'),
+    # 沒有年份: 比今天晚的是去年的
+    (NOW, '3/5', '2024-03-05'),
+    (NOW, '3/6', '2023-03-06'),
+    (NOW, '10/12', '2023-10-12'),
+    (NOW, '1/2 8:30', '2024-01-02 08:30'),
+    (NEW_YEAR, '12/31', '2023-12-31'),
+    # 有年份的照寫
+    (NOW, '2023/10/12', '2023-10-12'),
+    (NOW, '2025/1/2 08:30', '2025-01-02 08:30'),
+    # 看不懂的
+    (NOW, '', None),
+    (NOW, '剛剛', None),
+])
+def test_parse_list_time(now, text, expected):
+    assert parse_list_time(text, now) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    (None, None), # 列表上沒有這個欄位
+    ('', 0),
+    ('-', 0),
+    (' 12 ', 12),
+    ('1,234', 1234),
+    ('爆', 1000), # 跟樓層的讚數一樣
+    (' 爆\n', 1000),
+    ('X', None),
+    ('1.2萬', None),
+])
+def test_list_int(text, expected):
+    assert _list_int(text) == expected
+
+
+@pytest.mark.parametrize('listing, reply_count, last_reply, expected', [
+    ((3, '2024-03-05 13:30'), 3, '2024-03-05 13:30', True),
+    # 過幾天之後列表上只剩日期，比前面一樣長的部分就好
+    ((3, '2024-03-05'), 3, '2024-03-05 13:30', True),
+    ((3, '2024-03-05 13:30'), 3, '2024-03-05', True),
+    ((3, '2024-03-06'), 3, '2024-03-05 13:30', False),
+    ((3, '2024-03-05 13:31'), 3, '2024-03-05 13:30', False),
+    ((4, '2024-03-05 13:30'), 3, '2024-03-05 13:30', False), # 有人回覆
+    # 不知道的都當作有變
+    ((None, '2024-03-05 13:30'), 3, '2024-03-05 13:30', False),
+    ((3, None), 3, '2024-03-05 13:30', False),
+    ((3, '2024-03-05 13:30'), None, '2024-03-05 13:30', False),
+    ((3, '2024-03-05 13:30'), 3, None, False),
+])
+def test_same_as(listing, reply_count, last_reply, expected):
+    listing_reply_count, listing_last_reply = listing
+    row = PostListing(url='C.php?bsn=60076&snA=1', reply_count=listing_reply_count, gp=0, last_reply=listing_last_reply)
+    assert row.same_as(reply_count, last_reply) is expected
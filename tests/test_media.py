@@ -0,0 +1,160 @@
+'''
+MEDIA_CACHE=1: media_refs 重抓同一篇時整篇換掉、fetch_media 的 200 / 304 (帶 ETag 問) / 失敗 / 太大
+HTTP 用 httpx.MockTransport，資料庫跟 data/media 放在暫存資料夾，不用連網路
+
+    python -m pytest tests/test_media.py
+    python -m tests.test_media
+'''
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+
+from src import media, utils
+from src.append_to_db import client
+from src.records import Author, Comment, Floor, Post
+
+POST_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=1&tnum=3'
+CANONICAL_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=1'
+AVATAR = 'https://avatar2.bahamut.com.tw/avataruserpic/bob_s.png'
+IMAGE = 'https://truth.bahamut.com.tw/s01/image.JPG'
+
+
+def _post(floors: list[tuple[str, int]]) -> Post:
+    # 每樓: (內文, 幾則 bob 的留言)
+    return Post('哈啦板', '標題', POST_URL, [
+        Floor(index, {}, Author('愛麗絲', 'alice', 'https://home.gamer.com.tw/homeindex.php?owner=alice'),
+              '2024-03-05T10:07:33+00:00', content, 0, 0, [
+                  Comment(AVATAR, 'https://home.gamer.com.tw/bob', '鮑伯', '推', f'B{i}', '2024-03-05T13:30:01+00:00')
+                  for i in range(comments)
+              ])
+        for index, (content, comments) in enumerate(floors)
+    ])
+
+
+class _Server:
+    '''圖片伺服器: ETag 一樣的回 304，requests 記下每次收到的 If-None-Match'''
+    def __init__(self):
+        self.status = 200
+        self.body = b'IMAGE' * 100
+        self.etag = '"v1"'
+        self.requests: list[str | None] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request.headers.get('If-None-Match'))
+        if self.status != 200:
+            return httpx.Response(self.status)
+        if request.headers.get('If-None-Match') == self.etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=self.body, headers={'ETag': self.etag, 'Content-Type': 'image/jpeg'})
+
+
+@asynccontextmanager
+async def _media(directory: str, server: _Server):
+    saved = client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS, media.MEDIA_DIR, utils.HttpxClient
+    client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = os.path.join(directory, 'data.db'), 'blob', 0
+    media.MEDIA_DIR = Path(directory) / 'media'
+    utils.HttpxClient = httpx.AsyncClient(transport=httpx.MockTransport(server))
+    try:
+        await client.init_tables()
+        yield await client.get_client()
+    finally:
+        await media.close()
+        await utils.HttpxClient.aclose()
+        await client.close_client()
+        client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS, media.MEDIA_DIR, utils.HttpxClient = saved
+
+
+async def _media_row(db, url: str) -> tuple:
+    (row,) = await db.execute_fetchall("SELECT sha256, size, etag, status, not_modified, checked_at FROM media WHERE url = ?", (url,))
+    return tuple(row)
+
+
+def test_media_refs_replaced():
+    async def run(directory):
+        async with _media(directory, _Server()) as db:
+            refs = lambda: db.execute_fetchall("SELECT post_url, media_url, count FROM media_refs ORDER BY media_url")
+            await media.collect(_post([(f'![]({IMAGE})', 2), ('沒有圖', 1)]))
+            await media.drain()
+            first = await refs()
+            # 重抓同一篇 (留言被刪、圖片拿掉了): 整篇換掉，不會越加越多
+            await media.collect(_post([('沒有圖', 1)]))
+            await media.collect(_post([('沒有圖', 1)]))
+            second = await refs()
+            return first, second
+
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = asyncio.run(run(directory))
+    assert first == [(CANONICAL_URL, AVATAR, 3), (CANONICAL_URL, IMAGE, 1)]
+    assert second == [(CANONICAL_URL, AVATAR, 1)]
+
+
+def test_fetch_media_conditional():
+    server = _Server()
+
+    async def run(directory):
+        async with _media(directory, server) as db:
+            await db.execute("INSERT INTO media (url) VALUES (?)", (IMAGE,))
+            await db.commit()
+
+            await media.fetch_media(IMAGE) # 第一次: 沒有 If-None-Match，200 存檔
+            fetched = await _media_row(db, IMAGE)
+            await media.fetch_media(IMAGE) # 有舊的檔案: 帶 ETag 問，304
+            not_modified = await _media_row(db, IMAGE)
+
+            # 檔案不見了就不能只問有沒有變，要整個重抓
+            media.object_path(fetched[0]).unlink()
+            await media.fetch_media(IMAGE)
+            refetched = await _media_row(db, IMAGE)
+            return fetched, not_modified, refetched, media.object_path(fetched[0]).read_bytes()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fetched, not_modified, refetched, stored = asyncio.run(run(directory))
+    assert server.requests == [None, '"v1"', None]
+    assert stored == server.body
+    digest, size, etag, status, count, checked_at = fetched
+    assert (size, etag, status, count) == (len(server.body), '"v1"', 200, 0) and checked_at
+    assert not_modified[:5] == (digest, size, etag, 304, 1)
+    assert refetched[:5] == (digest, size, etag, 200, 1)
+
+
+def test_fetch_media_errors():
+    # 失敗的跟太大的都記 checked_at (不會一直重試)，之前存的 sha256 不動
+    server = _Server()
+
+    async def run(directory):
+        async with _media(directory, server) as db:
+            await db.executemany("INSERT INTO media (url) VALUES (?)", [(IMAGE,), (AVATAR,)])
+            await db.commit()
+
+            await media.fetch_media(IMAGE)
+            server.status = 500
+            await media.fetch_media(IMAGE)
+            failed = await _media_row(db, IMAGE)
+
+            server.status = 200
+            saved = media.MEDIA_MAX_BYTES
+            media.MEDIA_MAX_BYTES = len(server.body) - 1
+            try:
+                await media.fetch_media(AVATAR)
+            finally:
+                media.MEDIA_MAX_BYTES = saved
+            too_large = await _media_row(db, AVATAR)
+            return failed, too_large, await media.media_stats()
+
+    with tempfile.TemporaryDirectory() as directory:
+        failed, too_large, stats = asyncio.run(run(directory))
+    digest, size, _, status, _, checked_at = failed
+    assert digest is not None and size == len(server.body) and status == 500 and checked_at
+    assert too_large[0] is None and too_large[3] is None and too_large[5]
+    assert (stats['urls'], stats['fetched'], stats['objects']) == (2, 1, 1)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
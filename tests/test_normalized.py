@@ -0,0 +1,187 @@
+'''
+DB_LAYOUT=normalized: write_floors 拆開存，read_floors 組回來要跟原本的 floors 一模一樣 (連 JSON 的 bytes 都一樣)
+用記憶體裡的 SQLite，不用連網路
+
+    python -m pytest tests/test_normalized.py
+    python -m tests.test_normalized
+'''
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiosqlite
+import orjson
+
+from src.append_to_db import client
+from src.append_to_db.func import add_to_post_info, get_post_info
+from src.append_to_db.normalized import init_normalized_tables, migrate, read_floors, write_floors
+from src.parser import parse_post
+
+POST_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=1'
+OTHER_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=2'
+
+
+def _comment(user: str, name: str, text: str, floor: str, avatar: str | None = None) -> dict:
+    return {
+        'avatar_url': avatar or f'https://avatar2.bahamut.com.tw/avataruserpic/{user}_s.png',
+        'user_url': f'https://home.gamer.com.tw/{user}',
+        'user_name': name,
+        'comment_text': text,
+        'floor': floor,
+        'time': '2024-03-05T13:30:01+00:00',
+    }
+
+
+def _floor(index: int, user: str, name: str, comments: list[dict], **extra) -> dict:
+    floor = {
+        'index': index,
+        'tags': {},
+        'author': {'name': name, 'id': user, 'url': f'https://home.gamer.com.tw/homeindex.php?owner={user}'},
+        'time': f'2024-03-05T1{index}:07:33+00:00',
+        'content': f'第 {index} 樓',
+        'like_count': index,
+        'dislike_count': 0,
+        'comments': comments,
+    }
+    floor.update(extra)
+    return floor
+
+
+# 同一個人當樓主又留言 (第一次看到時沒有頭貼)、中途改暱稱、換頭貼、有 tag、沒有留言
+SAMPLE = [
+    _floor(0, 'alice', '愛麗絲', [
+        _comment('bob', '鮑伯', '推', 'B1'),
+        _comment('alice', '愛麗絲', '樓主自己回', 'B2'),
+        _comment('bob', '鮑伯改名了', '再推', 'B3'),
+    ], tags={'情報': 'B.php?bsn=60076&subbsn=5'}),
+    _floor(1, 'bob', '鮑伯', []),
+    _floor(2, 'carol', '卡蘿', [
+        _comment('bob', '鮑伯', '換頭貼', 'B1', avatar='https://avatar2.bahamut.com.tw/avataruserpic/bob_new.png'),
+    ], like_count=1000, dislike_count=1000),
+]
+
+# CONTENT_MODE=html 的 floors 是 content_html (位置跟 content 一樣，見 records.HtmlFloor)
+SAMPLE_HTML = [
+    {('content_html' if k == 'content' else k): (f'<div>{v}</div>' if k == 'content' else v) for k, v in floor.items()}
+    for floor in SAMPLE
+]
+
+
+async def _round_trip(posts: list[tuple[str, list[dict]]]) -> list[list[dict] | None]:
+    async with aiosqlite.connect(':memory:') as db:
+        await init_normalized_tables(db)
+        for url, floors in posts:
+            await write_floors(db, url, floors)
+        await db.commit()
+        return [await read_floors(db, url) for url, _ in posts]
+
+
+def _assert_same(actual, expected):
+    assert actual == expected
+    # 匯出的 JSONL 直接用 read_floors 的結果，key 的順序也要一樣
+    assert orjson.dumps(actual) == orjson.dumps(expected)
+
+
+def test_round_trip():
+    (floors,) = asyncio.run(_round_trip([(POST_URL, SAMPLE)]))
+    _assert_same(floors, SAMPLE)
+
+
+def test_round_trip_html_and_shared_users():
+    # 兩篇貼文共用 users，同一篇寫第二次會整篇換掉
+    rewritten = SAMPLE[:2]
+    first, second, again = asyncio.run(_round_trip([(POST_URL, SAMPLE), (OTHER_URL, SAMPLE_HTML), (POST_URL, rewritten)]))
+    _assert_same(second, SAMPLE_HTML)
+    _assert_same(again, rewritten)
+    _assert_same(first, rewritten) # 讀的時候已經是重寫後的
+
+
+def test_round_trip_parsed_fixture():
+    # 爬蟲實際存進去的就是 parse_post 的結果
+    html = (Path(__file__).parent / 'fixtures' / 'C.html').read_text(encoding='utf-8')
+    for mode in ('markdown', 'html'):
+        floors = orjson.loads(parse_post(html, POST_URL, '哈啦板', mode).encode_floors())
+        (actual,) = asyncio.run(_round_trip([(POST_URL, floors)]))
+        _assert_same(actual, floors)
+
+
+def test_missing_post():
+    async def read_missing():
+        async with aiosqlite.connect(':memory:') as db:
+            await init_normalized_tables(db)
+            return await read_floors(db, POST_URL)
+
+    assert asyncio.run(read_missing()) is None
+
+
+def test_rollback_forgets_users():
+    # rollback 掉的 users.id 還留在快取的話，下一篇會指到不存在的 user，read_floors 的 JOIN 就少掉那幾樓
+    async def run():
+        async with aiosqlite.connect(':memory:') as db:
+            await init_normalized_tables(db)
+            try:
+                async with client.writing(db):
+                    await write_floors(db, POST_URL, SAMPLE)
+                    raise RuntimeError('寫到一半出錯')
+            except RuntimeError:
+                pass
+            async with client.writing(db):
+                await write_floors(db, OTHER_URL, SAMPLE)
+                await db.commit()
+            return await read_floors(db, POST_URL), await read_floors(db, OTHER_URL)
+
+    rolled_back, floors = asyncio.run(run())
+    assert rolled_back is None
+    _assert_same(floors, SAMPLE)
+
+
+@asynccontextmanager
+async def _database(layout: str, directory: str):
+    # 真的走 add_to_post_info / get_post_info，資料庫放在暫存資料夾
+    saved = client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS
+    client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = os.path.join(directory, 'data.db'), layout, 0
+    try:
+        await client.init_tables()
+        yield
+    finally:
+        await client.close_client()
+        client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = saved
+
+
+def test_empty_floors_stay_cached():
+    # 沒有樓層的貼文 read_floors 是 None，post_info.floors 要留記號，不然每次都當成沒存過
+    async def run(directory):
+        async with _database('normalized', directory):
+            await add_to_post_info(POST_URL, '沒有樓層', '[]')
+            await add_to_post_info(OTHER_URL, '有樓層', orjson.dumps(SAMPLE).decode())
+            return await get_post_info(POST_URL), await get_post_info(OTHER_URL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        empty, full = asyncio.run(run(directory))
+    assert empty is not None and orjson.loads(empty['floors']) == []
+    assert orjson.loads(full['floors']) == SAMPLE
+
+
+def test_migrate_empty_floors():
+    async def run(directory):
+        async with _database('blob', directory):
+            await add_to_post_info(POST_URL, '沒有樓層', '[]')
+            await add_to_post_info(OTHER_URL, '有樓層', orjson.dumps(SAMPLE).decode())
+        async with _database('normalized', directory):
+            first = await migrate(batch_size=1, vacuum=False)
+            again = await migrate(batch_size=1, vacuum=False) # 重跑不會再搬 ('[]' 的也不會一直搬)
+            return first, again, await get_post_info(POST_URL), await get_post_info(OTHER_URL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        first, again, empty, full = asyncio.run(run(directory))
+    assert (first, again) == (1, 0) # '[]' 本來就是記號，只有一篇要搬
+    assert empty is not None and orjson.loads(empty['floors']) == []
+    assert orjson.loads(full['floors']) == SAMPLE
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
@@ -0,0 +1,157 @@
+'''
+啟動時的 _rekey_posts: 以前帶 tnum 存的列要合併成 canonical_post_url，同一篇留 updated_at 最新的
+資料庫放在暫存資料夾，不用連網路
+
+    python -m pytest tests/test_rekey.py
+    python -m tests.test_rekey
+'''
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+import orjson
+
+from src.append_to_db import client
+from src.append_to_db.normalized import read_floors, write_floors
+
+BASE = 'https://forum.gamer.com.tw/C.php?bsn={bsn}&snA={snA}'
+
+
+def _floors(content: str) -> list[dict]:
+    return [{
+        'index': 0, 'tags': {}, 'author': {'name': '愛麗絲', 'id': 'alice', 'url': 'https://home.gamer.com.tw/homeindex.php?owner=alice'},
+        'time': '2024-03-05T10:07:33+00:00', 'content': content, 'like_count': 0, 'dislike_count': 0, 'comments': [],
+    }]
+
+
+def _seed(bsn: int) -> list[tuple[str, str, str]]:
+    # (網址, updated_at, 內容)
+    # snA=1: canonical 比較舊、帶 tnum 的比較新 -> 留 tnum 的內容，網址改成 canonical
+    # snA=2: 只有帶 tnum 的兩列 -> 留新的那列
+    # snA=3: canonical 最新 -> 帶 tnum 的直接刪掉
+    # snA=4: 本來就是 canonical，不用動
+    return [
+        (BASE.format(bsn=bsn, snA=1), '2024-01-01 00:00:00', 'snA=1 舊的'),
+        (BASE.format(bsn=bsn, snA=1) + '&tnum=9', '2024-06-01 00:00:00', 'snA=1 新的'),
+        (BASE.format(bsn=bsn, snA=2) + '&tnum=3', '2024-01-01 00:00:00', 'snA=2 舊的'),
+        (BASE.format(bsn=bsn, snA=2) + '&tnum=5', '2024-06-01 00:00:00', 'snA=2 新的'),
+        (BASE.format(bsn=bsn, snA=3), '2024-06-01 00:00:00', 'snA=3 新的'),
+        (BASE.format(bsn=bsn, snA=3) + '&tnum=1', '2024-01-01 00:00:00', 'snA=3 舊的'),
+        (BASE.format(bsn=bsn, snA=4), '2024-01-01 00:00:00', 'snA=4'),
+    ]
+
+
+EXPECTED = {1: 'snA=1 新的', 2: 'snA=2 新的', 3: 'snA=3 新的', 4: 'snA=4'}
+
+
+@asynccontextmanager
+async def _database(layout: str, shards: int, directory: str):
+    saved = client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS
+    client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = os.path.join(directory, 'data.db'), layout, shards
+    try:
+        await client.init_tables()
+        yield
+    finally:
+        await client.close_client()
+        client.DB_PATH, client.DB_LAYOUT, client.DB_SHARDS = saved
+
+
+async def _insert(db, layout: str, bsn: int):
+    async with client.writing(db):
+        for url, updated_at, content in _seed(bsn):
+            floors = _floors(content)
+            if layout == 'normalized':
+                await write_floors(db, url, floors)
+                stored = None
+            else:
+                stored = orjson.dumps(floors).decode()
+            await db.execute(
+                "INSERT INTO post_info (url, title, floors, updated_at) VALUES (?, ?, ?, ?)",
+                (url, content, stored, updated_at),
+            )
+            await db.execute(
+                "INSERT INTO all_posts (post_url, bsn, updated_at) VALUES (?, ?, ?)",
+                (url, str(bsn), updated_at),
+            )
+        await db.commit()
+
+
+async def _check(db, layout: str, bsn: int):
+    assert await client._rekey_posts(db) == 4 # 帶 tnum 的 4 列都改掉了
+    assert await client._rekey_posts(db) == 0 # 再跑一次沒事做
+
+    rows = await db.execute_fetchall("SELECT url, title, floors FROM post_info ORDER BY url")
+    assert [(url, title) for url, title, _ in rows] == [(BASE.format(bsn=bsn, snA=snA), content) for snA, content in EXPECTED.items()]
+    posts = await db.execute_fetchall("SELECT post_url, updated_at FROM all_posts ORDER BY post_url")
+    assert [url for url, _ in posts] == [BASE.format(bsn=bsn, snA=snA) for snA in EXPECTED]
+    assert all(updated_at == '2024-06-01 00:00:00' for url, updated_at in posts if not url.endswith('snA=4'))
+
+    for snA, content in EXPECTED.items():
+        url = BASE.format(bsn=bsn, snA=snA)
+        if layout == 'normalized':
+            floors = await read_floors(db, url)
+        else:
+            floors = orjson.loads(dict((row[0], row[2]) for row in rows)[url])
+        assert floors == _floors(content)
+    if layout == 'normalized':
+        # 被刪掉的那幾列的樓層也要跟著刪
+        assert await db.execute_fetchall("SELECT COUNT(*), COUNT(DISTINCT post_url) FROM floors") == [(4, 4)]
+
+
+def _run(layout: str, shards: int):
+    async def run(directory):
+        async with _database(layout, shards, directory):
+            boards = [60076, 60077] if shards else [60076]
+            for bsn in boards:
+                await _insert(await client.get_client(client.shard_of(bsn)), layout, bsn)
+            for bsn in boards:
+                await _check(await client.get_client(client.shard_of(bsn)), layout, bsn)
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(directory))
+
+
+def test_rekey_blob():
+    _run('blob', 0)
+
+
+def test_rekey_normalized_shards():
+    _run('normalized', 2)
+
+
+def test_rekey_rolls_back():
+    # 搬到一半出錯的話整個 shard 都不動，下次啟動再搬
+    async def run(directory):
+        async with _database('blob', 0, directory):
+            db = await client.get_client()
+            await _insert(db, 'blob', 60076)
+            execute = db.executemany
+
+            async def broken(sql, *args):
+                if sql.startswith('UPDATE'):
+                    raise RuntimeError('搬到一半出錯')
+                return await execute(sql, *args)
+
+            db.executemany = broken
+            try:
+                await client._rekey_posts(db)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError('should raise')
+            finally:
+                del db.executemany
+            return await db.execute_fetchall("SELECT COUNT(*) FROM post_info"), await client._rekey_posts(db)
+
+    with tempfile.TemporaryDirectory() as directory:
+        before, changed = asyncio.run(run(directory))
+    assert before == [(7,)]
+    assert changed == 4
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
@@ -0,0 +1,68 @@
+'''
+CONTENT_MODE=html 的 render_markdown: MARKDOWN_OPTIONS 改了不會拿到舊的結果、data/md_cache 有上限
+data/md_cache 放在暫存資料夾，不用連網路
+
+    python -m pytest tests/test_render.py
+    python -m tests.test_render
+'''
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from src import render
+
+HTML = '<div><b>粗體</b> 跟 <a href="https://forum.gamer.com.tw/">連結</a></div>'
+
+
+@contextmanager
+def _cache(max_bytes: int):
+    saved = render.MD_CACHE_DIR, render.MD_CACHE_MAX_BYTES, render.MARKDOWN_OPTIONS, render._cache_bytes
+    with tempfile.TemporaryDirectory() as directory:
+        render.MD_CACHE_DIR, render.MD_CACHE_MAX_BYTES, render.MARKDOWN_OPTIONS = Path(directory), max_bytes, {}
+        render._cache_bytes = None
+        render._render_markdown.cache_clear()
+        try:
+            yield Path(directory)
+        finally:
+            render.MD_CACHE_DIR, render.MD_CACHE_MAX_BYTES, render.MARKDOWN_OPTIONS, render._cache_bytes = saved
+            render._render_markdown.cache_clear()
+
+
+def test_options_change_key():
+    with _cache(1 << 20) as directory:
+        assert render.render_markdown(HTML) == '**粗體** 跟 [連結](https://forum.gamer.com.tw/)'
+        render.MARKDOWN_OPTIONS = {'strong_em_symbol': '_'}
+        assert render.render_markdown(HTML) == '__粗體__ 跟 [連結](https://forum.gamer.com.tw/)'
+        assert len(list(directory.glob('*/*.md'))) == 2
+
+        # LRU 清掉之後從檔案讀回來也一樣
+        render._render_markdown.cache_clear()
+        assert render.render_markdown(HTML) == '__粗體__ 跟 [連結](https://forum.gamer.com.tw/)'
+
+
+def test_disk_memo_bounded():
+    size = len('內文 0'.encode())
+    with _cache(size * 10) as directory:
+        for i in range(30):
+            render.render_markdown(f'<p>內文 {i}</p>')
+            # mtime 的精度不一定夠，手動拉開 (都比現在早，剛寫的還是最新的)
+            for path in directory.glob('*/*.md'):
+                if path.read_text(encoding='utf-8') == f'內文 {i}':
+                    os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        texts = {path.read_text(encoding='utf-8') for path in directory.glob('*/*.md')}
+        assert sum(len(text.encode()) for text in texts) <= size * 10
+        assert '內文 29' in texts # 最新的留著
+        assert '內文 0' not in texts
+
+    with _cache(0) as directory:
+        assert render.render_markdown(HTML)
+        assert not list(directory.glob('*/*'))
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
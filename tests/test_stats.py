@@ -0,0 +1,66 @@
+'''
+統計全部重算: numpy 的版本 (_aggregate_numpy) 要跟純 Python 的 (_aggregate_python) 一模一樣
+不用連網路、不用資料庫
+
+    python -m pytest tests/test_stats.py
+'''
+import random
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+
+from src.append_to_db import stats
+
+
+def _posts(count: int, years: int) -> list[tuple[str, str, list[dict], str]]:
+    # 發文時間散在好幾年裡 (天數很多，但每篇只會碰到幾天)
+    random.seed(0)
+    start = datetime(2014, 1, 1, tzinfo=timezone.utc)
+    posts = []
+    for snA in range(count):
+        post_time = start + timedelta(seconds=random.randrange(years * 365 * 86400))
+        floors = []
+        for index in range(random.randint(0, 4)): # 0 樓的 (解析失敗之類) 要略過
+            floor_time = post_time + timedelta(hours=random.randrange(72))
+            floors.append({
+                'index': index,
+                'time': floor_time.isoformat(),
+                'like_count': random.choice((0, 1, 3, 12, 80, 700, 1000)),
+                'dislike_count': random.randrange(3),
+                'comments': [
+                    {
+                        'user_url': f'https://home.gamer.com.tw/user{random.randrange(50)}',
+                        'time': (floor_time + timedelta(hours=random.randrange(48))).isoformat(),
+                    }
+                    for _ in range(random.randrange(4))
+                ],
+            })
+        posts.append((f'https://forum.gamer.com.tw/C.php?bsn=60076&snA={snA}', f'title {snA}', floors, ''))
+    return posts
+
+
+@pytest.mark.parametrize('count, years', [(0, 1), (1, 1), (300, 10)])
+def test_numpy_matches_python(count, years):
+    pytest.importorskip('numpy')
+    posts = _posts(count, years)
+    expected_posts, expected_daily = stats._aggregate_python(60076, posts)
+    actual_posts, actual_daily = stats._aggregate_numpy(60076, posts)
+
+    # contrib 讀的時候是 dict，天的順序不用一樣
+    decode = lambda rows: [(*row[:-1], orjson.loads(row[-1])) for row in rows]
+    assert decode(actual_posts) == decode(expected_posts)
+    assert sorted(actual_daily, key=lambda row: row[1]) == sorted(expected_daily, key=lambda row: row[1])
+
+
+def test_contribution_from_parsed_post():
+    # 爬蟲直接丟 Post.floors 進來 (不再 orjson.loads)，結果要跟從資料庫讀出來的 dict 一樣
+    from src.parser import parse_post
+
+    html = (Path(__file__).parent / 'fixtures' / 'C.html').read_text(encoding='utf-8')
+    for mode in ('markdown', 'html'):
+        post = parse_post(html, 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=1', '哈啦板', mode)
+        contrib, commenters = stats.post_contribution(post.floors)
+        assert (contrib, commenters) == stats.post_contribution(orjson.loads(post.encode_floors()))
+        assert sum(vector[2] for vector in contrib.values()) == 3 # 重複的留言只算一次
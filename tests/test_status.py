@@ -0,0 +1,46 @@
+'''
+Status 的版本號 / change_log: count_post 也要讓 SSE 知道、同一個看板連續的變動合併成一筆之後 changes_since 還是對的
+不用連網路
+
+    python -m pytest tests/test_status.py
+    python -m tests.test_status
+'''
+from src.status import ListState, _Status
+
+
+def test_count_post_bumps():
+    status = _Status()
+    status.register('60076', '哈啦板')
+    version = status.version
+    status.count_post('60076', 'posts')
+    status.count_post('60076', 'failed')
+    assert status.version == version + 2
+    changed, global_changed = status.changes_since(version)
+    assert list(changed) == ['60076'] and not global_changed
+    assert (changed['60076'].posts, changed['60076'].failed) == (1, 1)
+
+
+def test_change_log_coalesces():
+    status = _Status()
+    status.register('1', 'A')
+    status.register('2', 'B')
+    seen_b = status.version
+    for _ in range(1000):
+        status.count_post('1', 'cached')
+    assert len(status._change_log) == 3 # 1 的一千次合併成一筆
+    after_a = status.version
+    assert list(status.changes_since(seen_b + 500)[0]) == ['1'] # 看到一半的也拿得到
+
+    status.set_list_state('2', ListState.FETCHING)
+    status.curr_status = 'running'
+    assert set(status.changes_since(seen_b)[0]) == {'1', '2'}
+    assert status.changes_since(seen_b)[1]
+    assert set(status.changes_since(after_a)[0]) == {'2'}
+    assert status.changes_since(status.version) == ({}, False)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')
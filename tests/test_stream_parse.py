@@ -0,0 +1,65 @@
+'''
+串流解析 (src/stream_parse.py) 跟整頁解析 (src/parser.py) 的結果要一模一樣
+用 tests/fixtures/ 裡存下來的 B.php / C.php，不用連網路
+
+    python -m pytest tests/test_stream_parse.py
+    python -m tests.test_stream_parse
+'''
+from pathlib import Path
+
+from src.parser import parse_post, parse_post_list
+from src.stream_parse import PostStreamParser, PostListStreamParser
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+POST_URL = 'https://forum.gamer.com.tw/C.php?bsn=60076&snA=8812345'
+
+# 一次全部 / 切很碎 (tag、entity 會被切在中間) / 差不多是網路上一塊的大小
+CHUNK_SIZES = (None, 1, 7, 4096)
+
+
+def _chunks(text: str, size: int | None):
+    if size is None:
+        yield text
+        return
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def _stream(sink, text: str, size: int | None):
+    for chunk in _chunks(text, size):
+        sink.feed(chunk)
+    return sink.close()
+
+
+def test_post_stream_matches_parse_post():
+    html = (FIXTURES / 'C.html').read_text(encoding='utf-8')
+    for mode in ('markdown', 'html'):
+        expected = parse_post(html, POST_URL, '哈啦板', mode)
+        assert len(expected.floors) == 3
+        for size in CHUNK_SIZES:
+            sink = PostStreamParser(POST_URL, '哈啦板', mode)
+            assert _stream(sink, html, size) == expected, (mode, size)
+
+
+def test_post_stream_reset_between_retries():
+    # 重試的時候會先 reset，前一次讀到一半的不能留著
+    html = (FIXTURES / 'C.html').read_text(encoding='utf-8')
+    sink = PostStreamParser(POST_URL, '哈啦板')
+    sink.feed(html[:len(html) // 2])
+    sink.reset()
+    assert _stream(sink, html, 4096) == parse_post(html, POST_URL, '哈啦板')
+
+
+def test_post_list_stream_matches_parse_post_list():
+    html = (FIXTURES / 'B.html').read_text(encoding='utf-8')
+    expected = parse_post_list(html)
+    assert len(expected[1]) == 4 # 廣告那一列沒有 C.php 連結
+    for size in CHUNK_SIZES:
+        assert _stream(PostListStreamParser(), html, size) == expected, size
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} ok')